@@ -3,6 +3,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from bot.utils.keyboards import Keyboards
 from bot.utils.states import WAITING_EXTRACT_PATTERN
+from bot.messages.patterns import validate_pattern
 
 class ConfigHandlers:
     def __init__(self, bot_instance):
@@ -68,6 +69,15 @@ class ConfigHandlers:
         pattern = update.message.text.strip()
         user_id = update.effective_user.id
         
+        # Kiểm tra pattern trước khi lưu để tránh regex lỗi hoặc gây treo bot
+        error = validate_pattern(pattern)
+        if error:
+            await update.message.reply_text(
+                f"❌ **Pattern không hợp lệ!**\n\n{error}\n\n✏️ Vui lòng nhập lại pattern khác.",
+                parse_mode='Markdown'
+            )
+            return WAITING_EXTRACT_PATTERN
+        
         if user_id not in self.temp_data:
             self.temp_data[user_id] = {}
         
@@ -147,6 +157,7 @@ Hãy tạo cấu hình mới bằng cách chọn "Cấu hình Copy Channel" ở
    • Thêm text đầu/cuối tin nhắn
    • Button với link tùy chỉnh
    • Hỗ trợ hình ảnh, video, file
+   • Copy tin nhắn cũ với `/backfill <config_id> <số ngày>`
 
 **📱 Các lệnh hữu ích:**
    • `/start` - Mở menu chính
@@ -157,7 +168,7 @@ Hãy tạo cấu hình mới bằng cách chọn "Cấu hình Copy Channel" ở
 **⚠️ Lưu ý:**
    • Cần quyền admin hoặc member của channel nguồn
    • Cần quyền gửi tin nhắn ở channel đích
-   • Bot chỉ copy tin nhắn mới, không copy tin nhắn cũ
+   • Bot tự động copy tin nhắn mới; tin nhắn cũ chỉ được copy khi chạy `/backfill`
    • Nếu gặp lỗi session, thử `/recover` trước khi đăng nhập lại
         """
         
@@ -16,7 +16,10 @@ from bot.utils.handlers import BotHandlers
 from bot.auth.handlers import AuthHandlers
 from bot.config.handlers import ConfigHandlers
 from bot.channels.manager import ChannelManager
-from bot.messages.processor import MessageProcessor
+from bot.messages.processor import MessageProcessor, OVERFLOW_POLICIES
+from bot.messages.send_modes import SEND_MODES
+from bot.utils.metrics import metrics, MetricsServer
+from bot.messages.latency import format_duration
 from bot.utils.states import *
 
 # Load environment variables
@@ -41,18 +44,57 @@ class TelegramBot:
         
         self.bot_instance = None  # Will be set during initialization
         
+        # HTTP server cho /metrics, /healthz, /readyz (chỉ nghe trên localhost)
+        self.metrics_server = None
+        if os.getenv('METRICS_ENABLED', 'True').lower() == 'true':
+            self.metrics_server = MetricsServer(metrics, self.is_ready)
+        
         # Tạo thư mục sessions nếu chưa có
         os.makedirs("sessions", exist_ok=True)
         
     async def init_async(self):
         """Khởi tạo các thành phần async sau khi event loop được tạo"""
-        await self.restore_user_sessions()
-        # Start message processing task
+        self.register_metrics()
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                print(f"⚠️ Could not start metrics server: {e}")
+        # Processor (và outbox) phải chạy trước khi khôi phục sessions: handler live và copy bù
+        # bắt đầu đưa message vào queue ngay khi session được khôi phục
         await self.message_processor.init_async()
+        await self.restore_user_sessions()
+        # Chạy tiếp các job backfill dang dở (cần sessions đã được khôi phục)
+        await self.message_processor.backfill.resume()
         
         # Start background session monitoring
         asyncio.create_task(self.monitor_sessions())
         
+    def is_ready(self) -> bool:
+        """Sẵn sàng khi bot đã khởi tạo và mọi worker của message processor đang chạy"""
+        workers = self.message_processor.worker_tasks
+        return bool(self.bot_instance and workers and not any(task.done() for task in workers))
+    
+    def register_metrics(self):
+        """Đăng ký các gauge được tính lúc scrape từ trạng thái hiện tại"""
+        processor = self.message_processor
+        metrics.gauge('bot_queue_depth', 'Messages waiting in each worker shard', ('shard',),
+                      lambda: {(stats['shard'],): stats['queue_depth'] for stats in processor.get_stats()})
+        metrics.gauge('bot_deferred_messages', 'Messages deferred behind a rate-limited chat', (),
+                      lambda: {(): processor.get_rate_limit_stats()['deferred_messages']})
+        metrics.gauge('bot_retry_pending', 'Messages waiting for a retry', (),
+                      lambda: {(): len(processor.retry_scheduler.heap)})
+        metrics.gauge('bot_user_clients', 'User clients by connection state', ('state',),
+                      lambda: {
+                          ('connected',): sum(1 for client in self.user_clients.values()
+                                              if client.client and client.client.is_connected),
+                          ('total',): len(self.user_clients)
+                      })
+        metrics.gauge('bot_active_configs', 'Configs currently copying, per user', ('user_id',),
+                      lambda: {(user_id,): len(client.active_configs) for user_id, client in self.user_clients.items()})
+        metrics.gauge('bot_peer_cache_entries', 'Cached peers per user client', ('user_id',),
+                      lambda: {(user_id,): len(client.peer_cache) for user_id, client in self.user_clients.items()})
+    
     async def monitor_sessions(self):
         """Background task để monitor và maintain sessions"""
         while True:
@@ -116,11 +158,13 @@ class TelegramBot:
                 # Restore active configs
                 await self.restore_active_configs(user_id)
                 self.session_recovery_attempts[user_id] = 0  # Reset on success
+                metrics.session_recoveries.inc('success')
                 return True
                 
         except Exception as e:
             print(f"❌ Session recovery failed for user {user_id}: {e}")
             
+        metrics.session_recoveries.inc('failure')
         return False
         
     async def restore_user_sessions(self):
@@ -163,6 +207,7 @@ class TelegramBot:
                             print(f"⚠️ Could not update auth status for user {user_id}: {auth_update_error}")
                         
                         restored_count += 1
+                        metrics.session_restores.inc('success')
                         print(f"✅ Khôi phục session cho user {user_data['first_name']} ({user_id})")
                         
                         # Khôi phục các active configs (message handlers) với delay
@@ -178,6 +223,7 @@ class TelegramBot:
                     failed_users.append(user_data)
             
             print(f"🎉 Đã khôi phục {restored_count}/{len(authenticated_users)} sessions thành công!")
+            metrics.session_restores.inc('failure', amount=len(failed_users))
             
             # Retry failed users với delay
             if failed_users:
@@ -230,6 +276,7 @@ class TelegramBot:
                     print(f"⚠️ Could not update auth status: {auth_update_error}")
                 
                 print(f"✅ Retry successful for user {user_id}")
+                metrics.session_restores.inc('retry_success')
                 await self.restore_active_configs(user_id)
                 return True
             else:
@@ -263,27 +310,34 @@ class TelegramBot:
                 print(f"❌ No client found for user {user_id}")
                 return
             
-            # Đăng ký lại message handlers cho configs đã active
-            active_count = 0
-            for config in configs:
-                try:
-                    success = await client.start_copying(config)
-                    if success:
-                        active_count += 1
-                        print(f"✅ Khôi phục copying: {config['source_channel_name']} -> {config['target_channel_name']}")
-                    else:
-                        print(f"❌ Không thể khôi phục config {config['id']} cho user {user_id}")
-                        # Đánh dấu config là không active nếu không thể khôi phục
+            # Message live đến trong lúc khôi phục được giữ lại cho tới khi copy bù xong
+            client.hold_live_updates()
+            try:
+                # Đăng ký lại message handlers cho configs đã active
+                active_count = 0
+                for config in configs:
+                    try:
+                        success = await client.start_copying(config)
+                        if success:
+                            active_count += 1
+                            print(f"✅ Khôi phục copying: {config['source_channel_name']} -> {config['target_channel_name']}")
+                        else:
+                            print(f"❌ Không thể khôi phục config {config['id']} cho user {user_id}")
+                            # Đánh dấu config là không active nếu không thể khôi phục
+                            self.db.update_config_status(config['id'], user_id, False)
+                    except Exception as e:
+                        print(f"❌ Lỗi khôi phục config {config['id']}: {e}")
+                        # Đánh dấu config là không active nếu có lỗi
                         self.db.update_config_status(config['id'], user_id, False)
-                except Exception as e:
-                    print(f"❌ Lỗi khôi phục config {config['id']}: {e}")
-                    # Đánh dấu config là không active nếu có lỗi
-                    self.db.update_config_status(config['id'], user_id, False)
-            
-            if active_count > 0:
-                print(f"🚀 Đã khôi phục {active_count}/{len(configs)} configs cho user {user_id}")
-            else:
-                print(f"⚠️ Không thể khôi phục config nào cho user {user_id}")
+                
+                if active_count > 0:
+                    print(f"🚀 Đã khôi phục {active_count}/{len(configs)} configs cho user {user_id}")
+                else:
+                    print(f"⚠️ Không thể khôi phục config nào cho user {user_id}")
+            finally:
+                # Copy bù các message nguồn đăng trong lúc mất kết nối/restart (chạy nền); luôn chạy
+                # kể cả khi khôi phục lỗi giữa chừng để các message live đang giữ được nhả ra
+                await client.catch_up()
                 
         except Exception as e:
             print(f"❌ Lỗi khôi phục active configs cho user {user_id}: {e}")
@@ -639,7 +693,61 @@ Nhấn vào các nút bên dưới để thiết lập!
                     debug_text += f"\n... và {len(all_configs) - 3} config khác"
             else:
                 debug_text += "\n❌ Không có config nào"
-            
+
+            # Thống kê worker pool của message processor
+            debug_text += "\n\n⚙️ **Message Workers:**"
+            for worker in self.message_processor.get_stats():
+                debug_text += (
+                    f"\n• Worker {worker['shard']}: queue {worker['queue_depth']} "
+                    f"(text {worker['lanes']['text']}/light {worker['lanes']['light']}/heavy {worker['lanes']['heavy']}), "
+                    f"processed {worker['processed']}, busy {worker['utilisation'] * 100:.1f}%"
+                )
+            rate_stats = self.message_processor.get_rate_limit_stats()
+            debug_text += (
+                f"\n• Rate limit: {rate_stats['parked_chats']} chat bị flood-wait, "
+                f"{rate_stats['deferred_messages']} tin nhắn đang chờ gửi "
+                f"({rate_stats['flood_waits']} flood-wait)"
+            )
+            retry_stats = self.message_processor.retry_scheduler.get_stats()
+            debug_text += (
+                f"\n• Retry: {retry_stats['pending']} đang chờ, {retry_stats['resubmitted']} đã gửi lại, "
+                f"{self.db.count_dead_letters(user_id)} dead letter (`/replay_dead_letters`)"
+            )
+            relay_stats = self.message_processor.media_relay.stats
+            debug_text += (
+                f"\n• Media relay: {relay_stats['relayed']} file "
+                f"({relay_stats['bytes'] / (1024 * 1024):.1f} MB), {relay_stats['active']} đang chạy, "
+                f"{relay_stats['skipped']} bỏ qua"
+            )
+            file_cache_stats = self.message_processor.file_id_cache.stats
+            debug_text += (
+                f"\n• File ID cache: {file_cache_stats['hits']} hit, {file_cache_stats['misses']} miss, "
+                f"{file_cache_stats['invalidated']} hết hạn"
+            )
+            media_cache_stats = self.message_processor.media_relay.media_cache.get_stats()
+            debug_text += (
+                f"\n• Media cache: {media_cache_stats['files']} file "
+                f"({media_cache_stats['bytes'] / (1024 * 1024):.1f} MB), "
+                f"hit rate {media_cache_stats['hit_rate']:.1%}, "
+                f"tiết kiệm {media_cache_stats['bytes_saved'] / (1024 * 1024):.1f} MB"
+            )
+            transfer_stats = self.message_processor.media_relay.transfer_engine.get_stats()
+            if transfer_stats['last']:
+                debug_text += (
+                    f"\n• Transfer: {transfer_stats['transfers']} file, "
+                    f"trung bình {transfer_stats['average_throughput'] / (1024 * 1024):.1f} MB/s, "
+                    f"gần nhất {transfer_stats['last']['throughput'] / (1024 * 1024):.1f} MB/s "
+                    f"({transfer_stats['last']['parts']} part, {transfer_stats['part_retries']} lần thử lại)"
+                )
+            for config_id, shed in self.message_processor.get_shed_stats().items():
+                shed_text = ", ".join(f"{reason.replace('_', ' ')} {count}" for reason, count in shed.items())
+                debug_text += f"\n• Shed config {config_id}: {shed_text}"
+            for config_id, dedupe in self.message_processor.duplicate_filter.get_stats().items():
+                debug_text += (
+                    f"\n• Dedupe config {config_id}: {dedupe['hits']}/{dedupe['checked']} "
+                    f"trùng ({dedupe['hit_rate'] * 100:.1f}%)"
+                )
+
             # Add specific troubleshooting for peer ID issues
             debug_text += f"""
 
@@ -653,6 +761,11 @@ Nhấn vào các nút bên dưới để thiết lập!
 • `/test_channels` - Test tất cả channel access
 • `/recover` - Khôi phục session
 • `/status` - Kiểm tra trạng thái chi tiết
+• `/queue_policy` - Chính sách khi queue đầy
+• `/send_mode` - Copy qua tài khoản hoặc gửi qua bot
+• `/replay_dead_letters` - Gửi lại tin nhắn lỗi
+• `/backfill` - Copy tin nhắn cũ
+• `/latency` - Độ trễ theo giai đoạn
 
 💡 **Quick Fix:**
 1. Dùng `/test_channels` để tìm channels có vấn đề
@@ -1043,6 +1156,185 @@ Nhấn vào các nút bên dưới để thiết lập!
                 parse_mode='Markdown'
             )
     
+    async def set_queue_policy(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Đặt chính sách xử lý khi queue đầy cho một config: /queue_policy <config_id> <policy>"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        valid_policies = OVERFLOW_POLICIES + ('default',)
+        
+        if len(args) != 2 or not args[0].isdigit() or args[1] not in valid_policies:
+            await update.message.reply_text(
+                "❌ **Cú pháp:** `/queue_policy <config_id> <policy>`\n\n"
+                "📋 **Policy:**\n"
+                "• `block` - Chờ đến khi queue còn chỗ\n"
+                "• `drop_oldest` - Bỏ tin nhắn cũ nhất khi queue đầy\n"
+                "• `drop_by_age` - Bỏ tin nhắn chờ quá lâu (TTL)\n"
+                "• `degrade` - Khi quá tải chỉ gửi phần text\n"
+                "• `default` - Dùng mặc định của hệ thống",
+                parse_mode='Markdown'
+            )
+            return
+        
+        config_id = int(args[0])
+        policy = None if args[1] == 'default' else args[1]
+        if self.db.update_config_overflow_policy(config_id, user_id, policy):
+            await update.message.reply_text(
+                f"✅ Config {config_id} dùng policy `{args[1]}`",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text(f"❌ Không tìm thấy config {config_id}")
+    
+    async def set_send_mode(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Đặt cách gửi tin nhắn cho một config: /send_mode <config_id> <mode>"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        valid_modes = SEND_MODES + ('default',)
+        
+        if len(args) != 2 or not args[0].isdigit() or args[1] not in valid_modes:
+            await update.message.reply_text(
+                "❌ **Cú pháp:** `/send_mode <config_id> <mode>`\n\n"
+                "📋 **Mode:**\n"
+                "• `auto` - Copy qua tài khoản của bạn nếu có quyền đăng vào channel đích\n"
+                "• `copy` - Luôn copy qua tài khoản của bạn (không có inline button)\n"
+                "• `bot` - Luôn gửi lại qua bot\n"
+                "• `forward` - Gom tin nhắn và forward nguyên bản (chỉ khi không có pattern/header/footer/button)\n"
+                "• `default` - Dùng mặc định của hệ thống",
+                parse_mode='Markdown'
+            )
+            return
+        
+        config_id = int(args[0])
+        send_mode = None if args[1] == 'default' else args[1]
+        if self.db.update_config_send_mode(config_id, user_id, send_mode):
+            await update.message.reply_text(
+                f"✅ Config {config_id} dùng send mode `{args[1]}`",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text(f"❌ Không tìm thấy config {config_id}")
+    
+    async def replay_dead_letters(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Gửi lại các message đã hết lượt retry: /replay_dead_letters [config_id]"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        
+        if len(args) > 1 or (args and not args[0].isdigit()):
+            await update.message.reply_text(
+                "❌ **Cú pháp:** `/replay_dead_letters [config_id]`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        config_id = int(args[0]) if args else None
+        replayed = await self.message_processor.replay_dead_letters(user_id, config_id)
+        if replayed:
+            await update.message.reply_text(f"🔁 Đã đưa {replayed} tin nhắn lỗi trở lại hàng đợi")
+        else:
+            await update.message.reply_text("✅ Không có tin nhắn lỗi nào cần gửi lại")
+    
+    async def backfill(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Copy tin nhắn cũ của một config: /backfill <config_id> <days>, /backfill <config_id> stop, /backfill"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        backfill = self.message_processor.backfill
+        
+        if not args:
+            jobs = backfill.get_status(user_id)
+            if not jobs:
+                await update.message.reply_text("ℹ️ Chưa có job backfill nào")
+                return
+            lines = [
+                f"• Config {job['config_id']}: {job['status']}, {job['copied']} tin nhắn, "
+                f"đến #{job['last_id']}/{job['end_id']}"
+                for job in jobs
+            ]
+            await update.message.reply_text("⏪ **Backfill:**\n" + "\n".join(lines), parse_mode='Markdown')
+            return
+        
+        if (len(args) != 2 or not args[0].isdigit()
+                or not (args[1] == 'stop' or (args[1].isdigit() and 1 <= int(args[1]) <= backfill.max_days))):
+            await update.message.reply_text(
+                "❌ **Cú pháp:**\n"
+                f"• `/backfill <config_id> <days>` - Copy tin nhắn của tối đa {backfill.max_days} ngày gần nhất\n"
+                "• `/backfill <config_id> stop` - Dừng backfill\n"
+                "• `/backfill` - Xem tiến độ",
+                parse_mode='Markdown'
+            )
+            return
+        
+        config_id = int(args[0])
+        config = self.db.get_config_by_id(config_id, user_id)
+        if not config:
+            await update.message.reply_text(f"❌ Không tìm thấy config {config_id}")
+            return
+        
+        if args[1] == 'stop':
+            if await backfill.cancel(config_id):
+                await update.message.reply_text(f"⏹️ Đã dừng backfill của config {config_id}")
+            else:
+                await update.message.reply_text(f"ℹ️ Config {config_id} không có backfill đang chạy")
+            return
+        
+        await self.get_or_restore_client(user_id)
+        if await backfill.start(config, int(args[1])):
+            await update.message.reply_text(
+                f"⏪ Bắt đầu copy tin nhắn {args[1]} ngày gần nhất cho config {config_id}. "
+                "Tiến độ được lưu lại, bot khởi động lại sẽ chạy tiếp."
+            )
+        else:
+            await update.message.reply_text("❌ Tài khoản chưa kết nối, hãy thử `/recover`", parse_mode='Markdown')
+    
+    async def latency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Độ trễ theo giai đoạn: /latency [config_id], /latency <config_id> trace <n>"""
+        user_id = update.effective_user.id
+        args = context.args or []
+        tracker = self.message_processor.latency
+        
+        if (len(args) not in (0, 1, 3) or (args and not args[0].isdigit())
+                or (len(args) == 3 and (args[1] != 'trace' or not args[2].isdigit()))):
+            await update.message.reply_text(
+                "❌ **Cú pháp:**\n"
+                "• `/latency` - p50/p95/p99 của các config\n"
+                "• `/latency <config_id>` - Chỉ một config\n"
+                "• `/latency <config_id> trace <n>` - Log đầy đủ các mốc của n tin nhắn tiếp theo (0 để tắt)",
+                parse_mode='Markdown'
+            )
+            return
+        
+        if args:
+            config = self.db.get_config_by_id(int(args[0]), user_id)
+            if not config:
+                await update.message.reply_text(f"❌ Không tìm thấy config {args[0]}")
+                return
+            configs = [config]
+        else:
+            configs = self.db.get_all_user_configs(user_id)
+        
+        if len(args) == 3:
+            tracker.trace(configs[0]['id'], int(args[2]))
+            await update.message.reply_text(
+                f"⏱️ Trace {args[2]} tin nhắn tiếp theo của config {args[0]} (xem trong log)"
+                if int(args[2]) else f"⏱️ Đã tắt trace của config {args[0]}"
+            )
+            return
+        
+        lines = []
+        for config in configs:
+            stages = tracker.summary(config['id'])
+            if not stages:
+                continue
+            lines.append(f"\n⚙️ **Config {config['id']}** ({max(stage['count'] for stage in stages)} tin nhắn)")
+            for stage in stages:
+                lines.append(
+                    f"• {stage['stage']}: p50 {format_duration(stage['p50'])}, "
+                    f"p95 {format_duration(stage['p95'])}, p99 {format_duration(stage['p99'])}"
+                )
+        if not lines:
+            await update.message.reply_text("ℹ️ Chưa có số liệu độ trễ (cần có tin nhắn được gửi sau khi bot khởi động)")
+            return
+        await update.message.reply_text("⏱️ **Độ trễ theo giai đoạn**" + "\n".join(lines), parse_mode='Markdown')
+    
     def run(self):
         """Chạy bot"""
         application = Application.builder().token(self.bot_token).build()
@@ -1090,6 +1382,11 @@ Nhấn vào các nút bên dưới để thiết lập!
         application.add_handler(CommandHandler("test_channels", self.test_channels))
         application.add_handler(CommandHandler("sync_auth", self.sync_auth_status))
         application.add_handler(CommandHandler("force_session_check", self.force_session_check))
+        application.add_handler(CommandHandler("queue_policy", self.set_queue_policy))
+        application.add_handler(CommandHandler("send_mode", self.set_send_mode))
+        application.add_handler(CommandHandler("replay_dead_letters", self.replay_dead_letters))
+        application.add_handler(CommandHandler("backfill", self.backfill))
+        application.add_handler(CommandHandler("latency", self.latency))
         application.add_handler(CallbackQueryHandler(button_handler))
         
         # Khởi tạo async sau khi application được tạo
@@ -1099,6 +1396,8 @@ Nhấn vào các nút bên dưới để thiết lập!
         # Cleanup function
         async def post_shutdown(app):
             await self.message_processor.shutdown()
+            if self.metrics_server:
+                await self.metrics_server.close()
         
         application.post_init = post_init
         application.post_shutdown = post_shutdown
@@ -1114,5 +1413,10 @@ Nhấn vào các nút bên dưới để thiết lập!
         print("   /test_channels - Kiểm tra quyền truy cập channels")
         print("   /sync_auth - Đồng bộ authentication status")
         print("   /force_session_check - Force check và sử dụng session đã có")
+        print("   /queue_policy - Đặt chính sách khi queue đầy cho config")
+        print("   /send_mode - Chọn copy qua tài khoản user hoặc gửi qua bot cho config")
+        print("   /replay_dead_letters - Gửi lại các tin nhắn đã hết lượt retry")
+        print("   /backfill - Copy tin nhắn cũ của channel nguồn (chạy tiếp sau restart)")
+        print("   /latency - Độ trễ p50/p95/p99 theo giai đoạn, trace tin nhắn của config")
         print("📨 Message processor ready!")
         application.run_polling() 
\ No newline at end of file
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+from bot.utils.config_registry import config_registry
+from bot.messages.send_modes import uses_forward_mode, MAX_FORWARD_BATCH
+
+logger = logging.getLogger(__name__)
+
+async def newest_message_id(client, chat_id: int, before=None) -> int:
+    """Id message mới nhất của chat (hoặc mới nhất trước thời điểm before); 0 nếu không có"""
+    kwargs = {'offset_date': before} if before else {}
+    async for message in client.get_chat_history(chat_id, limit=1, **kwargs):
+        return message.id
+    return 0
+
+async def fetch_newer_messages(client, chat_id: int, after_id: int, end_id: int, limit: int = 100) -> List:
+    """Tối đa limit message có after_id < id <= end_id, sắp xếp cũ -> mới"""
+    # offset âm + offset_id lấy các message mới hơn offset_id; chunk ngắn có thể lặp nên cần lọc trùng
+    messages = {}
+    async for message in client.get_chat_history(chat_id, limit=limit, offset_id=after_id + 1, offset=-limit):
+        if after_id < message.id <= end_id:
+            messages[message.id] = message
+    return [messages[message_id] for message_id in sorted(messages)]
+
+class BackfillJob:
+    """Trạng thái của một job backfill đang chạy (checkpoint chỉ tiến khi mọi message trước đó đã xong)"""
+
+    def __init__(self, config_id: int, user_id: int, last_id: int, end_id: int, copied: int):
+        self.config_id = config_id
+        self.user_id = user_id
+        self.last_id = last_id  # Checkpoint: mọi message nguồn <= last_id đã được xử lý
+        self.end_id = end_id  # Message mới nhất lúc tạo job, phần sau đó do live copy xử lý
+        self.copied = copied
+        self.run_id = f"{config_id}:{time.time():.6f}"  # Phân biệt với message của lần chạy trước
+        self.sequence = 0
+        self.outstanding = deque()  # (seq, source id lớn nhất, số message nguồn) theo thứ tự enqueue
+        self.done = set()
+        self.drained = asyncio.Event()
+        self.task = None
+
+    def inflight(self) -> int:
+        return len(self.outstanding)
+
+    def complete(self, seq: int):
+        """Đánh dấu một item đã xong và dời checkpoint qua các item liên tiếp đã hoàn thành"""
+        self.done.add(seq)
+        while self.outstanding and self.outstanding[0][0] in self.done:
+            seq, last_id, count = self.outstanding.popleft()
+            self.done.discard(seq)
+            self.last_id = last_id
+            self.copied += count
+        self.drained.set()
+
+class BackfillManager:
+    """Copy tin nhắn cũ của channel nguồn theo thứ tự cũ -> mới qua pipeline bình thường, có giới hạn tốc độ"""
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.db = processor.db
+        self.page_size = min(100, max(20, int(os.getenv('BACKFILL_PAGE_SIZE', '100'))))
+        self.rate = float(os.getenv('BACKFILL_RATE', '1.0'))  # message nguồn mỗi giây cho mỗi job
+        self.max_inflight = max(1, int(os.getenv('BACKFILL_MAX_INFLIGHT', '10')))
+        self.max_days = int(os.getenv('BACKFILL_MAX_DAYS', '30'))
+        self.jobs: Dict[int, BackfillJob] = {}
+
+    def _user_client(self, user_id: int):
+        user_client = self.processor.bot_instance.user_clients.get(user_id)
+        if not user_client or not user_client.client or not user_client.client.is_connected:
+            return None
+        return user_client
+
+    async def start(self, config: Dict[str, Any], days: int) -> bool:
+        """Tạo job backfill cho config (thay job cũ nếu có); False nếu user client chưa sẵn sàng"""
+        user_client = self._user_client(config['user_id'])
+        if not user_client:
+            return False
+        await self.cancel(config['id'])
+
+        source_channel_id = int(config['source_channel_id'])
+        cutoff = datetime.now() - timedelta(days=days)
+        # Message mới nhất trước mốc thời gian và message mới nhất hiện tại giới hạn khoảng cần copy
+        start_id = await newest_message_id(user_client.client, source_channel_id, before=cutoff)
+        end_id = await newest_message_id(user_client.client, source_channel_id)
+
+        self.db.save_backfill_job(config['id'], config['user_id'], days, start_id, end_id)
+        self._spawn(BackfillJob(config['id'], config['user_id'], start_id, end_id, 0))
+        logger.info("⏪ Backfill started for config %s: messages %d..%d (%d days)",
+                    config['id'], start_id + 1, end_id, days)
+        return True
+
+    async def resume(self):
+        """Chạy tiếp các job còn dang dở từ lần chạy trước (gọi sau khi đã khôi phục sessions)"""
+        for row in self.db.get_backfill_jobs(status='running'):
+            if row['config_id'] in self.jobs:
+                continue
+            if not config_registry.get(row['config_id']) or not self._user_client(row['user_id']):
+                logger.warning("⚠️ Backfill for config %s not resumed: config or session unavailable", row['config_id'])
+                continue
+            self._spawn(BackfillJob(row['config_id'], row['user_id'], row['last_id'], row['end_id'], row['copied']))
+            logger.info("⏪ Backfill resumed for config %s after message %s", row['config_id'], row['last_id'])
+
+    def _spawn(self, job: BackfillJob):
+        self.jobs[job.config_id] = job
+        job.task = asyncio.create_task(self._run(job))
+
+    async def cancel(self, config_id: int, status: str = 'cancelled') -> bool:
+        """Dừng job đang chạy, lưu checkpoint và đánh dấu trạng thái"""
+        job = self.jobs.get(config_id)
+        if job:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        if job or any(row['config_id'] == config_id for row in self.db.get_backfill_jobs(status='running')):
+            self.db.update_backfill_status(config_id, status)
+            return True
+        return False
+
+    def complete(self, message_data: Dict[str, Any]):
+        """Gọi từ processor khi một message backfill đã xử lý xong"""
+        marker = message_data['backfill']
+        job = self.jobs.get(marker['config_id'])
+        if job and job.run_id == marker['run_id']:
+            job.complete(marker['seq'])
+
+    async def _run(self, job: BackfillJob):
+        try:
+            await self._copy_history(job)
+            self.db.update_backfill_progress(job.config_id, job.last_id, job.copied)
+            self.db.update_backfill_status(job.config_id, 'done')
+            logger.info("✅ Backfill finished for config %s: %d messages", job.config_id, job.copied)
+        except asyncio.CancelledError:
+            self.db.update_backfill_progress(job.config_id, job.last_id, job.copied)
+            raise
+        except Exception as e:
+            # Giữ trạng thái running để lần khởi động sau chạy tiếp từ checkpoint
+            self.db.update_backfill_progress(job.config_id, job.last_id, job.copied)
+            logger.error("❌ Backfill for config %s stopped at message %s: %s", job.config_id, job.last_id, e)
+        finally:
+            if self.jobs.get(job.config_id) is job:
+                del self.jobs[job.config_id]
+
+    async def _copy_history(self, job: BackfillJob):
+        cursor = job.last_id
+        while cursor < job.end_id:
+            config = config_registry.get(job.config_id)
+            user_client = self._user_client(job.user_id)
+            if not config or not user_client:
+                raise RuntimeError("config or user session unavailable")
+
+            messages = await fetch_newer_messages(
+                user_client.client, int(config['source_channel_id']), cursor, job.end_id, self.page_size
+            )
+            if not messages:
+                break
+
+            # Album có thể bị cắt ở cuối trang: để lại cho trang sau lấy đủ các phần
+            tail_group = messages[-1].media_group_id
+            if messages[-1].id < job.end_id and tail_group and messages[0].media_group_id != tail_group:
+                while messages[-1].media_group_id == tail_group:
+                    messages.pop()
+            cursor = messages[-1].id
+
+            for message_data, source_ids in self._build_items(user_client, config, messages):
+                await self._submit(job, message_data, source_ids)
+
+            # Đợi trang hiện tại xong rồi mới ghi checkpoint (message service/rỗng ở cuối trang cũng tính là xong)
+            while job.inflight():
+                job.drained.clear()
+                await job.drained.wait()
+            job.last_id = max(job.last_id, cursor)
+            self.db.update_backfill_progress(job.config_id, job.last_id, job.copied)
+
+    def _build_items(self, user_client, config: Dict[str, Any], messages: List):
+        """Chuyển một trang thành các item queue giống live copy (album gộp lại, config forward gom batch)"""
+        base = {
+            'user_id': config['user_id'],
+            'config_id': config['id'],
+            'source_channel_id': config['source_channel_id'],
+            'target_channel_id': config['target_channel_id']
+        }
+        converted = [user_client.convert_message_to_dict(message)
+                     for message in messages if not message.service and not message.empty]
+
+        if uses_forward_mode(config):
+            for start in range(0, len(converted), MAX_FORWARD_BATCH):
+                parts = converted[start:start + MAX_FORWARD_BATCH]
+                yield user_client.build_forward_message(base, parts), [part['message_id'] for part in parts]
+            return
+
+        index = 0
+        while index < len(converted):
+            message_dict = converted[index]
+            media_group_id = message_dict.get('media_group_id')
+            if not media_group_id:
+                index += 1
+                yield dict(base, message=message_dict), [message_dict['message_id']]
+                continue
+            parts = []
+            while index < len(converted) and converted[index].get('media_group_id') == media_group_id:
+                parts.append(converted[index])
+                index += 1
+            yield user_client.build_album_message(base, parts, media_group_id), [part['message_id'] for part in parts]
+
+    async def _submit(self, job: BackfillJob, message_data: Dict[str, Any], source_ids: List[int]):
+        """Đưa một item vào queue với tốc độ giới hạn, nhường chỗ cho live copy"""
+        processor = self.processor
+        chat_id = int(message_data['target_channel_id'])
+        queue = processor.shard_queues[processor.get_shard_index(chat_id)]
+        while (job.inflight() >= self.max_inflight
+               or queue.qsize() >= processor.queue_maxsize // 2
+               or chat_id in processor.deferred_messages):
+            job.drained.clear()
+            try:
+                await asyncio.wait_for(job.drained.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+        delay = processor.rate_limiter.chat_delay(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        job.sequence += 1
+        job.outstanding.append((job.sequence, max(source_ids), len(source_ids)))
+        message_data['backfill'] = {'config_id': job.config_id, 'run_id': job.run_id, 'seq': job.sequence}
+        await processor.add_message_to_queue(message_data)
+        if self.rate > 0:
+            await asyncio.sleep(len(source_ids) / self.rate)
+
+    def get_status(self, user_id: int) -> List[Dict[str, Any]]:
+        """Tiến độ các job của user (job đang chạy lấy số liệu trong bộ nhớ)"""
+        jobs = []
+        for row in self.db.get_backfill_jobs(user_id=user_id):
+            job = self.jobs.get(row['config_id'])
+            if job:
+                row = dict(row, last_id=job.last_id, copied=job.copied, inflight=job.inflight())
+            jobs.append(row)
+        return jobs
+
+    async def close(self):
+        """Dừng các job (trạng thái vẫn là running để chạy tiếp ở lần khởi động sau)"""
+        jobs = list(self.jobs.values())
+        for job in jobs:
+            job.task.cancel()
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
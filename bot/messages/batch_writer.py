@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class BatchedWriter:
+    """Gom các thay đổi key -> value trong bộ nhớ và ghi xuống SQLite theo batch (group commit) trong thread pool.
+
+    Lớp con cài đặt _write_batch (chạy trong thread pool với self.conn) và có thể override
+    _flushed (chạy trên event loop sau khi ghi xong) hoặc _after_flush (việc định kỳ như prune).
+    """
+
+    label = 'Batch writer'  # Tên hiển thị trong log
+
+    def __init__(self, db_path: str, batch_size: int, flush_interval: float):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.conn = None  # Chỉ dùng bởi một flush tại một thời điểm, trong thread pool
+        # Thay đổi chưa ghi theo thứ tự; batch đang ghi nằm ở flushing
+        self.pending: Dict[Hashable, Any] = {}
+        self.flushing: Dict[Hashable, Any] = {}
+        self.flush_event = None
+        self.flush_task = None
+        self.closing = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Mở connection ghi (WAL)"""
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        return self.conn
+
+    def _start_flushing(self):
+        self.flush_event = asyncio.Event()
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    def _queue_write(self, key: Hashable, value: Any):
+        self.pending[key] = value
+        # Trước start() chưa có flush task: thay đổi được giữ lại cho lần flush đầu tiên
+        if self.flush_event and len(self.pending) >= self.batch_size:
+            self.flush_event.set()
+
+    async def _flush_loop(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_event.clear()
+
+            try:
+                await self.flush()
+                await self._after_flush()
+            except Exception as e:
+                logger.warning("⚠️ %s flush failed, will retry: %s", self.label, e)
+
+    async def flush(self):
+        """Ghi tất cả thay đổi đang chờ trong một transaction"""
+        if not self.pending or not self.conn:
+            return
+
+        self.flushing, self.pending = self.pending, {}
+        changes = list(self.flushing.items())
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, self._write_batch, changes)
+        except Exception:
+            # Thay đổi mới hơn (trong pending) được ưu tiên khi trả batch lại
+            self.pending = {**self.flushing, **self.pending}
+            raise
+        finally:
+            self.flushing = {}
+        self._flushed(changes, result)
+
+    def _write_batch(self, changes: List[Tuple[Hashable, Any]]) -> Any:
+        raise NotImplementedError
+
+    def _flushed(self, changes: List[Tuple[Hashable, Any]], result: Any):
+        pass
+
+    async def _after_flush(self):
+        pass
+
+    async def close(self):
+        """Flush phần còn lại và đóng connection"""
+        # Không cancel giữa chừng một lần flush đang ghi trong thread pool
+        self.closing = True
+        if self.flush_task:
+            self.flush_event.set()
+            await self.flush_task
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("⚠️ Final %s flush failed: %s", self.label.lower(), e)
+        if self.conn:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+class KeyedBatcher:
+    """Gom các item theo key trong một cửa sổ thời gian ngắn rồi flush một lần"""
+
+    def __init__(self, flush_callback: Callable[[Hashable, List[Any]], Awaitable[None]],
+                 window: float, max_items: int, sliding: bool = True):
+        self.flush_callback = flush_callback
+        self.window = window
+        self.max_items = max_items
+        self.sliding = sliding  # True: cửa sổ tính từ item cuối, False: tính từ item đầu tiên
+        self.batches: Dict[Hashable, List[Any]] = {}
+        self.timers: Dict[Hashable, asyncio.Task] = {}
+
+    async def add(self, key: Hashable, item: Any):
+        """Thêm item vào batch; flush ngay khi batch đầy, nếu không thì khi hết cửa sổ"""
+        batch = self.batches.setdefault(key, [])
+        batch.append(item)
+
+        if len(batch) >= self.max_items:
+            await self.flush(key)
+            return
+
+        if key in self.timers and not self.sliding:
+            return
+
+        # Cửa sổ trượt được tính lại từ item cuối cùng để các phần đến chậm vẫn được gom chung
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        self.timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: Hashable):
+        await asyncio.sleep(self.window)
+        self.timers.pop(key, None)
+        try:
+            await self.flush(key)
+        except Exception as e:
+            logger.error("❌ Error flushing batch %s: %s", key, e)
+
+    async def flush(self, key: Hashable):
+        """Flush batch của một key (nếu có)"""
+        timer = self.timers.pop(key, None)
+        if timer and timer is not asyncio.current_task():
+            timer.cancel()
+
+        items = self.batches.pop(key, None)
+        if items:
+            await self.flush_callback(key, items)
+
+    async def flush_where(self, predicate: Callable[[Hashable], bool]):
+        """Flush tất cả batch có key thỏa điều kiện"""
+        for key in [key for key in self.batches if predicate(key)]:
+            await self.flush(key)
+
+    async def flush_all(self):
+        await self.flush_where(lambda key: True)
+
+    def __len__(self) -> int:
+        return len(self.batches)
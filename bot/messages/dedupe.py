@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import struct
+import time
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_FILE_MAGIC = b'DDUP1'
+
+class BloomFilter:
+    """Bloom filter cố định kích thước trên một bytearray"""
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RotatingBloomFilter:
+    """Các thế hệ bloom filter xoay vòng: một key được nhớ trong khoảng window giây"""
+
+    def __init__(self, window: float, capacity: int, error_rate: float, generations: int = 2):
+        self.generation_span = window / generations
+        self.generations = generations
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        # Mỗi thế hệ là (thời điểm bắt đầu, filter); thế hệ mới nhất ở cuối
+        self.filters: List[list] = [[time.time(), BloomFilter(self.num_bits, self.num_hashes)]]
+
+    def _rotate(self, now: float):
+        if now - self.filters[-1][0] < self.generation_span:
+            return
+        self.filters.append([now, BloomFilter(self.num_bits, self.num_hashes)])
+        del self.filters[:-self.generations]
+
+    def add(self, key: bytes):
+        self._rotate(time.time())
+        self.filters[-1][1].add(key)
+
+    def __contains__(self, key: bytes) -> bool:
+        now = time.time()
+        self._rotate(now)
+        window = self.generation_span * self.generations
+        return any(key in bloom for started, bloom in self.filters if now - started < window)
+
+    def save(self, path: str):
+        """Ghi filter ra file (ghi file tạm rồi os.replace để không hỏng file cũ)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_FILE_MAGIC)
+            f.write(struct.pack('<QII', self.num_bits, self.num_hashes, len(self.filters)))
+            for started, bloom in self.filters:
+                f.write(struct.pack('<d', started))
+                f.write(bloom.bits)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """Đọc filter đã lưu; bỏ qua nếu kích thước không khớp cấu hình hiện tại"""
+        with open(path, 'rb') as f:
+            if f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+                return False
+            num_bits, num_hashes, count = struct.unpack('<QII', f.read(16))
+            if (num_bits, num_hashes) != (self.num_bits, self.num_hashes):
+                return False
+            filters = []
+            for _ in range(count):
+                started, = struct.unpack('<d', f.read(8))
+                bits = bytearray(f.read((num_bits + 7) // 8))
+                filters.append([started, BloomFilter(num_bits, num_hashes, bits)])
+        if filters:
+            self.filters = filters[-self.generations:]
+        return True
+
+class DuplicateFilter:
+    """Chống gửi trùng theo từng channel đích: file_unique_id của media hoặc hash text đã chuẩn hóa"""
+
+    def __init__(self):
+        self.enabled = os.getenv('DEDUPE_ENABLED', 'True').lower() == 'true'
+        self.persist_path = os.getenv('DEDUPE_PERSIST_PATH', '')
+        self.seen = RotatingBloomFilter(
+            window=float(os.getenv('DEDUPE_WINDOW_SECONDS', '86400')),
+            capacity=max(1, int(os.getenv('DEDUPE_CAPACITY', '100000'))),
+            error_rate=float(os.getenv('DEDUPE_ERROR_RATE', '0.001'))
+        )
+        self.stats: Dict[int, Dict[str, int]] = {}  # config_id -> {'checked', 'hits'}
+
+        if self.enabled and self.persist_path and os.path.exists(self.persist_path):
+            try:
+                if self.seen.load(self.persist_path):
+                    logger.info("🧹 Dedupe filter loaded from %s", self.persist_path)
+            except (OSError, struct.error) as e:
+                logger.warning("⚠️ Could not load dedupe filter: %s", e)
+
+    @staticmethod
+    def message_key(target_channel_id, message: Dict[str, Any]) -> Optional[bytes]:
+        """Tạo key dedupe cho message, None nếu message không có nội dung để so sánh"""
+        parts = message.get('media_group') or [message]
+        file_ids = []
+        for part in parts:
+            for media_type in ('photo', 'video', 'document', 'audio', 'voice', 'sticker'):
+                if part.get(media_type) and part[media_type].get('file_unique_id'):
+                    file_ids.append(part[media_type]['file_unique_id'])
+                    break
+
+        if file_ids:
+            content = 'm:' + ','.join(sorted(file_ids))
+        else:
+            text = _WHITESPACE.sub(' ', message.get('text') or message.get('caption') or '').strip().lower()
+            if not text:
+                return None
+            content = 't:' + hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return f"{target_channel_id}:{content}".encode('utf-8')
+
+    def is_duplicate(self, config_id: int, key: Optional[bytes]) -> bool:
+        """Kiểm tra message đã được gửi tới channel đích trong cửa sổ dedupe chưa"""
+        if not self.enabled or key is None:
+            return False
+        stats = self.stats.setdefault(config_id, {'checked': 0, 'hits': 0})
+        stats['checked'] += 1
+        if key in self.seen:
+            stats['hits'] += 1
+            return True
+        return False
+
+    def remember(self, key: Optional[bytes]):
+        """Ghi nhận message đã gửi thành công"""
+        if self.enabled and key is not None:
+            self.seen.add(key)
+
+    def get_stats(self) -> Dict[int, Dict[str, Any]]:
+        return {
+            config_id: dict(stats, hit_rate=stats['hits'] / stats['checked'] if stats['checked'] else 0.0)
+            for config_id, stats in self.stats.items()
+        }
+
+    def save(self):
+        if self.enabled and self.persist_path:
+            try:
+                self.seen.save(self.persist_path)
+            except OSError as e:
+                logger.warning("⚠️ Could not save dedupe filter: %s", e)
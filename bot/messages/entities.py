@@ -0,0 +1,149 @@
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from telegram import MessageEntity as BotMessageEntity, User as BotUser
+from pyrogram import types as pyrogram_types
+from pyrogram.enums import MessageEntityType
+
+# Các loại entity mà Bot API nhận được (tên giống MessageEntityType của pyrogram, viết thường)
+ENTITY_TYPES = (
+    'mention', 'hashtag', 'cashtag', 'bot_command', 'url', 'email', 'phone_number',
+    'bold', 'italic', 'underline', 'strikethrough', 'spoiler', 'code', 'pre',
+    'blockquote', 'text_link', 'text_mention', 'custom_emoji'
+)
+
+# Ký tự đặc biệt của Markdown (legacy) của Bot API
+MARKDOWN_SPECIAL = ('\\', '_', '*', '`', '[')
+MARKDOWN_ENTITIES = {'*': 'bold', '_': 'italic'}
+MARKDOWN_LINK = re.compile(r'\[((?:\\.|[^\]])+)\]\(([^)\s]+)\)')
+MARKDOWN_ESCAPE = re.compile(r'\\([\\_*`\[])')
+# Nội dung của *bold*/_italic_: ký tự đã escape (ví dụ giá trị biến template) không đóng entity
+MARKDOWN_BODY = {
+    char: re.compile(r'((?:\\.|[^\\%s])+)%s' % (re.escape(char), re.escape(char)), re.S)
+    for char in MARKDOWN_ENTITIES
+}
+
+def utf16_len(text: str) -> int:
+    """Độ dài theo UTF-16 code unit - đơn vị offset/length của entity"""
+    return len(text.encode('utf-16-le')) // 2
+
+def escape_markdown(text: str) -> str:
+    for char in MARKDOWN_SPECIAL:
+        text = text.replace(char, '\\' + char)
+    return text
+
+def entities_from_pyrogram(entities) -> List[Dict[str, Any]]:
+    """Chuyển entity của pyrogram sang dict (lưu được vào outbox/JSON)"""
+    result = []
+    for entity in entities or []:
+        entity_type = entity.type.name.lower()
+        if entity_type not in ENTITY_TYPES:
+            continue
+        data = {'type': entity_type, 'offset': entity.offset, 'length': entity.length}
+        if getattr(entity, 'url', None):
+            data['url'] = entity.url
+        if getattr(entity, 'language', None):
+            data['language'] = entity.language
+        if getattr(entity, 'custom_emoji_id', None):
+            data['custom_emoji_id'] = str(entity.custom_emoji_id)
+        if getattr(entity, 'user', None):
+            data['user'] = {'id': entity.user.id, 'first_name': entity.user.first_name or ''}
+        result.append(data)
+    return result
+
+def parse_markdown(text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Parse Markdown (legacy) của header/footer thành text thuần + entities.
+
+    Ký hiệu không đóng được giữ nguyên như text thường thay vì làm lỗi cả tin nhắn.
+    """
+    output = []
+    entities = []
+    position = 0  # offset UTF-16 của output
+    i = 0
+
+    def add_entity(entity_type, body, **extra):
+        nonlocal position
+        length = utf16_len(body)
+        if length:
+            entities.append(dict({'type': entity_type, 'offset': position, 'length': length}, **extra))
+        output.append(body)
+        position += length
+
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text) and text[i + 1] in MARKDOWN_SPECIAL:
+            output.append(text[i + 1])
+            position += 1
+            i += 2
+            continue
+
+        if text.startswith('```', i):
+            end = text.find('```', i + 3)
+            if end != -1:
+                body, language = text[i + 3:end], None
+                first_line, newline, rest = body.partition('\n')
+                if newline and first_line and not first_line.isspace() and ' ' not in first_line:
+                    body, language = rest, first_line
+                add_entity('pre', body, **({'language': language} if language else {}))
+                i = end + 3
+                continue
+        elif char == '`':
+            end = text.find(char, i + 1)
+            if end > i + 1:
+                add_entity('code', text[i + 1:end])
+                i = end + 1
+                continue
+        elif char in MARKDOWN_ENTITIES:
+            match = MARKDOWN_BODY[char].match(text, i + 1)
+            if match:
+                add_entity(MARKDOWN_ENTITIES[char], MARKDOWN_ESCAPE.sub(r'\1', match.group(1)))
+                i = match.end()
+                continue
+        elif char == '[':
+            match = MARKDOWN_LINK.match(text, i)
+            if match:
+                add_entity('text_link', MARKDOWN_ESCAPE.sub(r'\1', match.group(1)), url=match.group(2))
+                i = match.end()
+                continue
+
+        output.append(char)
+        position += utf16_len(char)
+        i += 1
+
+    return ''.join(output), entities
+
+def shift_entities(entities: Optional[List[Dict[str, Any]]], offset: int) -> List[Dict[str, Any]]:
+    if not offset:
+        return list(entities or [])
+    return [dict(entity, offset=entity['offset'] + offset) for entity in entities or []]
+
+def to_bot_entities(entities: Optional[List[Dict[str, Any]]]) -> Optional[List[BotMessageEntity]]:
+    """Entity dict -> telegram.MessageEntity cho các send_* của bot"""
+    if not entities:
+        return None
+    return [
+        BotMessageEntity(
+            type=entity['type'],
+            offset=entity['offset'],
+            length=entity['length'],
+            url=entity.get('url'),
+            language=entity.get('language'),
+            custom_emoji_id=entity.get('custom_emoji_id'),
+            user=BotUser(entity['user']['id'], entity['user']['first_name'], False) if entity.get('user') else None
+        )
+        for entity in entities
+    ]
+
+def to_pyrogram_entities(entities: Optional[List[Dict[str, Any]]]) -> List[pyrogram_types.MessageEntity]:
+    """Entity dict -> pyrogram MessageEntity cho các lệnh gửi qua user client"""
+    return [
+        pyrogram_types.MessageEntity(
+            type=MessageEntityType[entity['type'].upper()],
+            offset=entity['offset'],
+            length=entity['length'],
+            url=entity.get('url'),
+            language=entity.get('language'),
+            custom_emoji_id=int(entity['custom_emoji_id']) if entity.get('custom_emoji_id') else None
+        )
+        # text_mention cần resolve user qua session, bỏ qua khi gửi bằng user client
+        for entity in entities or [] if entity['type'] != 'text_mention'
+    ]
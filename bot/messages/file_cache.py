@@ -0,0 +1,157 @@
+import asyncio
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from bot.messages.batch_writer import BatchedWriter
+
+FILE_MEDIA_TYPES = ('photo', 'video', 'document', 'audio', 'voice', 'sticker')
+
+def extract_file_id(message, media_type: str) -> Optional[str]:
+    """Lấy file_id của media trong Message trả về từ Bot API"""
+    media = getattr(message, media_type, None)
+    if media_type == 'photo' and media:
+        media = media[-1]  # PhotoSize lớn nhất
+    return getattr(media, 'file_id', None)
+
+def is_file_id_error(error: Exception) -> bool:
+    """Telegram từ chối file_id (sai, hết hạn file reference...)"""
+    message = str(error).lower()
+    return 'file' in message and any(
+        keyword in message for keyword in ('identifier', 'file_id', 'reference', 'invalid', 'expired')
+    )
+
+class FileIdCache(BatchedWriter):
+    """Ánh xạ (file_unique_id, sender) -> file_id dùng lại được, LRU trong bộ nhớ trước bảng SQLite.
+
+    Ghi/xóa được gom lại và flush theo batch trong thread pool; khi miss thì đọc DB trong thread pool
+    và cache cả kết quả "không có", nên đường gửi không chạm disk trên event loop.
+    """
+
+    label = 'File ID cache'
+
+    def __init__(self, db_path: str):
+        self.max_size = max(1, int(os.getenv('FILE_ID_CACHE_SIZE', '1024')))
+        # pending/flushing: key -> file_id cần ghi, None là cần xóa
+        super().__init__(db_path, batch_size=self.max_size,
+                         flush_interval=float(os.getenv('FILE_ID_CACHE_FLUSH_INTERVAL', '1.0')))
+        self.entries: OrderedDict = OrderedDict()  # key -> file_id, None nghĩa là đã biết không có
+        self.complete = False  # Cả bảng đang nằm trong LRU: miss không cần đọc DB
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+    def start(self):
+        """Nạp trước các file_id dùng gần đây nhất và chạy task flush"""
+        rows = self._connect().execute(
+            'SELECT file_unique_id, sender, file_id FROM file_id_cache ORDER BY updated_at DESC LIMIT ?',
+            (self.max_size + 1,)
+        ).fetchall()
+        self.complete = len(rows) <= self.max_size
+        for file_unique_id, sender, file_id in reversed(rows[:self.max_size]):
+            self.entries[(file_unique_id, sender)] = file_id
+        self._start_flushing()
+
+    def _lookup(self, key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+        """(đã biết, file_id) từ các thay đổi chưa ghi hoặc LRU, không đọc DB"""
+        for buffer in (self.pending, self.flushing):
+            if key in buffer:
+                return True, buffer[key]
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return True, self.entries[key]
+        return self.complete, None
+
+    def _remember(self, key: Tuple[str, str], file_id: Optional[str]):
+        self.entries[key] = file_id
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.complete = False
+
+    async def _load(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[str]]:
+        """Đọc các key chưa biết từ DB trong thread pool và cache kết quả (kể cả không có)"""
+        def read():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                loaded = {}
+                for key in keys:
+                    row = conn.execute(
+                        'SELECT file_id FROM file_id_cache WHERE file_unique_id = ? AND sender = ?', key
+                    ).fetchone()
+                    loaded[key] = row[0] if row else None
+                return loaded
+            finally:
+                conn.close()
+
+        loaded = await asyncio.get_running_loop().run_in_executor(None, read)
+        for key, file_id in loaded.items():
+            known, current = self._lookup(key)
+            if known and (key in self.entries or key in self.pending or key in self.flushing):
+                loaded[key] = current  # put/invalidate trong lúc đọc mới hơn giá trị trên disk
+            else:
+                self._remember(key, file_id)
+        return loaded
+
+    def put(self, file_unique_id: str, sender: str, file_id: str):
+        key = (file_unique_id, sender)
+        if self._lookup(key) == (True, file_id):
+            return
+        self._remember(key, file_id)
+        self._queue_write(key, file_id)
+
+    def invalidate(self, file_unique_id: str, sender: str):
+        key = (file_unique_id, sender)
+        self._remember(key, None)
+        self._queue_write(key, None)
+        self.stats['invalidated'] += 1
+
+    def _write_batch(self, changes):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO file_id_cache (file_unique_id, sender, file_id, updated_at) '
+                'VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+                [(key[0], key[1], file_id) for key, file_id in changes if file_id is not None]
+            )
+            self.conn.executemany(
+                'DELETE FROM file_id_cache WHERE file_unique_id = ? AND sender = ?',
+                [key for key, file_id in changes if file_id is None]
+            )
+
+    @staticmethod
+    def media_parts(message_data: Dict[str, Any]):
+        """Các (media_type, media) của message hoặc album"""
+        for part in message_data.get('media_group') or [message_data]:
+            for media_type in FILE_MEDIA_TYPES:
+                if part.get(media_type):
+                    yield media_type, part[media_type]
+                    break
+
+    async def resolve(self, message_data: Dict[str, Any], sender: str) -> Dict[str, str]:
+        """Trả về dict file_id gốc -> file_id của sender cho các media đã có trong cache"""
+        medias = [media for _, media in self.media_parts(message_data) if media.get('file_unique_id')]
+        found = {}
+        unknown = []
+        for media in medias:
+            key = (media['file_unique_id'], sender)
+            known, file_id = self._lookup(key)
+            if known:
+                found[key] = file_id
+            else:
+                unknown.append(key)
+        if unknown:
+            # Một lần đọc DB cho mọi media chưa biết của message/album
+            found.update(await self._load(unknown))
+
+        resolved = {}
+        for media in medias:
+            file_id = found.get((media['file_unique_id'], sender))
+            if file_id:
+                resolved[media['file_id']] = file_id
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+        return resolved
+
+    def invalidate_message(self, message_data: Dict[str, Any], sender: str):
+        for _, media in self.media_parts(message_data):
+            if media.get('file_unique_id'):
+                self.invalidate(media['file_unique_id'], sender)
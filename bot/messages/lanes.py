@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import Any, Callable, Dict, Iterator
+
+# Lane theo loại message: text nhẹ nhất, media lớn (video/document/audio/album) nặng nhất;
+# backfill (tin nhắn cũ) có lane riêng để không chiếm lượt của tin nhắn mới
+LANE_WEIGHTS = {'text': 6, 'light': 3, 'heavy': 1, 'backfill': 1}
+HEAVY_MEDIA = ('media_group', 'video', 'document', 'audio')
+LIGHT_MEDIA = ('photo', 'voice', 'sticker')
+
+def parse_lane_weights(value: str) -> Dict[str, int]:
+    """Đọc trọng số lane từ chuỗi dạng "text:6,light:3,heavy:1,backfill:1" """
+    weights = dict(LANE_WEIGHTS)
+    for part in (value or '').split(','):
+        lane, _, weight = part.partition(':')
+        lane = lane.strip()
+        if lane in weights and weight.strip().isdigit():
+            weights[lane] = max(1, int(weight))
+    return weights
+
+def classify_message(message_data: Dict[str, Any]) -> str:
+    """Chọn lane cho message dựa trên các key của convert_message_to_dict"""
+    if (message_data or {}).get('event'):
+        return 'text'  # Edit/delete chỉ là lệnh nhỏ, không upload media
+    if (message_data or {}).get('backfill'):
+        return 'backfill'
+    message = (message_data or {}).get('message') or {}
+    if any(message.get(key) for key in HEAVY_MEDIA):
+        return 'heavy'
+    if any(message.get(key) for key in LIGHT_MEDIA):
+        return 'light'
+    return 'text'
+
+class LaneBuffer:
+    """Bộ đệm nhiều lane: lấy ra theo smooth weighted round-robin, giữ thứ tự trong cùng channel đích"""
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self.lanes = {lane: deque() for lane in weights}
+        self.shutdown = deque()  # Tín hiệu dừng (None): chỉ lấy ra khi mọi lane khác đã hết
+        self.current = {lane: 0 for lane in weights}
+        self.target_seqs: Dict[Any, deque] = {}  # target -> seq của các message đang chờ, theo thứ tự
+        self.counter = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values()) + len(self.shutdown)
+
+    def __iter__(self) -> Iterator:
+        entries = sorted(entry for lane in self.lanes.values() for entry in lane)
+        return (item for _, _, item in entries)
+
+    def append(self, item):
+        if item is None:
+            self.shutdown.append(item)
+            return
+        seq = next(self.counter)
+        target = item['target_channel_id']
+        self.lanes[classify_message(item)].append((seq, target, item))
+        self.target_seqs.setdefault(target, deque()).append(seq)
+
+    def _take(self, lane: str, index: int = 0):
+        entries = self.lanes[lane]
+        if index:
+            _, target, item = entries[index]
+            del entries[index]
+        else:
+            _, target, item = entries.popleft()
+        seqs = self.target_seqs[target]
+        seqs.popleft()
+        if not seqs:
+            del self.target_seqs[target]
+        return item
+
+    def pop_oldest(self):
+        """Lấy message cũ nhất trong tất cả các lane"""
+        lane = min((lane for lane in self.lanes if self.lanes[lane]),
+                   key=lambda lane: self.lanes[lane][0][0])
+        return self._take(lane)
+
+    def pop_oldest_matching(self, match: Callable[[Any], bool]):
+        """Lấy message cũ nhất thỏa match, None nếu không có"""
+        oldest = None
+        for lane, entries in self.lanes.items():
+            # Mỗi lane đã theo thứ tự seq nên chỉ cần message khớp đầu tiên của lane
+            for index, (seq, _, item) in enumerate(entries):
+                if match(item):
+                    if oldest is None or seq < oldest[0]:
+                        oldest = (seq, lane, index)
+                    break
+        if oldest is None:
+            return None
+        _, lane, index = oldest
+        return self._take(lane, index)
+
+    def popleft(self):
+        ready = [lane for lane in self.lanes if self.lanes[lane]]
+        if not ready:
+            return self.shutdown.popleft()
+        total = 0
+        for lane in ready:
+            self.current[lane] += self.weights[lane]
+            total += self.weights[lane]
+        lane = max(ready, key=self.current.get)
+        self.current[lane] -= total
+
+        # Bỏ qua message của channel đích còn message cũ hơn ở lane khác để không đảo thứ tự
+        for index, (seq, target, _) in enumerate(self.lanes[lane]):
+            if self.target_seqs[target][0] == seq:
+                return self._take(lane, index)
+        # Cả lane đều đang chờ lane khác: message cũ nhất luôn gửi được
+        return self.pop_oldest()
+
+    def sizes(self) -> Dict[str, int]:
+        return {lane: len(entries) for lane, entries in self.lanes.items()}
+
+class LaneQueue(asyncio.Queue):
+    """asyncio.Queue dùng LaneBuffer thay cho deque FIFO"""
+
+    def __init__(self, maxsize: int = 0, weights: Dict[str, int] = None):
+        self.weights = weights or dict(LANE_WEIGHTS)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._queue = LaneBuffer(self.weights)
+
+    def pop_oldest_matching_nowait(self, match: Callable[[Any], bool]):
+        """Lấy message cũ nhất thỏa match (ví dụ cùng config), None nếu queue không có message nào như vậy"""
+        item = self._queue.pop_oldest_matching(match)
+        if item is not None:
+            self._wakeup_next(self._putters)
+        return item
+
+    def lane_sizes(self) -> Dict[str, int]:
+        return self._queue.sizes()
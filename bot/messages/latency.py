@@ -0,0 +1,123 @@
+import logging
+import math
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Các mốc thời gian của một message và giai đoạn tương ứng (từ mốc trước tới mốc sau)
+STAGES = (
+    ('delivery', 'source', 'received'),   # Telegram đăng bài -> handler của pyrogram nhận được
+    ('batching', 'received', 'enqueued'),  # Chờ gom album/forward batch
+    ('queue', 'enqueued', 'dequeued'),     # Chờ trong queue của shard (kể cả hoãn/retry)
+    ('render', 'dequeued', 'rendered'),    # Lọc pattern, dedupe, render header/footer
+    ('send', 'rendered', 'sent'),          # Gọi API gửi (kể cả chờ rate limiter, relay media)
+    ('total', 'source', 'sent')
+)
+
+# Bucket log-scale từ 1ms, mỗi bucket lớn hơn 25% -> 70 bucket phủ tới ~1 giờ, sai số percentile <= 25%
+MIN_LATENCY = 0.001
+GROWTH = 1.25
+BUCKETS = 70
+
+def stamp(message_data: Dict[str, Any], name: str, value: Optional[float] = None):
+    """Ghi mốc thời gian (wall clock để còn đúng sau khi message đi qua outbox/restart)"""
+    message_data.setdefault('stamps', {})[name] = time.time() if value is None else value
+
+def source_timestamp(date) -> Optional[float]:
+    """Thời điểm đăng của message nguồn (datetime của pyrogram hoặc chuỗi ISO)"""
+    if not date:
+        return None
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    return date.timestamp()
+
+def format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+class LatencyHistogram:
+    """Histogram bộ nhớ cố định (array các bộ đếm theo bucket log-scale)"""
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self):
+        self.counts = array('I', bytes(4 * BUCKETS))
+        self.total = 0
+
+    def observe(self, seconds: float):
+        if seconds <= MIN_LATENCY:
+            index = 0
+        else:
+            index = min(BUCKETS - 1, math.ceil(math.log(seconds / MIN_LATENCY) / math.log(GROWTH)))
+        self.counts[index] += 1
+        self.total += 1
+
+    def percentile(self, q: float) -> float:
+        """Cận trên của bucket chứa percentile q (0..1)"""
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(q * self.total))
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return MIN_LATENCY * GROWTH ** index
+        return MIN_LATENCY * GROWTH ** (BUCKETS - 1)
+
+class LatencyTracker:
+    """Gom thời gian từng giai đoạn theo config; trace mode log đầy đủ các mốc của N message tiếp theo"""
+
+    def __init__(self):
+        self.histograms: Dict[int, Dict[str, LatencyHistogram]] = {}
+        self.traces: Dict[int, int] = {}  # config_id -> số message còn cần trace
+
+    def record(self, message_data: Dict[str, Any]):
+        """Ghi nhận một message đã gửi xong"""
+        stamps = message_data.get('stamps')
+        if not stamps or message_data.get('backfill'):
+            return  # Message backfill có thời điểm đăng cũ, sẽ làm lệch số liệu live
+        stamp(message_data, 'sent')
+        config_id = message_data['config_id']
+        histograms = self.histograms.get(config_id)
+        if histograms is None:
+            histograms = self.histograms[config_id] = {name: LatencyHistogram() for name, _, _ in STAGES}
+
+        durations = {}
+        for name, start, end in STAGES:
+            if start == 'source' and message_data.get('catchup'):
+                continue  # Message copy bù có thời điểm đăng từ trước lúc reconnect/restart
+            if start in stamps and end in stamps:
+                durations[name] = max(0.0, stamps[end] - stamps[start])
+                histograms[name].observe(durations[name])
+
+        remaining = self.traces.get(config_id)
+        if remaining:
+            logger.info("⏱️ Trace config %s message %s: %s", config_id, message_data['message'].get('message_id'),
+                        ', '.join(f"{name} {format_duration(value)}" for name, value in durations.items()))
+            if remaining > 1:
+                self.traces[config_id] = remaining - 1
+            else:
+                del self.traces[config_id]
+
+    def trace(self, config_id: int, count: int):
+        """Bật trace cho count message tiếp theo của config (0 để tắt)"""
+        if count > 0:
+            self.traces[config_id] = count
+        else:
+            self.traces.pop(config_id, None)
+
+    def summary(self, config_id: int) -> List[Dict[str, Any]]:
+        """p50/p95/p99 của từng giai đoạn (bỏ qua giai đoạn chưa có số liệu)"""
+        result = []
+        for name, histogram in self.histograms.get(config_id, {}).items():
+            if histogram.total:
+                result.append({
+                    'stage': name,
+                    'count': histogram.total,
+                    'p50': histogram.percentile(0.50),
+                    'p95': histogram.percentile(0.95),
+                    'p99': histogram.percentile(0.99)
+                })
+        return result
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class MediaCache:
+    """Kho file trên disk theo file_unique_id, giới hạn dung lượng và loại bỏ file ít dùng nhất (LRU)"""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.enabled = os.getenv('MEDIA_CACHE_ENABLED', 'True').lower() == 'true'
+        self.cache_dir = cache_dir or os.getenv('MEDIA_CACHE_DIR', 'data/media_cache')
+        self.max_bytes = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+        self.entries: OrderedDict = OrderedDict()  # file_unique_id -> size, cũ nhất ở đầu
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'stored': 0, 'evicted': 0}
+        if self.enabled:
+            self._load_index()
+
+    def _load_index(self):
+        """Dựng lại index từ thư mục cache (thứ tự LRU theo mtime) để giữ cache qua các lần khởi động"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                # File tạm còn sót lại khi bị dừng giữa lúc ghi
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+        self._evict()
+        logger.info("🗄️ Media cache loaded: %d files, %.1f MB", len(self.entries), self.total_bytes / (1024 * 1024))
+
+    @staticmethod
+    def _key(file_unique_id: Optional[str]) -> Optional[str]:
+        # file_unique_id chỉ gồm ký tự base64url, vẫn lọc lại để tránh path traversal
+        if not file_unique_id or not re.fullmatch(r'[A-Za-z0-9_-]+', file_unique_id):
+            return None
+        return file_unique_id
+
+    def open(self, file_unique_id: Optional[str]):
+        """Mở file đã cache để đọc (None nếu chưa có)"""
+        key = self._key(file_unique_id)
+        if not self.enabled or not key:
+            return None
+        if key not in self.entries:
+            self.stats['misses'] += 1
+            return None
+
+        path = os.path.join(self.cache_dir, key)
+        try:
+            handle = open(path, 'rb')
+            os.utime(path)
+        except OSError:
+            # File bị xóa bên ngoài: bỏ khỏi index
+            self.total_bytes -= self.entries.pop(key)
+            self.stats['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        self.stats['bytes_saved'] += self.entries[key]
+        return handle
+
+    def _write(self, key: str, source) -> int:
+        # Ghi ra file tạm trong cùng thư mục rồi os.replace để không bao giờ có file cache dở dang
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                source.seek(0)
+                shutil.copyfileobj(source, output)
+                size = output.tell()
+            os.replace(tmp_path, os.path.join(self.cache_dir, key))
+            return size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            source.seek(0)
+
+    async def store(self, file_unique_id: Optional[str], source, size: int):
+        """Lưu nội dung source (file object có seek) vào cache"""
+        key = self._key(file_unique_id)
+        if not self.enabled or not key or key in self.entries or not size or size > self.max_bytes:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+            size = await loop.run_in_executor(None, self._write, key, source)
+        except OSError as e:
+            logger.warning("⚠️ Could not write media cache file %s: %s", key, e)
+            return
+
+        self.entries[key] = size
+        self.total_bytes += size
+        self.stats['stored'] += 1
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evicted'] += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(
+            self.stats,
+            files=len(self.entries),
+            bytes=self.total_bytes,
+            hit_rate=self.stats['hits'] / lookups if lookups else 0.0
+        )
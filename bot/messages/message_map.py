@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from bot.messages.batch_writer import BatchedWriter
+
+logger = logging.getLogger(__name__)
+
+def render_hash(text: str, entities) -> str:
+    """Hash của nội dung đã render (text + entities), dùng để bỏ qua edit không làm đổi output"""
+    payload = json.dumps([text, entities or []], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+class MessageMap(BatchedWriter):
+    """Ánh xạ (config_id, source_msg_id) -> target_msg_id để mirror edit/delete/reply, ghi theo batch"""
+
+    label = 'Message map'
+
+    def __init__(self, db_path: str):
+        # pending/flushing: (config_id, source_msg_id) -> danh sách row, None nghĩa là đã xóa
+        super().__init__(
+            db_path,
+            batch_size=int(os.getenv('MESSAGE_MAP_BATCH_SIZE', '200')),
+            flush_interval=float(os.getenv('MESSAGE_MAP_FLUSH_INTERVAL', '1.0'))
+        )
+        self.retention = float(os.getenv('MESSAGE_MAP_RETENTION_DAYS', '7')) * 86400
+        self.read_conn = None  # Chỉ dùng trong read_executor (WAL cho phép đọc song song với ghi)
+        self.read_executor = None
+        # Các row đọc/ghi gần đây: reply/edit/delete thường nhắm vào message vừa copy nên không cần đọc DB
+        self.cache_size = max(1, int(os.getenv('MESSAGE_MAP_CACHE_SIZE', '4096')))
+        self.recent: OrderedDict = OrderedDict()
+        self.last_prune = 0.0
+
+    def start(self):
+        self._connect()
+        self.read_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.read_executor = ThreadPoolExecutor(max_workers=1)
+        self._start_flushing()
+
+    def _cached(self, key: Tuple[int, int]) -> Optional[List[Dict[str, Any]]]:
+        """Row của key từ các thay đổi chưa ghi hoặc cache gần đây; None nếu phải đọc DB"""
+        for buffer in (self.pending, self.flushing):
+            if key in buffer:
+                return list(buffer[key] or [])
+        if key in self.recent:
+            self.recent.move_to_end(key)
+            return list(self.recent[key])
+        return None
+
+    def _remember(self, key: Tuple[int, int], rows: List[Dict[str, Any]]):
+        self.recent[key] = rows
+        self.recent.move_to_end(key)
+        if len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+
+    def _read(self, key: Tuple[int, int]) -> List[Dict[str, Any]]:
+        rows = self.read_conn.execute('''
+            SELECT target_msg_id, via, render_hash, created_at FROM message_map
+            WHERE config_id = ? AND source_msg_id = ?
+            ORDER BY target_msg_id
+        ''', key).fetchall()
+        return [
+            {'target_msg_id': row[0], 'via': row[1], 'render_hash': row[2], 'created_at': row[3]}
+            for row in rows
+        ]
+
+    async def get(self, config_id: int, source_msg_id: int) -> List[Dict[str, Any]]:
+        """Các message đích tương ứng với một message nguồn"""
+        key = (config_id, source_msg_id)
+        rows = self._cached(key)
+        if rows is not None:
+            return rows
+
+        rows = await asyncio.get_running_loop().run_in_executor(self.read_executor, self._read, key)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached  # record/remove trong lúc đọc mới hơn dữ liệu trên disk
+        self._remember(key, rows)
+        return list(rows)
+
+    def _set(self, key: Tuple[int, int], rows: Optional[List[Dict[str, Any]]]):
+        self._remember(key, rows or [])
+        self._queue_write(key, rows)
+
+    def record(self, config_id: int, pairs: List[Tuple[int, int]], via: str, render_hash: Optional[str] = None,
+               captioned_source: Optional[int] = None):
+        """Ghi nhận các cặp (source_msg_id, target_msg_id) vừa gửi.
+
+        Với album, chỉ cặp của captioned_source (phần mang caption) lưu render_hash để edit được mirror.
+        """
+        now = int(time.time())
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for source_msg_id, target_msg_id in pairs:
+            row_hash = render_hash if captioned_source is None or source_msg_id == captioned_source else None
+            grouped.setdefault(source_msg_id, []).append(
+                {'target_msg_id': target_msg_id, 'via': via, 'render_hash': row_hash, 'created_at': now}
+            )
+        for source_msg_id, rows in grouped.items():
+            self._set((config_id, source_msg_id), rows)
+
+    def update_hash(self, config_id: int, source_msg_id: int, render_hash: str):
+        """Cập nhật hash của các row có hash (gọi sau get nên row đã nằm trong cache)"""
+        rows = self._cached((config_id, source_msg_id))
+        if rows:
+            self._set((config_id, source_msg_id), [
+                dict(row, render_hash=render_hash) if row['render_hash'] else row for row in rows
+            ])
+
+    def remove(self, config_id: int, source_msg_ids: List[int]):
+        for source_msg_id in source_msg_ids:
+            self._set((config_id, source_msg_id), None)
+
+    async def _after_flush(self):
+        if time.monotonic() - self.last_prune > 3600:
+            await self.prune()
+
+    def _write_batch(self, changes):
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM message_map WHERE config_id = ? AND source_msg_id = ?',
+                [key for key, _ in changes]
+            )
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO message_map
+                (config_id, source_msg_id, target_msg_id, via, render_hash, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (config_id, source_msg_id, row['target_msg_id'], row['via'], row['render_hash'], row['created_at'])
+                for (config_id, source_msg_id), rows in changes for row in rows or []
+            ])
+
+    async def prune(self):
+        """Xóa các ánh xạ cũ hơn thời gian lưu giữ"""
+        self.last_prune = time.monotonic()
+        cutoff = int(time.time() - self.retention)
+
+        def delete_expired():
+            with self.conn:
+                return self.conn.execute('DELETE FROM message_map WHERE created_at < ?', (cutoff,)).rowcount
+
+        deleted = await asyncio.get_running_loop().run_in_executor(None, delete_expired)
+        if deleted:
+            logger.info("🧹 Pruned %d message mappings older than %.0f days", deleted, self.retention / 86400)
+
+    async def close(self):
+        """Flush phần còn lại và đóng các connection"""
+        await super().close()
+        if self.read_executor:
+            self.read_executor.shutdown(wait=True)
+            self.read_executor = None
+        if self.read_conn:
+            self.read_conn.close()
+            self.read_conn = None
@@ -0,0 +1,86 @@
+import itertools
+import json
+import logging
+import os
+from typing import Dict, Any, List
+from bot.messages.batch_writer import BatchedWriter
+
+logger = logging.getLogger(__name__)
+
+class MessageOutbox(BatchedWriter):
+    """Outbox bền vững trong SQLite cho message queue, ghi theo batch (group commit).
+
+    enqueue trả về một handle trong bộ nhớ; id của row do SQLite cấp khi batch được ghi,
+    nên message enqueue trước start() hay trong lúc replay không thể trùng id với row cũ.
+    """
+
+    label = 'Outbox'
+
+    def __init__(self, db_path: str):
+        super().__init__(
+            db_path,
+            batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', '500')),
+            flush_interval=float(os.getenv('OUTBOX_FLUSH_INTERVAL', '0.05'))
+        )
+        self.handles = itertools.count(1)
+        # handle -> id của row đã ghi; chỉ đổi trên event loop khi không có flush nào đang chạy
+        self.row_ids: Dict[int, int] = {}
+
+    def start(self) -> List[Dict[str, Any]]:
+        """Mở connection (WAL) và trả về các message chưa gửi để replay"""
+        rows = self._connect().execute('SELECT id, payload FROM message_outbox ORDER BY id').fetchall()
+        pending = []
+        for row_id, payload in rows:
+            handle = next(self.handles)
+            self.row_ids[handle] = row_id
+            try:
+                message_data = json.loads(payload)
+            except ValueError as e:
+                logger.warning("⚠️ Skipping corrupted outbox row %s: %s", row_id, e)
+                self._queue_write(handle, None)
+                continue
+            message_data['outbox_id'] = handle
+            pending.append(message_data)
+
+        self._start_flushing()
+        logger.info("📮 Message outbox started (%d unsent messages to replay)", len(pending))
+        return pending
+
+    def enqueue(self, message_data: Dict[str, Any]) -> int:
+        """Ghi message vào outbox (được commit ở lần flush kế tiếp), trả về handle dùng để ack"""
+        handle = next(self.handles)
+        self._queue_write(handle, json.dumps(message_data, ensure_ascii=False))
+        return handle
+
+    def ack(self, handle: int):
+        """Đánh dấu message đã xử lý xong"""
+        # Message được xử lý trước khi kịp flush thì không cần ghi xuống disk nữa
+        if self.pending.get(handle) is not None:
+            del self.pending[handle]
+            return
+        self._queue_write(handle, None)
+
+    def _write_batch(self, changes) -> Dict[int, int]:
+        written = {}
+        with self.conn:
+            for handle, payload in changes:
+                if payload is not None:
+                    written[handle] = self.conn.execute(
+                        'INSERT INTO message_outbox (payload) VALUES (?)', (payload,)
+                    ).lastrowid
+            # Ack của message chưa ghi xong ở batch trước vẫn nằm trong row_ids sau khi batch đó hoàn tất
+            self.conn.executemany('DELETE FROM message_outbox WHERE id = ?', [
+                (self.row_ids[handle],) for handle, payload in changes
+                if payload is None and handle in self.row_ids
+            ])
+        return written
+
+    def _flushed(self, changes, written: Dict[int, int]):
+        self.row_ids.update(written)
+        for handle, payload in changes:
+            if payload is None:
+                self.row_ids.pop(handle, None)
+
+    def backlog(self) -> int:
+        """Số message chưa được ghi hoặc chưa được ack trong lần flush gần nhất"""
+        return len(self.pending)
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import List, Optional
+
+PATTERN_FLAGS = re.IGNORECASE | re.DOTALL
+PATTERN_CACHE_SIZE = int(os.getenv('PATTERN_CACHE_SIZE', '256'))
+
+# Nhóm chứa quantifier và bản thân nhóm lại bị lặp, ví dụ (a+)+ hoặc (\w*){2,}
+# -> dấu hiệu điển hình của catastrophic backtracking
+_NESTED_QUANTIFIER = re.compile(r'\((?:[^()\\]|\\.)*[+*](?:[^()\\]|\\.)*\)(?:[+*]|\{\d*,\d*\})')
+
+class PatternTimeout(Exception):
+    """Pattern chạy quá thời gian cho phép"""
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _compile_in_worker(pattern: str):
+    return re.compile(pattern, PATTERN_FLAGS)
+
+def _findall_in_worker(pattern: str, text: str) -> List:
+    """Chạy trong process con để có thể kill nếu pattern bị treo"""
+    return _compile_in_worker(pattern).findall(text)
+
+def validate_pattern(pattern: str) -> Optional[str]:
+    """Kiểm tra pattern khi lưu cấu hình, trả về thông báo lỗi hoặc None nếu hợp lệ"""
+    try:
+        re.compile(pattern, PATTERN_FLAGS)
+    except re.error as e:
+        return f"Regex không hợp lệ: {e}"
+
+    if _NESTED_QUANTIFIER.search(pattern):
+        return "Pattern có quantifier lồng nhau (ví dụ `(a+)+`), có thể làm treo bot"
+
+    return None
+
+class _PatternWorker:
+    """Process riêng cho một pattern; chạy từng job một để đếm giờ đúng lúc job bắt đầu"""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.executor = None
+        self.lock = asyncio.Lock()
+
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    async def findall(self, text: str, timeout: float) -> List:
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                if self.executor is None:
+                    # Khởi động process và compile trước, không tính vào time budget của message
+                    self.executor = ProcessPoolExecutor(max_workers=1)
+                    await loop.run_in_executor(self.executor, _compile_in_worker, self.pattern)
+
+                future = loop.run_in_executor(self.executor, _findall_in_worker, self.pattern, text)
+                try:
+                    return await asyncio.wait_for(future, timeout=timeout)
+                except asyncio.TimeoutError:
+                    self.kill()
+                    raise PatternTimeout(f"Pattern '{self.pattern[:50]}' vượt quá {timeout}s")
+                except BrokenProcessPool:
+                    # Process chết ngoài ý muốn, thử lại với process mới
+                    self.kill()
+
+            raise PatternTimeout(f"Pattern '{self.pattern[:50]}' không chạy được trong worker")
+
+    def kill(self):
+        """Kill process của pattern này (có thể đang kẹt trong regex), process mới được tạo khi cần"""
+        executor, self.executor = self.executor, None
+        if executor is None:
+            return
+        # ProcessPoolExecutor không có API public để dừng task đang chạy,
+        # nên terminate trực tiếp process con
+        for process in list(getattr(executor, '_processes', {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+
+class PatternMatcher:
+    """Cache pattern đã compile (LRU) và chạy matching với giới hạn thời gian"""
+
+    def __init__(self):
+        self.cache_size = PATTERN_CACHE_SIZE
+        self.timeout = float(os.getenv('PATTERN_TIMEOUT_SECONDS', '1.0'))
+        self.max_workers = max(1, int(os.getenv('PATTERN_WORKERS', '4')))
+        self.compiled = OrderedDict()
+        self.workers: OrderedDict = OrderedDict()  # pattern -> _PatternWorker
+        self.timeouts = 0
+
+    def compile(self, pattern: str):
+        """Lấy pattern đã compile từ cache, compile và evict LRU nếu chưa có"""
+        compiled = self.compiled.get(pattern)
+        if compiled is not None:
+            self.compiled.move_to_end(pattern)
+            return compiled
+
+        compiled = re.compile(pattern, PATTERN_FLAGS)
+        self.compiled[pattern] = compiled
+        if len(self.compiled) > self.cache_size:
+            self.compiled.popitem(last=False)
+        return compiled
+
+    async def findall(self, pattern: str, text: str) -> List:
+        """re.findall với time budget; raise PatternTimeout nếu quá hạn"""
+        compiled = self.compile(pattern)  # re.error được raise ngay cho caller
+
+        if self.timeout <= 0:
+            return compiled.findall(text)
+
+        # validate_pattern chỉ bắt được một phần các pattern backtracking (ví dụ (a|aa)+b vẫn lọt),
+        # nên mọi pattern đều chạy trong process riêng của nó: timeout chỉ kill process đó
+        # và chỉ làm chậm các message của config dùng pattern này
+        worker = self._get_worker(pattern)
+        try:
+            return await worker.findall(text, self.timeout)
+        except PatternTimeout:
+            self.timeouts += 1
+            raise
+
+    def _get_worker(self, pattern: str) -> _PatternWorker:
+        worker = self.workers.get(pattern)
+        if worker is None:
+            worker = self.workers[pattern] = _PatternWorker(pattern)
+        self.workers.move_to_end(pattern)
+        # Giữ tối đa max_workers process, chỉ dừng các worker đang rảnh (ít dùng gần đây nhất trước)
+        for idle_pattern in [key for key, idle in self.workers.items() if not idle.busy() and key != pattern]:
+            if len(self.workers) <= self.max_workers:
+                break
+            self.workers.pop(idle_pattern).kill()
+        return worker
+
+    def shutdown(self):
+        """Dừng các worker process"""
+        for worker in self.workers.values():
+            worker.kill()
+        self.workers.clear()
@@ -1,40 +1,395 @@
 import asyncio
-import re
-from typing import Dict, Any
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Any, List
+from pyrogram.enums import ParseMode
+from pyrogram.parser.html import HTML
+from telegram.error import BadRequest
+from pyrogram.errors import MessageNotModified
+from telegram import (
+    ReplyParameters,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+)
+from bot.utils.config_registry import config_registry
+from bot.utils.logger import set_trace, current_trace
+from bot.utils.metrics import metrics
+from bot.messages.patterns import PatternMatcher, PatternTimeout
+from bot.messages.rate_limiter import RateLimiter, ChatParked
+from bot.messages.outbox import MessageOutbox
+from bot.messages.dedupe import DuplicateFilter
+from bot.messages.lanes import LaneQueue, parse_lane_weights
+from bot.messages.send_modes import SEND_MODES, MAX_FORWARD_BATCH
+from bot.messages.relay import MediaRelay
+from bot.messages.render import RenderPlanCache
+from bot.messages.entities import to_bot_entities, to_pyrogram_entities
+from bot.messages.retry import RetryScheduler, classify_error
+from bot.messages.file_cache import FileIdCache, FILE_MEDIA_TYPES, extract_file_id, is_file_id_error
+from bot.messages.message_map import MessageMap, render_hash
+from bot.messages.backfill import BackfillManager
+from bot.messages.progress import ProgressTracker
+from bot.messages.latency import LatencyTracker, stamp
+
+logger = logging.getLogger(__name__)
+
+# Chính sách khi queue đầy: chặn producer, bỏ message cũ nhất, bỏ message quá TTL, hạ media xuống text
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_by_age', 'degrade')
 
 class MessageProcessor:
     def __init__(self, bot_instance):
         self.bot_instance = bot_instance
         self.db = bot_instance.db
-        self.message_queue = asyncio.Queue()
-        self.processing_task = None
+        
+        # Worker pool: mỗi worker xử lý một shard, message được chia theo target_channel_id
+        # để giữ thứ tự trong cùng một channel đích nhưng các channel khác nhau chạy song song
+        self.num_workers = max(1, int(os.getenv('MESSAGE_WORKERS', '4')))
+        
+        # Queue có giới hạn; khi đầy hoặc message quá cũ thì áp dụng chính sách overflow của config
+        self.queue_maxsize = max(1, int(os.getenv('MESSAGE_QUEUE_MAXSIZE', '1000')))
+        self.default_overflow_policy = os.getenv('QUEUE_OVERFLOW_POLICY', 'block')
+        self.message_ttl = float(os.getenv('QUEUE_MESSAGE_TTL', '600'))
+        self.shed_counts: Dict[int, Dict[str, int]] = {}
+        
+        # Mỗi shard chia lane text/light/heavy để text không bị kẹt sau các media lớn
+        lane_weights = parse_lane_weights(os.getenv('LANE_WEIGHTS', ''))
+        self.shard_queues = [LaneQueue(self.queue_maxsize, lane_weights) for _ in range(self.num_workers)]
+        self.worker_tasks = []
+        self.pattern_matcher = PatternMatcher()
+        
+        # Rate limiter cho mọi lệnh send_*; message tới chat đang phải chờ được chuyển
+        # sang hàng đợi riêng của chat đó để worker tiếp tục xử lý các chat khác
+        self.rate_limiter = RateLimiter()
+        self.max_flood_retries = int(os.getenv('MAX_RETRY_ATTEMPTS', '3'))
+        self.deferred_messages: Dict[int, deque] = {}
+        self.deferred_space: Dict[int, asyncio.Event] = {}
+        self.deferred_tasks = set()
+        
+        # Message gửi lỗi được xếp lịch retry (không chặn worker), hết lượt thì vào dead letter
+        self.retry_scheduler = RetryScheduler(self.resubmit_message, self.dead_letter_message)
+        self.worker_stats = [
+            {'processed': 0, 'busy_seconds': 0.0, 'started_at': None}
+            for _ in range(self.num_workers)
+        ]
+        
+        # Chống gửi trùng, relay media cho bot và cách gửi mặc định của config
+        self.duplicate_filter = DuplicateFilter()
+        self.media_relay = MediaRelay()
+        self.render_plans = RenderPlanCache()
+        
+        # file_id phía bot của các media đã upload, dùng lại cho repost/fan-out/retry
+        self.file_id_cache = FileIdCache(self.db.db_path)
+        self.bot_sender = f"bot:{os.getenv('BOT_TOKEN', '').split(':')[0]}"
+        self.default_send_mode = os.getenv('DEFAULT_SEND_MODE', 'auto')
+        
+        # Ánh xạ message nguồn -> đích để mirror edit/delete và giữ reply
+        self.message_map = None
+        if os.getenv('MESSAGE_MAP_ENABLED', 'True').lower() == 'true':
+            self.message_map = MessageMap(self.db.db_path)
+        
+        # Message nguồn mới nhất đã xử lý của từng config, để copy bù sau khi reconnect/restart
+        self.progress = ProgressTracker(self.db)
+        
+        # Độ trễ theo từng giai đoạn (nhận -> queue -> render -> gửi) của mỗi config
+        self.latency = LatencyTracker()
+        
+        # Backfill tin nhắn cũ: chạy ở lane riêng, trọng số thấp để không lấn live copy
+        self.backfill = BackfillManager(self)
+        
+        # Outbox bền vững (tùy chọn): message được ghi vào SQLite trước khi vào queue
+        self.outbox = None
+        if os.getenv('OUTBOX_ENABLED', 'False').lower() == 'true':
+            self.outbox = MessageOutbox(self.db.db_path)
         
     async def init_async(self):
         """Khởi tạo message processor"""
-        self.processing_task = asyncio.create_task(self.process_message_queue())
-        print("🔄 Message processor started...")
+        now = time.monotonic()
+        for shard_index in range(self.num_workers):
+            self.worker_stats[shard_index]['started_at'] = now
+            self.worker_tasks.append(asyncio.create_task(self.process_message_queue(shard_index)))
+        self.retry_scheduler.start()
+        self.progress.start()
+        self.file_id_cache.start()
+        if self.message_map:
+            self.message_map.start()
+        logger.info("🔄 Message processor started with %d workers", self.num_workers)
+        
+        if self.outbox:
+            # Replay các message chưa gửi xong từ lần chạy trước, theo đúng thứ tự
+            for message_data in self.outbox.start():
+                shard_index = self.get_shard_index(message_data['target_channel_id'])
+                await self.shard_queues[shard_index].put(message_data)
+        
+    async def process_message_queue(self, shard_index: int):
+        """Background task để xử lý message queue của một shard"""
+        queue = self.shard_queues[shard_index]
+        stats = self.worker_stats[shard_index]
         
-    async def process_message_queue(self):
-        """Background task để xử lý message queue"""
         while True:
             try:
                 # Lấy message từ queue
-                message_data = await self.message_queue.get()
+                message_data = await queue.get()
                 
                 if message_data is None:  # Shutdown signal
                     break
-                    
-                await self.handle_incoming_message(message_data)
+                
+                chat_id = int(message_data['target_channel_id'])
+                if chat_id in self.deferred_messages or self.rate_limiter.chat_delay(chat_id) > 0:
+                    # Không chờ ở đây: worker dùng chung cho nhiều chat đích, backpressure áp ở producer
+                    self.defer_message(message_data)
+                    continue
+                
+                started = time.monotonic()
+                try:
+                    await self.dispatch_message(message_data)
+                finally:
+                    stats['busy_seconds'] += time.monotonic() - started
+                    stats['processed'] += 1
                 
             except Exception as e:
-                print(f"❌ Error processing message: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("❌ Error processing message in worker %d: %s", shard_index, e)
+    
+    async def dispatch_message(self, message_data: Dict[str, Any]):
+        """Xử lý một message; nếu chat bị flood-wait thì xếp lịch gửi lại thay vì chờ"""
+        if not self.admit_message(message_data):
+            return
+        
+        trace = set_trace(message_data['config_id'], message_data['message'].get('message_id'))
+        if 'stamps' in message_data:
+            stamp(message_data, 'dequeued')
+        try:
+            event = message_data.get('event')
+            if event == 'edit':
+                await self.handle_edited_message(message_data)
+            elif event == 'delete':
+                await self.handle_deleted_messages(message_data)
+            else:
+                await self.handle_incoming_message(message_data)
+        except ChatParked as e:
+            if not e.flood:
+                # Phần tiếp theo của message nhiều phần: chờ rate limit trong hàng đợi hoãn, không chiếm worker
+                self.defer_message(message_data, front=True)
+                return
+            retries = message_data.get('flood_retries', 0) + 1
+            if retries > self.max_flood_retries:
+                logger.error("❌ Giving up on chat %s after %d flood-wait retries", e.chat_id, retries - 1)
+                metrics.messages_failed.inc(message_data['config_id'], 'flood')
+                self.dead_letter_message(message_data, 'flood', e)
+            else:
+                message_data['flood_retries'] = retries
+                self.defer_message(message_data, front=True)
+            return
+        except Exception as e:
+            # Lỗi khác: retry sau theo chính sách của lỗi, hết lượt thì scheduler chuyển vào dead letter
+            metrics.messages_failed.inc(message_data['config_id'], classify_error(e))
+            self.retry_scheduler.schedule(message_data, e)
+            return
+        finally:
+            current_trace.reset(trace)
+        
+        self.complete_message(message_data)
+    
+    def complete_message(self, message_data: Dict[str, Any]):
+        """Đánh dấu message đã xử lý xong (gửi thành công hoặc bị bỏ qua)"""
+        if self.outbox and 'outbox_id' in message_data:
+            self.outbox.ack(message_data['outbox_id'])
+        if 'backfill' in message_data:
+            self.backfill.complete(message_data)
+        if not message_data.get('event'):
+            message = message_data['message']
+            parts = message.get('forward_messages') or message.get('media_group') or [message]
+            self.progress.mark(message_data['config_id'], max(part.get('message_id') or 0 for part in parts))
+    
+    async def resubmit_message(self, message_data: Dict[str, Any]):
+        """Đưa message đến hạn retry trở lại queue của shard (đã có trong outbox nên không ghi lại)"""
+        shard_index = self.get_shard_index(message_data['target_channel_id'])
+        await self.shard_queues[shard_index].put(message_data)
+    
+    def dead_letter_message(self, message_data: Dict[str, Any], error_class: str, error: Exception):
+        """Chuyển message đã hết lượt retry vào bảng dead_letters"""
+        payload = {key: value for key, value in message_data.items() if key not in ('outbox_id', 'enqueued_at')}
+        self.db.add_dead_letter(payload, error_class, f"{type(error).__name__}: {error}")
+        self.complete_message(message_data)
+        logger.error("☠️ Message for config %s moved to dead letters (%s: %s)",
+                     message_data['config_id'], error_class, error)
+    
+    async def replay_dead_letters(self, user_id: int, config_id: int = None) -> int:
+        """Đưa các dead letter của user trở lại queue; trả về số message đã replay"""
+        messages = self.db.pop_dead_letters(user_id, config_id)
+        for message_data in messages:
+            # Bỏ mốc thời gian cũ để message replay không làm lệch số liệu độ trễ
+            for key in ('retry_attempts', 'flood_retries', 'enqueued_at', 'stamps'):
+                message_data.pop(key, None)
+            await self.add_message_to_queue(message_data)
+        return len(messages)
+    
+    def get_overflow_policy(self, message_data: Dict[str, Any]) -> str:
+        """Chính sách overflow của config (hoặc mặc định từ env)"""
+        config = config_registry.get(message_data['config_id']) or {}
+        policy = config.get('overflow_policy') or self.default_overflow_policy
+        return policy if policy in OVERFLOW_POLICIES else 'block'
+    
+    def shed_message(self, message_data: Dict[str, Any], reason: str):
+        """Bỏ một message do quá tải và ghi nhận vào thống kê"""
+        self._count_shed(message_data['config_id'], reason)
+        metrics.messages_filtered.inc(message_data['config_id'], reason)
+        self.complete_message(message_data)
+        logger.warning("🗑️ Shed message for config %s (%s)", message_data['config_id'], reason)
+    
+    def _count_shed(self, config_id: int, reason: str):
+        counts = self.shed_counts.setdefault(config_id, {})
+        counts[reason] = counts.get(reason, 0) + 1
+    
+    def get_backlog(self, chat_id: int) -> int:
+        """Số message đang chờ của shard và hàng đợi hoãn của chat đích"""
+        return (self.shard_queues[self.get_shard_index(chat_id)].qsize()
+                + len(self.deferred_messages.get(chat_id, ())))
+    
+    def admit_message(self, message_data: Dict[str, Any]) -> bool:
+        """Áp dụng drop_by_age/degrade khi dequeue; trả về False nếu message bị bỏ"""
+        policy = self.get_overflow_policy(message_data)
+        if policy not in ('drop_by_age', 'degrade'):
+            return True
+        
+        age = time.time() - message_data.get('enqueued_at', time.time())
+        if policy == 'drop_by_age':
+            if age > self.message_ttl:
+                self.shed_message(message_data, 'expired')
+                return False
+            return True
+        
+        chat_id = int(message_data['target_channel_id'])
+        if message_data['message'].get('forward_messages') or message_data.get('event'):
+            return True  # Forward đã là cách gửi rẻ nhất, edit/delete không có media để bỏ
+        if message_data.get('degraded') or (age <= self.message_ttl
+                                            and self.get_backlog(chat_id) < self.queue_maxsize // 2):
+            return True
+        
+        # Quá tải hoặc đã trễ: chỉ gửi phần text, bỏ media
+        original_message = message_data['message']
+        text = original_message.get('text') or original_message.get('caption')
+        if not text:
+            self.shed_message(message_data, 'degraded_empty')
+            return False
+        
+        message_data['message'] = {
+            'message_id': original_message.get('message_id'),
+            'text': text,
+            'caption': None,
+            'date': original_message.get('date')
+        }
+        message_data['degraded'] = True
+        self._count_shed(message_data['config_id'], 'degraded')
+        return True
+    
+    async def wait_for_deferred_space(self, message_data: Dict[str, Any]):
+        """Với chính sách block: producer chờ đến khi hàng đợi hoãn của chat đích còn chỗ (chỉ chặn config đó)"""
+        chat_id = int(message_data['target_channel_id'])
+        while (self.get_overflow_policy(message_data) == 'block'
+               and len(self.deferred_messages.get(chat_id, ())) >= self.queue_maxsize):
+            space = self.deferred_space.setdefault(chat_id, asyncio.Event())
+            space.clear()
+            await space.wait()
+    
+    def defer_message(self, message_data: Dict[str, Any], front: bool = False):
+        """Đưa message vào hàng đợi riêng của chat đích, giữ nguyên thứ tự"""
+        chat_id = int(message_data['target_channel_id'])
+        pending = self.deferred_messages.get(chat_id)
+        if pending is None:
+            pending = self.deferred_messages[chat_id] = deque()
+            task = asyncio.create_task(self._drain_deferred(chat_id, pending))
+            self.deferred_tasks.add(task)
+            task.add_done_callback(self.deferred_tasks.discard)
+        
+        # Với block, producer đã dừng khi hàng đợi đầy; phần vượt chỉ là message đã nằm sẵn trong
+        # queue của shard nên cho thêm một queue_maxsize trước khi phải bỏ message
+        limit = self.queue_maxsize * (2 if self.get_overflow_policy(message_data) == 'block' else 1)
+        if not front and len(pending) >= limit:
+            self.shed_message(pending.popleft(), 'overflow')
+        
+        if front:
+            pending.appendleft(message_data)
+        else:
+            pending.append(message_data)
+    
+    async def _drain_deferred(self, chat_id: int, pending: deque):
+        """Gửi lần lượt các message đã hoãn của một chat khi rate limit cho phép"""
+        try:
+            while pending:
+                delay = self.rate_limiter.chat_delay(chat_id)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                
+                message_data = pending.popleft()
+                space = self.deferred_space.get(chat_id)
+                if space:
+                    space.set()
+                try:
+                    await self.dispatch_message(message_data)
+                except Exception as e:
+                    logger.error("❌ Error sending deferred message to %s: %s", chat_id, e)
+        finally:
+            self.deferred_messages.pop(chat_id, None)
+            space = self.deferred_space.pop(chat_id, None)
+            if space:
+                space.set()
+    
+    def get_shard_index(self, target_channel_id) -> int:
+        """Chọn shard cho message dựa trên hash của target_channel_id"""
+        return hash(int(target_channel_id)) % self.num_workers
     
     async def add_message_to_queue(self, message_data: Dict[str, Any]):
-        """Thêm tin nhắn vào queue để xử lý"""
-        await self.message_queue.put(message_data)
+        """Thêm tin nhắn vào queue của shard tương ứng để xử lý"""
+        shard_index = self.get_shard_index(message_data['target_channel_id'])
+        queue = self.shard_queues[shard_index]
+        message_data.setdefault('enqueued_at', time.time())
+        message_data.setdefault('stamps', {}).setdefault('enqueued', message_data['enqueued_at'])
+        await self.wait_for_deferred_space(message_data)
+        if self.outbox:
+            message_data['outbox_id'] = self.outbox.enqueue(message_data)
+        
+        # Queue đầy: drop_oldest bỏ message cũ nhất của chính config đó (không đụng tới config khác
+        # cùng shard); config không còn message nào trong queue thì chặn producer như các chính sách khác
+        if queue.full() and self.get_overflow_policy(message_data) == 'drop_oldest':
+            config_id = message_data['config_id']
+            oldest = queue.pop_oldest_matching_nowait(lambda item: item['config_id'] == config_id)
+            if oldest is not None:
+                self.shed_message(oldest, 'dropped_oldest')
+        await queue.put(message_data)
+    
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Thống kê utilisation và queue depth của từng worker"""
+        now = time.monotonic()
+        stats = []
+        for shard_index, worker in enumerate(self.worker_stats):
+            elapsed = now - worker['started_at'] if worker['started_at'] else 0.0
+            stats.append({
+                'shard': shard_index,
+                'queue_depth': self.shard_queues[shard_index].qsize(),
+                'lanes': self.shard_queues[shard_index].lane_sizes(),
+                'processed': worker['processed'],
+                'utilisation': worker['busy_seconds'] / elapsed if elapsed > 0 else 0.0
+            })
+        return stats
+    
+    def get_shed_stats(self) -> Dict[int, Dict[str, int]]:
+        """Số message bị bỏ/hạ cấp theo config và lý do"""
+        return {config_id: dict(counts) for config_id, counts in self.shed_counts.items()}
+    
+    def get_rate_limit_stats(self) -> Dict[str, int]:
+        """Thống kê rate limiter: số chat bị park và số message đang hoãn"""
+        return {
+            'parked_chats': sum(1 for chat_id in self.rate_limiter.parked_until
+                                if self.rate_limiter.is_parked(chat_id)),
+            'deferred_chats': len(self.deferred_messages),
+            'deferred_messages': sum(len(pending) for pending in self.deferred_messages.values()),
+            'flood_waits': self.rate_limiter.park_count
+        }
+    
+    async def _send(self, method_name: str, chat_id, **kwargs):
+        """Gọi bot.send_* thông qua rate limiter"""
+        method = metrics.timed(getattr(self.bot_instance.bot_instance, method_name), method_name)
+        return await self.rate_limiter.call(int(chat_id), method, chat_id=chat_id, **kwargs)
     
     async def handle_incoming_message(self, message_data: Dict[str, Any]):
         """Xử lý tin nhắn đến từ pyrogram client"""
@@ -45,205 +400,625 @@ class MessageProcessor:
             source_channel_id = message_data['source_channel_id']
             target_channel_id = message_data['target_channel_id']
             
-            print(f"📨 Processing message from user {user_id}, config {config_id}")
-            print(f"🔍 Debug - Source: {source_channel_id}, Target: {target_channel_id}")
+            # %.100s cắt nội dung khi format (ở thread ghi log), không cắt chuỗi trên event loop
+            logger.debug("📨 Processing message from user %s, config %s: %s -> %s, content: %.100s",
+                         user_id, config_id, source_channel_id, target_channel_id,
+                         original_message.get('text') or original_message.get('caption') or '')
             
-            # Safe string handling for debug logs
-            message_content = original_message.get('text', '') or original_message.get('caption', '') or ''
-            print(f"📄 Debug - Message content: {message_content[:100]}...")
+            # Lấy cấu hình từ registry trong bộ nhớ (không truy cập database)
+            config = config_registry.get(config_id)
             
-            # Lấy cấu hình chi tiết từ database
-            configs = self.db.get_user_configs(user_id)
-            config = next((c for c in configs if c['id'] == config_id), None)
+            if not config or not config['is_active'] or config['user_id'] != user_id:
+                logger.warning("❌ Config %s not found for user %s", config_id, user_id)
+                return
             
-            if not config:
-                print(f"❌ Config {config_id} not found for user {user_id}")
+            if original_message.get('forward_messages'):
+                await self.forward_message_batch(config, message_data)
                 return
             
-            print(f"✅ Debug - Config found: {config.get('extract_pattern', 'No pattern')}")
+            # Bỏ qua message đã gửi tới channel đích gần đây (source repost hoặc update bị nhận lại)
+            dedupe_key = self.duplicate_filter.message_key(target_channel_id, original_message)
+            if self.duplicate_filter.is_duplicate(config_id, dedupe_key):
+                metrics.messages_filtered.inc(config_id, 'duplicate')
+                logger.info("♻️ Duplicate message for target %s, skipping", target_channel_id)
+                return
             
-            # Áp dụng pattern extraction nếu có
-            if config.get('extract_pattern') and config['extract_pattern'].strip():
-                pattern = config['extract_pattern']
-                print(f"🎯 Debug - Applying pattern: '{pattern}'")
-                try:
-                    matches = re.findall(pattern, message_content, re.IGNORECASE | re.DOTALL)
-                    if matches:
-                        message_content = ' '.join(matches)
-                        print(f"✅ Debug - Pattern matched: '{message_content[:100]}...'")
-                    else:
-                        print(f"🔍 No pattern match found, skipping message")
-                        original_text = original_message.get('text', '') or original_message.get('caption', '') or ''
-                        print(f"🔍 Debug - Original text was: '{original_text[:200]}...'")
-                        return  # Không có match thì không copy
-                except Exception as e:
-                    print(f"❌ Pattern error: {e}")
-                    # Nếu pattern lỗi, vẫn gửi tin nhắn gốc
-            else:
-                print("🔄 Debug - No pattern filter, processing original message")
-            
-            # Xây dựng tin nhắn cuối cùng
-            final_text = ""
-            
-            # Thêm header nếu có
-            if config.get('header_text') and config['header_text'].strip():
-                final_text += config['header_text'] + "\n\n"
-                print(f"📄 Debug - Added header")
-            
-            # Thêm nội dung chính
-            final_text += message_content
-            
-            # Thêm footer nếu có
-            if config.get('footer_text') and config['footer_text'].strip():
-                final_text += "\n\n" + config['footer_text']
-                print(f"📄 Debug - Added footer")
-            
-            print(f"📤 Debug - Final message length: {len(final_text)}")
-            print(f"📤 Debug - Final message preview: '{final_text[:200]}...'")
-            
-            # Tạo inline button nếu có cấu hình
-            reply_markup = None
-            if (config.get('button_text') and config['button_text'].strip() and 
-                config.get('button_url') and config['button_url'].strip()):
-                button = InlineKeyboardButton(
-                    config['button_text'],
-                    url=config['button_url']
+            rendered = await self.render_message(config, original_message)
+            if rendered is None:
+                return
+            final_text, entities, reply_markup = rendered
+            stamp(message_data, 'rendered')
+            
+            logger.debug("📤 Final message (%d chars): %.200r", len(final_text), final_text)
+            
+            # Reply tới message nguồn đã copy thì reply tới message tương ứng ở channel đích
+            reply_to = await self.map_reply_target(config_id, original_message)
+            
+            # Copy server-side qua user client nếu được, không thì gửi qua bot telegram
+            sent, via = None, 'user'
+            user_client = await self.get_copy_client(config, target_channel_id, reply_markup)
+            if user_client:
+                sent = await self.copy_processed_message(
+                    user_client=user_client,
+                    source_channel_id=source_channel_id,
+                    target_channel_id=target_channel_id,
+                    message_data=original_message,
+                    final_text=final_text,
+                    entities=entities,
+                    reply_to=reply_to
                 )
-                reply_markup = InlineKeyboardMarkup([[button]])
-                print(f"🔘 Debug - Added button: {config['button_text']}")
             
-            print(f"🚀 Debug - About to send message to {target_channel_id}")
+            if sent is None:
+                sent, via = await self.send_processed_message(
+                    target_channel_id=target_channel_id,
+                    message_data=original_message,
+                    final_text=final_text,
+                    reply_markup=reply_markup,
+                    user_client=self.bot_instance.user_clients.get(user_id),
+                    entities=entities,
+                    reply_to=reply_to
+                ), 'bot'
+            self.duplicate_filter.remember(dedupe_key)
+            self.record_mapping(config_id, original_message, sent, via, render_hash(final_text, entities))
+            metrics.messages_sent.inc(config_id, via)
+            self.latency.record(message_data)
             
-            # Gửi tin nhắn qua bot telegram
-            await self.send_processed_message(
+            logger.info("✅ Message %s of config %s sent to %s via %s",
+                        original_message.get('message_id'), config_id, target_channel_id, via)
+            
+            # Sticker không có caption nên text được gửi thành message riêng ngay sau sticker
+            if original_message.get('sticker') and final_text.strip():
+                message_data.pop('stamps', None)  # Độ trễ đã được ghi nhận khi gửi sticker
+                self.defer_parts(message_data, [
+                    self.followup_text(original_message, final_text, entities, via)
+                ])
+            
+        except ChatParked:
+            raise  # Để worker xếp lịch gửi lại
+        except Exception as e:
+            logger.warning("❌ Error handling incoming message: %s: %s", type(e).__name__, e)
+            raise  # Để worker retry theo chính sách lỗi
+    
+    async def render_message(self, config: Dict[str, Any], original_message: Dict[str, Any]):
+        """Áp dụng pattern và render plan; trả về (final_text, entities, reply_markup) hoặc None nếu bỏ qua"""
+        config_id = config['id']
+        message_content = original_message.get('text', '') or original_message.get('caption', '') or ''
+        content_entities = original_message.get('entities')
+        
+        # Áp dụng pattern extraction nếu có
+        if config.get('extract_pattern') and config['extract_pattern'].strip():
+            pattern = config['extract_pattern']
+            logger.debug("🎯 Applying pattern %r", pattern)
+            try:
+                matches = await self.pattern_matcher.findall(pattern, message_content)
+                if matches:
+                    message_content = ' '.join(matches)
+                    content_entities = None  # Offset entity gốc không còn đúng với nội dung đã trích
+                    logger.debug("✅ Pattern matched: %.100r", message_content)
+                else:
+                    logger.debug("🔍 No pattern match, skipping message: %.200r", message_content)
+                    metrics.messages_filtered.inc(config_id, 'no_match')
+                    return None  # Không có match thì không copy
+            except PatternTimeout as e:
+                logger.warning("⏱️ %s - skipping message for config %s", e, config_id)
+                metrics.messages_filtered.inc(config_id, 'pattern_timeout')
+                return None  # Pattern quá chậm thì bỏ qua tin nhắn này
+            except Exception as e:
+                logger.error("❌ Pattern error: %s", e)
+                # Nếu pattern lỗi, vẫn gửi tin nhắn gốc
+        
+        # Xây dựng tin nhắn cuối cùng từ render plan đã compile sẵn của config
+        plan = self.render_plans.get(config)
+        final_text, entities = plan.render(message_content, original_message, content_entities)
+        return final_text, entities, plan.reply_markup
+    
+    async def map_reply_target(self, config_id: int, original_message: Dict[str, Any]):
+        """message_id ở channel đích tương ứng với message mà tin nhắn nguồn đang reply (nếu có)"""
+        reply_to = original_message.get('reply_to_message_id')
+        if not reply_to or not self.message_map:
+            return None
+        rows = await self.message_map.get(config_id, reply_to)
+        return rows[0]['target_msg_id'] if rows else None
+    
+    def record_mapping(self, config_id: int, original_message: Dict[str, Any], sent, via: str,
+                       rendered_hash: str = None):
+        """Lưu ánh xạ message nguồn -> message đích từ kết quả gửi"""
+        if not self.message_map or not sent:
+            return
+        targets = list(sent) if isinstance(sent, (list, tuple)) else [sent]
+        captioned_source = None
+        if original_message.get('forward_messages'):
+            source_ids = [part['message_id'] for part in original_message['forward_messages']]
+        elif original_message.get('media_group'):
+            media_parts = [part for part in original_message['media_group'] if self._album_media_type(part)]
+            source_ids = [part['message_id'] for part in media_parts]
+            if len(targets) > 1:
+                # Caption của album nằm ở phần tương ứng với phần mang caption ở nguồn (xem caption_index)
+                captioned_source = source_ids[self.caption_index(media_parts)]
+        else:
+            source_ids = [original_message['message_id']]
+        # Message của bot có message_id, của pyrogram có id
+        target_ids = [getattr(target, 'message_id', None) or target.id for target in targets]
+        self.message_map.record(config_id, list(zip(source_ids, target_ids)), via, rendered_hash, captioned_source)
+    
+    async def handle_edited_message(self, message_data: Dict[str, Any]):
+        """Mirror edit của message nguồn sang message đích (chỉ khi nội dung render thay đổi)"""
+        config_id = message_data['config_id']
+        original_message = message_data['message']
+        config = config_registry.get(config_id)
+        if not config or not config['is_active'] or config['user_id'] != message_data['user_id']:
+            return
+        
+        rows = [row for row in await self.message_map.get(config_id, original_message['message_id'])
+                if row['render_hash']]
+        if not rows or original_message.get('sticker'):
+            return
+        
+        rendered = await self.render_message(config, original_message)
+        if rendered is None:
+            return
+        final_text, entities, reply_markup = rendered
+        new_hash = render_hash(final_text, entities)
+        if all(row['render_hash'] == new_hash for row in rows):
+            logger.debug("✏️ Edit of message %s does not change output, skipping", original_message['message_id'])
+            return
+        
+        target_channel_id = message_data['target_channel_id']
+        has_caption = any(original_message.get(media_type) for media_type in FILE_MEDIA_TYPES)
+        for row in rows:
+            if row['render_hash'] == new_hash:
+                continue
+            try:
+                if row['via'] == 'bot':
+                    if has_caption:
+                        await self._send('edit_message_caption', target_channel_id, message_id=row['target_msg_id'],
+                                         caption=final_text, caption_entities=to_bot_entities(entities),
+                                         reply_markup=reply_markup)
+                    else:
+                        await self._send('edit_message_text', target_channel_id, message_id=row['target_msg_id'],
+                                         text=final_text, entities=to_bot_entities(entities),
+                                         reply_markup=reply_markup)
+                else:
+                    user_client = self.bot_instance.user_clients.get(config['user_id'])
+                    if not user_client or not user_client.client or not user_client.client.is_connected:
+                        raise ConnectionError(f"User client {config['user_id']} is not connected")
+                    if has_caption:
+                        await self._send_as_user(user_client, 'edit_message_caption', target_channel_id,
+                                                 message_id=row['target_msg_id'], caption=final_text,
+                                                 caption_entities=to_pyrogram_entities(entities),
+                                                 parse_mode=ParseMode.DISABLED)
+                    else:
+                        await self._send_as_user(user_client, 'edit_message_text', target_channel_id,
+                                                 message_id=row['target_msg_id'], text=final_text,
+                                                 entities=to_pyrogram_entities(entities),
+                                                 parse_mode=ParseMode.DISABLED)
+            except (BadRequest, MessageNotModified) as e:
+                if 'not modified' not in str(e).lower():
+                    raise
+        
+        self.message_map.update_hash(config_id, original_message['message_id'], new_hash)
+        logger.info("✏️ Mirrored edit of message %s to %s", original_message['message_id'], target_channel_id)
+    
+    async def handle_deleted_messages(self, message_data: Dict[str, Any]):
+        """Xóa các message đích tương ứng với message nguồn đã bị xóa"""
+        config_id = message_data['config_id']
+        source_ids = message_data['message']['deleted_ids']
+        target_channel_id = message_data['target_channel_id']
+        
+        targets = {}
+        for source_id in source_ids:
+            for row in await self.message_map.get(config_id, source_id):
+                targets.setdefault(row['via'], []).append(row['target_msg_id'])
+        if not targets:
+            return
+        
+        # Bot API xóa tối đa 100 message mỗi lần
+        for start in range(0, len(targets.get('bot', [])), MAX_FORWARD_BATCH):
+            await self._send('delete_messages', target_channel_id,
+                             message_ids=targets['bot'][start:start + MAX_FORWARD_BATCH])
+        if targets.get('user'):
+            user_client = self.bot_instance.user_clients.get(message_data['user_id'])
+            if not user_client or not user_client.client or not user_client.client.is_connected:
+                raise ConnectionError(f"User client {message_data['user_id']} is not connected")
+            await self._send_as_user(user_client, 'delete_messages', target_channel_id, message_ids=targets['user'])
+        
+        self.message_map.remove(config_id, source_ids)
+        logger.info("🗑️ Mirrored deletion of %d message(s) to %s", len(source_ids), target_channel_id)
+    
+    async def get_copy_client(self, config: Dict[str, Any], target_channel_id, reply_markup=None):
+        """Trả về user client dùng để copy message, hoặc None nếu phải gửi qua bot"""
+        send_mode = config.get('send_mode') or self.default_send_mode
+        if send_mode == 'forward':
+            send_mode = 'auto'  # Message không forward được thì xử lý như auto
+        if send_mode not in SEND_MODES or send_mode == 'bot':
+            return None
+        if send_mode == 'auto' and reply_markup:
+            return None  # Tài khoản user không gắn được inline button
+        
+        user_client = self.bot_instance.user_clients.get(config['user_id'])
+        if not user_client or not user_client.client or not user_client.client.is_connected:
+            return None
+        if send_mode == 'auto' and not await user_client.can_post_to(int(target_channel_id)):
+            return None
+        return user_client
+    
+    async def _send_as_user(self, user_client, method_name: str, chat_id, **kwargs):
+        """Gọi method của pyrogram client thông qua rate limiter"""
+        method = metrics.timed(getattr(user_client.client, method_name), f"user.{method_name}")
+        return await self.rate_limiter.call(int(chat_id), method, chat_id=int(chat_id), **kwargs)
+    
+    async def forward_message_batch(self, config: Dict[str, Any], message_data: Dict[str, Any]):
+        """Forward một batch message của cùng source/config bằng một lần forward_messages"""
+        target_channel_id = message_data['target_channel_id']
+        parts = []
+        batch_keys = set()
+        for part in message_data['message']['forward_messages']:
+            if part.get('followup'):
+                parts.append((part, None))  # Text gửi sau sticker đã được render và kiểm tra trùng
+                continue
+            dedupe_key = self.duplicate_filter.message_key(target_channel_id, part)
+            if (self.duplicate_filter.is_duplicate(config['id'], dedupe_key)
+                    or (self.duplicate_filter.enabled and dedupe_key and dedupe_key in batch_keys)):
+                metrics.messages_filtered.inc(config['id'], 'duplicate')
+                logger.info("♻️ Duplicate message %s for target %s, skipping", part['message_id'], target_channel_id)
+                continue
+            batch_keys.add(dedupe_key)
+            parts.append((part, dedupe_key))
+        if not parts:
+            return
+        stamp(message_data, 'rendered')
+        
+        user_client = None
+        if not message_data.get('bot_fallback'):
+            user_client = await self.get_copy_client(dict(config, send_mode='auto'), target_channel_id)
+        if user_client:
+            message_ids = [part['message_id'] for part, _ in parts]
+            try:
+                logger.debug("⏩ Forwarding %d messages to %s", len(message_ids), target_channel_id)
+                forwarded = await self._send_as_user(
+                    user_client, 'forward_messages', target_channel_id,
+                    from_chat_id=int(message_data['source_channel_id']),
+                    message_ids=message_ids
+                )
+                for _, dedupe_key in parts:
+                    self.duplicate_filter.remember(dedupe_key)
+                # Message forward không sửa được nên chỉ lưu ánh xạ để mirror delete/reply
+                self.record_mapping(config['id'], {'forward_messages': [part for part, _ in parts]},
+                                    forwarded, 'user')
+                metrics.messages_sent.inc(config['id'], 'forward', amount=len(parts))
+                self.latency.record(message_data)
+                return
+            except ChatParked:
+                raise
+            except Exception as e:
+                logger.warning("⚠️ Forward via user client failed, falling back to bot: %s: %s", type(e).__name__, e)
+        
+        # Không forward được: gửi từng message qua bot, mỗi lần dispatch một message;
+        # phần còn lại chờ rate limit của chat trong hàng đợi hoãn thay vì chờ trong worker
+        (part, dedupe_key), rest = parts[0], [part for part, _ in parts[1:]]
+        if part.get('followup'):
+            await self.send_followup(config, target_channel_id, part)
+        else:
+            final_text = part.get('text') or part.get('caption') or ''
+            sent = await self.send_processed_message(
                 target_channel_id=target_channel_id,
-                message_data=original_message,
+                message_data=part,
                 final_text=final_text,
-                reply_markup=reply_markup
+                user_client=user_client or self.bot_instance.user_clients.get(config['user_id']),
+                entities=part.get('entities')
             )
+            self.duplicate_filter.remember(dedupe_key)
+            self.record_mapping(config['id'], part, sent, 'bot')
+            metrics.messages_sent.inc(config['id'], 'bot')
+            if part.get('sticker') and final_text.strip():
+                rest.insert(0, self.followup_text(part, final_text, part.get('entities'), 'bot'))
+        if rest:
+            self.defer_parts(message_data, rest)
+        self.latency.record(message_data)
+    
+    @staticmethod
+    def followup_text(original_message: Dict[str, Any], final_text: str, entities, via: str) -> Dict[str, Any]:
+        """Phần text (đã render) gửi riêng sau một message, ví dụ text đi kèm sticker"""
+        return {'message_id': original_message['message_id'], 'text': final_text,
+                'entities': entities, 'followup': via}
+    
+    def defer_parts(self, message_data: Dict[str, Any], parts: List[Dict[str, Any]]):
+        """Hoãn các phần còn lại của message nhiều phần qua hàng đợi của chat đích (không chờ trong worker).
+        
+        Message được đổi thành batch chỉ gồm các phần còn lại và gửi tiếp qua bot khi chat hết phải chờ.
+        """
+        message_data['message'] = dict(message_data['message'], forward_messages=parts)
+        message_data['bot_fallback'] = True
+        chat_id = int(message_data['target_channel_id'])
+        raise ChatParked(chat_id, self.rate_limiter.chat_delay(chat_id), flood=False)
+    
+    async def send_followup(self, config: Dict[str, Any], target_channel_id, part: Dict[str, Any]):
+        """Gửi phần text của followup_text qua đúng đường đã gửi message chính"""
+        user_client = self.bot_instance.user_clients.get(config['user_id'])
+        if part['followup'] == 'user' and user_client:
+            await self._send_as_user(
+                user_client, 'send_message', target_channel_id,
+                text=part['text'],
+                entities=to_pyrogram_entities(part['entities']),
+                parse_mode=ParseMode.DISABLED
+            )
+        else:
+            await self._send(
+                'send_message',
+                target_channel_id,
+                text=part['text'],
+                entities=to_bot_entities(part['entities']),
+                reply_markup=self.render_plans.get(config).reply_markup
+            )
+    
+    async def copy_processed_message(self, user_client, source_channel_id, target_channel_id,
+                                     message_data: Dict, final_text: str, entities: List[Dict] = None,
+                                     reply_to: int = None):
+        """Copy message server-side bằng user client (không tải file); trả về các message đã gửi, None nếu cần gửi qua bot"""
+        sent = []
+        try:
+            pyrogram_entities = to_pyrogram_entities(entities)
+            source_chat_id = int(source_channel_id)
+            message_id = message_data['message_id']
             
-            print(f"✅ Message processed and sent to {target_channel_id}")
-            
+            if message_data.get('media_group'):
+                logger.debug("🖼️ Copying album %s via user client", message_id)
+                # copy_media_group không nhận entities: chuyển sang HTML để pyrogram parse lại
+                caption = HTML.unparse(final_text, pyrogram_entities) if pyrogram_entities else final_text
+                media_parts = [part for part in message_data['media_group'] if self._album_media_type(part)]
+                caption_at = self.caption_index(media_parts)
+                sent = await self._send_as_user(
+                    user_client, 'copy_media_group', target_channel_id,
+                    from_chat_id=source_chat_id,
+                    message_id=message_id,
+                    reply_to_message_id=reply_to,
+                    captions=caption if caption_at == 0 else [''] * caption_at + [caption]
+                )
+            elif self._album_media_type(message_data) or message_data.get('voice') or message_data.get('sticker'):
+                logger.debug("📋 Copying message %s via user client", message_id)
+                sent = await self._send_as_user(
+                    user_client, 'copy_message', target_channel_id,
+                    from_chat_id=source_chat_id,
+                    message_id=message_id,
+                    reply_to_message_id=reply_to,
+                    caption=final_text,
+                    caption_entities=pyrogram_entities,
+                    parse_mode=ParseMode.DISABLED
+                )
+            elif final_text.strip():
+                logger.debug("💬 Sending text via user client")
+                sent = await self._send_as_user(
+                    user_client, 'send_message', target_channel_id,
+                    reply_to_message_id=reply_to,
+                    text=final_text,
+                    entities=pyrogram_entities,
+                    parse_mode=ParseMode.DISABLED
+                )
+            else:
+                logger.debug("⚠️ No text content to send")
+            return sent
+        
+        except ChatParked:
+            raise
         except Exception as e:
-            print(f"❌ Error handling incoming message: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning("⚠️ Copy via user client failed, falling back to bot: %s: %s", type(e).__name__, e)
+            return None
     
     async def send_processed_message(self, target_channel_id: int, message_data: Dict, 
-                                   final_text: str, reply_markup=None):
-        """Gửi tin nhắn đã xử lý đến channel đích qua bot telegram"""
+                                   final_text: str, reply_markup=None, user_client=None, entities: List[Dict] = None,
+                                   reply_to: int = None):
+        """Gửi tin nhắn đã xử lý đến channel đích qua bot telegram, trả về message đã gửi"""
+        if not self.bot_instance.bot_instance:
+            raise RuntimeError("Bot instance not available")
+        
+        # Dùng file_id của bot đã có trong cache, chỉ relay các media còn thiếu.
+        # Lỗi được raise lên worker: lỗi mạng/quyền được retry có backoff
+        cached = await self.file_id_cache.resolve(message_data, self.bot_sender)
         try:
-            if not self.bot_instance.bot_instance:
-                print("❌ Bot instance not available")
-                return
+            sent = await self._relay_and_send(target_channel_id, message_data, final_text,
+                                              entities, reply_markup, user_client, cached, reply_to)
+        except BadRequest as e:
+            # BadRequest khác (caption quá dài, entity sai...) là lỗi vĩnh viễn: worker chuyển thẳng vào dead letter
+            if not cached or not is_file_id_error(e):
+                raise
+            logger.info("♻️ Cached file_id rejected (%s), re-uploading", e)
+            self.file_id_cache.invalidate_message(message_data, self.bot_sender)
+            sent = await self._relay_and_send(target_channel_id, message_data, final_text,
+                                              entities, reply_markup, user_client, {}, reply_to)
+        self.remember_file_ids(message_data, sent)
+        return sent
+    
+    async def _relay_and_send(self, target_channel_id, message_data: Dict, final_text: str,
+                              entities, reply_markup, user_client, cached: Dict, reply_to: int = None):
+        # file_id của user session không dùng được cho bot: relay media qua user client
+        async with self.media_relay.relay(user_client, message_data, exclude=cached) as relayed:
+            return await self._send_with_bot(target_channel_id, message_data, final_text,
+                                             entities, reply_markup, dict(cached, **relayed), reply_to)
+    
+    def remember_file_ids(self, message_data: Dict, sent):
+        """Lưu file_id phía bot của các media vừa gửi vào cache"""
+        if not sent:
+            return
+        results = list(sent) if isinstance(sent, (list, tuple)) else [sent]
+        for (media_type, media), result in zip(self.file_id_cache.media_parts(message_data), results):
+            file_id = extract_file_id(result, media_type)
+            if file_id and media.get('file_unique_id'):
+                self.file_id_cache.put(media['file_unique_id'], self.bot_sender, file_id)
+    
+    async def _send_with_bot(self, target_channel_id, message_data: Dict, final_text: str,
+                             entities, reply_markup, sources: Dict, reply_to: int = None):
+        """Gọi send_* của bot theo loại tin nhắn; sources ánh xạ file_id gốc sang file_id của bot hoặc file đã relay"""
+        sent = None
+        # Gửi kèm entities thay vì parse Markdown nên nội dung nguồn có '_' hay '*' cũng không bị từ chối
+        bot_entities = to_bot_entities(entities)
+        reply = {'reply_parameters': ReplyParameters(reply_to, allow_sending_without_reply=True)} if reply_to else {}
+        logger.debug("🎯 Sending to channel %s, message keys: %s", target_channel_id, list(message_data))
+        
+        media_group = self.build_media_group(message_data.get('media_group') or [], final_text, sources, entities)
+        if len(media_group) == 1:
+            # Album chỉ còn một media hợp lệ thì gửi như tin nhắn thường
+            message_data = next(part for part in message_data['media_group']
+                                if self._album_media_type(part))
+        
+        # Xử lý các loại tin nhắn khác nhau
+        if len(media_group) > 1:
+            logger.debug("🖼️ Sending album with %d items", len(media_group))
+            if reply_markup:
+                logger.info("⚠️ Inline button is not supported for albums, skipping button")
+            sent = await self._send(
+                'send_media_group',
+                target_channel_id,
+                media=media_group,
+                **reply
+            )
             
-            print(f"🎯 Debug - Sending to channel {target_channel_id}")
-            print(f"📊 Debug - Message data keys: {list(message_data.keys())}")
+        elif message_data.get('photo'):
+            logger.debug("📸 Sending photo with caption")
+            sent = await self._send(
+                'send_photo',
+                target_channel_id,
+                photo=sources.get(message_data['photo']['file_id'], message_data['photo']['file_id']),
+                caption=final_text if final_text.strip() else None,
+                caption_entities=bot_entities if final_text.strip() else None,
+                reply_markup=reply_markup,
+                **reply
+            )
             
-            # Xử lý các loại tin nhắn khác nhau
-            if message_data.get('photo'):
-                print(f"📸 Debug - Sending photo with caption")
-                await self.bot_instance.bot_instance.send_photo(
-                    chat_id=target_channel_id,
-                    photo=message_data['photo']['file_id'],
-                    caption=final_text if final_text.strip() else None,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
-            elif message_data.get('video'):
-                print(f"🎬 Debug - Sending video with caption")
-                await self.bot_instance.bot_instance.send_video(
-                    chat_id=target_channel_id,
-                    video=message_data['video']['file_id'],
-                    caption=final_text if final_text.strip() else None,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
-            elif message_data.get('document'):
-                print(f"📎 Debug - Sending document with caption")
-                await self.bot_instance.bot_instance.send_document(
-                    chat_id=target_channel_id,
-                    document=message_data['document']['file_id'],
-                    caption=final_text if final_text.strip() else None,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
-            elif message_data.get('audio'):
-                print(f"🎵 Debug - Sending audio with caption")
-                await self.bot_instance.bot_instance.send_audio(
-                    chat_id=target_channel_id,
-                    audio=message_data['audio']['file_id'],
-                    caption=final_text if final_text.strip() else None,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+        elif message_data.get('video'):
+            logger.debug("🎬 Sending video with caption")
+            sent = await self._send(
+                'send_video',
+                target_channel_id,
+                video=sources.get(message_data['video']['file_id'], message_data['video']['file_id']),
+                caption=final_text if final_text.strip() else None,
+                caption_entities=bot_entities if final_text.strip() else None,
+                reply_markup=reply_markup,
+                **reply
+            )
+            
+        elif message_data.get('document'):
+            logger.debug("📎 Sending document with caption")
+            sent = await self._send(
+                'send_document',
+                target_channel_id,
+                document=sources.get(message_data['document']['file_id'], message_data['document']['file_id']),
+                caption=final_text if final_text.strip() else None,
+                caption_entities=bot_entities if final_text.strip() else None,
+                reply_markup=reply_markup,
+                **reply
+            )
+            
+        elif message_data.get('audio'):
+            logger.debug("🎵 Sending audio with caption")
+            sent = await self._send(
+                'send_audio',
+                target_channel_id,
+                audio=sources.get(message_data['audio']['file_id'], message_data['audio']['file_id']),
+                caption=final_text if final_text.strip() else None,
+                caption_entities=bot_entities if final_text.strip() else None,
+                reply_markup=reply_markup,
+                **reply
+            )
+            
+        elif message_data.get('voice'):
+            logger.debug("🎤 Sending voice note")
+            sent = await self._send(
+                'send_voice',
+                target_channel_id,
+                voice=sources.get(message_data['voice']['file_id'], message_data['voice']['file_id']),
+                caption=final_text if final_text.strip() else None,
+                caption_entities=bot_entities if final_text.strip() else None,
+                reply_markup=reply_markup,
+                **reply
+            )
+            
+        elif message_data.get('sticker'):
+            logger.debug("🔖 Sending sticker")
+            sent = await self._send(
+                'send_sticker',
+                target_channel_id,
+                sticker=sources.get(message_data['sticker']['file_id'], message_data['sticker']['file_id']),
+                reply_markup=reply_markup,
+                **reply
+            )
+            # Text đi kèm được gửi riêng sau sticker (xem followup_text)
                 
-            elif message_data.get('voice'):
-                print(f"🎤 Debug - Sending voice note")
-                await self.bot_instance.bot_instance.send_voice(
-                    chat_id=target_channel_id,
-                    voice=message_data['voice']['file_id'],
-                    caption=final_text if final_text.strip() else None,
+        else:
+            logger.debug("💬 Sending text message only")
+            if final_text.strip():
+                sent = await self._send(
+                    'send_message',
+                    target_channel_id,
+                    text=final_text,
+                    entities=bot_entities,
                     reply_markup=reply_markup,
-                    parse_mode='Markdown'
+                    **reply
                 )
-                
-            elif message_data.get('sticker'):
-                print(f"🔖 Debug - Sending sticker")
-                await self.bot_instance.bot_instance.send_sticker(
-                    chat_id=target_channel_id,
-                    sticker=message_data['sticker']['file_id'],
-                    reply_markup=reply_markup
-                )
-                # Gửi text riêng nếu có
-                if final_text.strip():
-                    print(f"💬 Debug - Sending text separately after sticker")
-                    await self.bot_instance.bot_instance.send_message(
-                        chat_id=target_channel_id,
-                        text=final_text,
-                        reply_markup=reply_markup,
-                        parse_mode='Markdown'
-                    )
-                    
             else:
-                print(f"💬 Debug - Sending text message only")
-                if final_text.strip():
-                    await self.bot_instance.bot_instance.send_message(
-                        chat_id=target_channel_id,
-                        text=final_text,
-                        reply_markup=reply_markup,
-                        parse_mode='Markdown'
-                    )
-                else:
-                    print(f"⚠️ Debug - No text content to send")
+                logger.debug("⚠️ No text content to send")
+        return sent
+    
+    @staticmethod
+    def _album_media_type(part: Dict) -> str:
+        for media_type in ('photo', 'video', 'document', 'audio'):
+            if part.get(media_type):
+                return media_type
+        return None
+    
+    @staticmethod
+    def caption_index(media_parts: List[Dict]) -> int:
+        """Vị trí trong album của phần mang caption ở nguồn (cùng quy tắc với build_album_message), mặc định 0"""
+        return next((index for index, part in enumerate(media_parts) if part.get('caption')), 0)
+    
+    def build_media_group(self, parts: List[Dict], final_text: str, sources: Dict = None,
+                          entities: List[Dict] = None) -> List:
+        """Tạo danh sách InputMedia cho album, caption chỉ gắn vào media tương ứng với phần mang caption ở nguồn"""
+        input_media_types = {
+            'photo': InputMediaPhoto,
+            'video': InputMediaVideo,
+            'document': InputMediaDocument,
+            'audio': InputMediaAudio
+        }
         
-        except Exception as e:
-            print(f"❌ Error sending processed message: {e}")
-            print(f"❌ Debug - Error details: {type(e).__name__}: {str(e)}")
-            # Fallback: try to send as plain text without markdown
-            try:
-                print(f"🔄 Debug - Trying fallback without markdown")
-                if final_text.strip():
-                    await self.bot_instance.bot_instance.send_message(
-                        chat_id=target_channel_id,
-                        text=final_text,
-                        reply_markup=reply_markup
-                    )
-                    print(f"✅ Debug - Fallback successful")
-            except Exception as fallback_error:
-                print(f"❌ Fallback send also failed: {fallback_error}")
-                print(f"❌ Debug - Fallback error details: {type(fallback_error).__name__}: {str(fallback_error)}")
+        media_group = []
+        caption_at = self.caption_index([part for part in parts if self._album_media_type(part)])
+        for part in parts:
+            media_type = self._album_media_type(part)
+            if not media_type:
+                continue
+            caption = final_text if len(media_group) == caption_at and final_text.strip() else None
+            file_id = part[media_type]['file_id']
+            media_group.append(input_media_types[media_type](
+                (sources or {}).get(file_id, file_id),
+                caption=caption,
+                caption_entities=to_bot_entities(entities) if caption else None
+            ))
+        return media_group
     
     async def shutdown(self):
         """Shutdown message processor"""
-        print("🔄 Shutting down message processor...")
-        if self.processing_task and not self.processing_task.done():
-            await self.message_queue.put(None)  # Shutdown signal
-            try:
-                await asyncio.wait_for(self.processing_task, timeout=5.0)
-            except asyncio.TimeoutError:
-                self.processing_task.cancel()
-        print("✅ Message processor shutdown complete") 
\ No newline at end of file
+        logger.info("🔄 Shutting down message processor...")
+        await self.backfill.close()
+        running = [task for task in self.worker_tasks if not task.done()]
+        if running:
+            for queue in self.shard_queues:
+                await queue.put(None)  # Shutdown signal cho từng worker
+            done, pending = await asyncio.wait(running, timeout=5.0)
+            for task in pending:
+                task.cancel()
+        for task in list(self.deferred_tasks):
+            task.cancel()
+        await self.retry_scheduler.close()
+        if not self.outbox:
+            # Không có outbox để replay: giữ các retry đang chờ lại dưới dạng dead letter
+            for message_data in self.retry_scheduler.pending():
+                self.db.add_dead_letter(message_data, 'shutdown', 'Retry pending at shutdown')
+        self.pattern_matcher.shutdown()
+        self.duplicate_filter.save()
+        await self.progress.close()
+        await self.file_id_cache.close()
+        if self.message_map:
+            await self.message_map.close()
+        if self.outbox:
+            await self.outbox.close()
+        logger.info("✅ Message processor shutdown complete") 
\ No newline at end of file
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import os
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class ProgressTracker:
+    """Message nguồn mới nhất đã xử lý của mỗi config; ghi xuống DB theo batch, có debounce"""
+
+    def __init__(self, db):
+        self.db = db
+        self.flush_delay = float(os.getenv('PROGRESS_FLUSH_INTERVAL', '2.0'))
+        self.progress: Dict[int, int] = db.get_config_progress()
+        self.dirty: Dict[int, int] = {}
+        self.changed = None
+        self.task = None
+
+    def start(self):
+        self.changed = asyncio.Event()
+        self.task = asyncio.create_task(self._flush_loop())
+
+    def get(self, config_id: int) -> int:
+        """0 nghĩa là config chưa xử lý message nào"""
+        return self.progress.get(config_id, 0)
+
+    def mark(self, config_id: int, message_id: int):
+        if message_id > self.progress.get(config_id, 0):
+            self.progress[config_id] = message_id
+            self.dirty[config_id] = message_id
+            if self.changed:
+                self.changed.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self.changed.wait()
+            # Debounce: gom các thay đổi trong một khoảng rồi ghi một transaction
+            await asyncio.sleep(self.flush_delay)
+            self.changed.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("⚠️ Config progress flush failed, will retry: %s", e)
+                self.changed.set()
+
+    async def flush(self):
+        """Ghi các tiến độ đã đổi trong thread pool, không chặn event loop"""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.db.save_config_progress, dirty)
+        except BaseException:
+            # Kể cả khi bị cancel lúc close: ghi lại ở lần flush sau (ghi trùng vô hại vì id không lùi)
+            self.dirty = {**dirty, **self.dirty}
+            raise
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("⚠️ Final config progress flush failed: %s", e)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+from telegram.error import RetryAfter
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+class ChatParked(Exception):
+    """Chat đích đang bị flood-wait (hoặc phải chờ rate limit), message cần được xếp lịch gửi lại.
+
+    flood=False: không phải lỗi mà là phần tiếp theo của message nhiều phần đang chờ rate limit của chat,
+    nên không tính vào số lần retry flood-wait.
+    """
+
+    def __init__(self, chat_id: int, retry_after: float, flood: bool = True):
+        super().__init__(f"Chat {chat_id} parked for {retry_after:.1f}s")
+        self.chat_id = chat_id
+        self.retry_after = retry_after
+        self.flood = flood
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Lấy thời gian chờ (giây) từ RetryAfter của Bot API hoặc FloodWait của Pyrogram"""
+    if isinstance(error, RetryAfter):
+        value = error.retry_after
+        return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+    if isinstance(error, FloodWait):
+        return float(error.value)
+    return None
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Số giây cần chờ đến khi có token"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+class RateLimiter:
+    """Giới hạn tốc độ gửi: một bucket global và một bucket cho mỗi chat_id"""
+
+    def __init__(self):
+        global_rate = float(os.getenv('GLOBAL_RATE_LIMIT', '30'))
+        self.chat_messages = max(1, int(os.getenv('RATE_LIMIT_MESSAGES', '20')))
+        self.chat_period = float(os.getenv('RATE_LIMIT_PERIOD', '60'))
+        self.copy_delay = float(os.getenv('COPY_DELAY_SECONDS', '1.0'))
+
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.last_sent: Dict[int, float] = {}
+        self.parked_until: Dict[int, float] = {}
+        self.park_count = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_messages / self.chat_period, self.chat_messages)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def chat_delay(self, chat_id: int) -> float:
+        """Số giây chat này cần chờ trước lần gửi tiếp theo (flood-wait, delay, bucket)"""
+        now = time.monotonic()
+        delay = self.parked_until.get(chat_id, 0.0) - now
+
+        last_sent = self.last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = max(delay, last_sent + self.copy_delay - now)
+
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is not None:
+            delay = max(delay, bucket.delay(now))
+
+        return max(0.0, delay)
+
+    def is_parked(self, chat_id: int) -> bool:
+        return self.parked_until.get(chat_id, 0.0) > time.monotonic()
+
+    def park(self, chat_id: int, seconds: float):
+        """Tạm dừng gửi tới chat trong khoảng thời gian Telegram yêu cầu"""
+        until = time.monotonic() + seconds
+        self.parked_until[chat_id] = max(self.parked_until.get(chat_id, 0.0), until)
+        self.park_count += 1
+        logger.warning("🅿️ Chat %s parked for %.1fs (flood wait)", chat_id, seconds)
+
+    async def acquire(self, chat_id: int):
+        """Chờ đến khi được phép gửi tới chat rồi trừ token"""
+        while True:
+            now = time.monotonic()
+            delay = max(self.chat_delay(chat_id), self.global_bucket.delay(now))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        now = time.monotonic()
+        self.global_bucket.consume(now)
+        self._chat_bucket(chat_id).consume(now)
+        self.last_sent[chat_id] = now
+
+    async def call(self, chat_id: int, method, /, *args, **kwargs):
+        """Gọi một hàm send_* sau khi qua limiter; flood-wait sẽ park chat và raise ChatParked"""
+        await self.acquire(chat_id)
+        try:
+            return await method(*args, **kwargs)
+        except (RetryAfter, FloodWait) as e:
+            retry_after = get_retry_after(e)
+            self.park(chat_id, retry_after)
+            raise ChatParked(chat_id, retry_after) from e
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Tuple
+from telegram import InputFile
+from bot.messages.transfer import TransferEngine
+from bot.messages.media_cache import MediaCache
+
+logger = logging.getLogger(__name__)
+
+# Bot API chỉ cho phép upload file tối đa 50MB
+BOT_UPLOAD_LIMIT = 50 * 1024 * 1024
+RELAY_MEDIA_TYPES = ('photo', 'video', 'document', 'audio', 'voice', 'sticker')
+DEFAULT_FILE_NAMES = {
+    'photo': 'photo.jpg',
+    'video': 'video.mp4',
+    'document': 'document',
+    'audio': 'audio.mp3',
+    'voice': 'voice.ogg',
+    'sticker': 'sticker.webp'
+}
+
+class ByteBudget:
+    """Giới hạn tổng số byte bộ nhớ mà các relay đang giữ cùng lúc"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.used = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, size: int) -> int:
+        # Một yêu cầu lớn hơn cả budget vẫn được chạy (một mình) thay vì chờ mãi
+        size = min(size, self.capacity)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.used + size <= self.capacity)
+            self.used += size
+        return size
+
+    async def release(self, size: int):
+        async with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+class MediaRelay:
+    """Tải media qua user client theo từng chunk vào SpooledTemporaryFile rồi upload lại qua bot"""
+
+    def __init__(self):
+        self.enabled = os.getenv('RELAY_ENABLED', 'True').lower() == 'true'
+        self.spool_max_bytes = int(os.getenv('RELAY_SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+        self.budget = ByteBudget(int(os.getenv('RELAY_MEMORY_BUDGET_BYTES', str(128 * 1024 * 1024))))
+        self.transfer_engine = TransferEngine()
+        self.media_cache = MediaCache()
+        self.stats = {'relayed': 0, 'bytes': 0, 'skipped': 0, 'active': 0}
+
+    @staticmethod
+    def media_of(part: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        for media_type in RELAY_MEDIA_TYPES:
+            if part.get(media_type):
+                return media_type, part[media_type]
+        return None
+
+    async def _download(self, user_client, media: Dict[str, Any]):
+        """Stream file vào spool: nhỏ thì nằm trong RAM, lớn hơn spool_max_bytes thì chuyển xuống disk"""
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+        try:
+            transfer = await self.transfer_engine.download(
+                user_client.client, media['file_id'], media.get('file_size') or 0, spool,
+                max_bytes=BOT_UPLOAD_LIMIT
+            )
+            return spool, transfer['bytes']
+        except BaseException:
+            spool.close()
+            raise
+
+    @asynccontextmanager
+    async def relay(self, user_client, message_data: Dict[str, Any], exclude=()):
+        """Yield dict file_id -> InputFile cho các media của message (rỗng nếu không relay được)"""
+        parts = [part for part in (message_data.get('media_group') or [message_data])
+                 if self.media_of(part) and self.media_of(part)[1]['file_id'] not in exclude]
+        if (not parts or not self.enabled or not user_client
+                or not user_client.client or not user_client.client.is_connected):
+            yield {}
+            return
+
+        sizes = [self.media_of(part)[1].get('file_size') for part in parts]
+        if any(size and size > BOT_UPLOAD_LIMIT for size in sizes):
+            logger.warning("⚠️ Media larger than %dMB cannot be uploaded by the bot, skipping relay",
+                           BOT_UPLOAD_LIMIT // (1024 * 1024))
+            self.stats['skipped'] += 1
+            yield {}
+            return
+
+        # Mỗi file giữ tối đa spool_max_bytes trong RAM; upload được stream thẳng từ spool
+        memory = sum(min(size or self.spool_max_bytes, self.spool_max_bytes) for size in sizes)
+        reserved = await self.budget.acquire(memory)
+        self.stats['active'] += 1
+        spools = []
+        try:
+            sources = {}
+            for part in parts:
+                media_type, media = self.media_of(part)
+                # Media đã tải trước đó (cho target/account khác) được đọc lại từ cache trên disk
+                spool, size = self.media_cache.open(media.get('file_unique_id')), 0
+                if not spool:
+                    spool, size = await self._download(user_client, media)
+                spools.append(spool)
+                if size:
+                    await self.media_cache.store(media.get('file_unique_id'), spool, size)
+                sources[media['file_id']] = InputFile(
+                    spool,
+                    filename=media.get('file_name') or DEFAULT_FILE_NAMES[media_type],
+                    read_file_handle=False
+                )
+                self.stats['bytes'] += size
+            self.stats['relayed'] += len(parts)
+            logger.debug("📦 Relayed %d media file(s) via user client", len(parts))
+            yield sources
+        finally:
+            for spool in spools:
+                spool.close()
+            self.stats['active'] -= 1
+            await self.budget.release(reserved)
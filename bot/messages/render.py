@@ -0,0 +1,129 @@
+import re
+import string
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bot.messages.entities import escape_markdown, parse_markdown, shift_entities, utf16_len
+
+def _source_title(message: Dict[str, Any]):
+    return escape_markdown(message.get('source_title') or '')
+
+def _date(message: Dict[str, Any]):
+    # Trả về datetime để header/footer dùng format spec, ví dụ {date:%d/%m/%Y}
+    return datetime.fromisoformat(message['date']) if message.get('date') else datetime.now()
+
+# Biến template dùng được trong header/footer
+TEMPLATE_FIELDS = {
+    'source_title': _source_title,
+    'date': _date
+}
+
+# Format spec của header/footer do user nhập: chỉ cho phép căn lề/độ rộng nhỏ cho text và
+# các mã strftime thông dụng cho ngày, để spec như {source_title:>10000000} không làm phình message
+TEMPLATE_MAX_WIDTH = 64
+_TEXT_SPEC = re.compile(r'(?:[^{}]?[<>^])?(\d{1,2})?(?:\.(\d{1,4}))?\Z', re.DOTALL)
+_DATE_SPEC = re.compile(r'(?:[^%{}]|%[aAbBdHIjmMpSyYzZ%])*\Z', re.DOTALL)
+_DATE_SPEC_MAX_LENGTH = 64
+
+def _check_spec(field: str, spec: str) -> Optional[str]:
+    """Thông báo lỗi nếu format spec của field không được phép, None nếu hợp lệ"""
+    if not spec:
+        return None
+    if field == 'date':
+        if len(spec) > _DATE_SPEC_MAX_LENGTH or not _DATE_SPEC.match(spec):
+            return f"`{{date:{spec}}}` chỉ được dùng các mã ngày giờ như `%d/%m/%Y %H:%M`"
+        return None
+    match = _TEXT_SPEC.match(spec)
+    if not match or int(match.group(1) or 0) > TEMPLATE_MAX_WIDTH:
+        return f"`{{{field}:{spec}}}` chỉ được căn lề với độ rộng tối đa {TEMPLATE_MAX_WIDTH}, ví dụ `{{{field}:^20}}`"
+    return None
+
+def _parse_template(text: str) -> Optional[List[Tuple[str, Optional[str], str]]]:
+    try:
+        pieces = [
+            (literal, field, spec or '')
+            for literal, field, spec, _ in string.Formatter().parse(text)
+        ]
+    except ValueError:
+        return None
+
+    fields = [field for _, field, _ in pieces if field is not None]
+    # Header cũ có thể chứa dấu ngoặc nhọn thường: chỉ coi là template khi mọi field đều được hỗ trợ
+    if not fields or any(field not in TEMPLATE_FIELDS for field in fields):
+        return None
+    return pieces
+
+def validate_template(text: str) -> Optional[str]:
+    """Kiểm tra header/footer khi lưu cấu hình, trả về thông báo lỗi hoặc None nếu hợp lệ"""
+    for _, field, spec in _parse_template(text) or ():
+        error = field is not None and _check_spec(field, spec)
+        if error:
+            return error
+    return None
+
+def compile_template(text: str) -> Optional[List[Tuple[str, Optional[str], str]]]:
+    """Tách text thành các đoạn (literal, field, format_spec); None nếu text không dùng biến template"""
+    pieces = _parse_template(text)
+    if pieces is None:
+        return None
+    # Config lưu trước khi có validate_template: bỏ spec không hợp lệ thay vì format theo nó
+    return [
+        (literal, field, spec if field is None or not _check_spec(field, spec) else '')
+        for literal, field, spec in pieces
+    ]
+
+class RenderPlan:
+    """Header/footer/button của một config được compile một lần, dùng lại cho mọi tin nhắn"""
+
+    __slots__ = ('prefix', 'suffix', 'prefix_template', 'suffix_template', 'reply_markup')
+
+    def __init__(self, config: Dict[str, Any]):
+        header = config.get('header_text') or ''
+        footer = config.get('footer_text') or ''
+        prefix = header + "\n\n" if header.strip() else ''
+        suffix = "\n\n" + footer if footer.strip() else ''
+        self.prefix_template = compile_template(prefix)
+        self.suffix_template = compile_template(suffix)
+        # Markdown của header/footer được parse sẵn thành text thuần + entities
+        self.prefix = parse_markdown(prefix)
+        self.suffix = parse_markdown(suffix)
+
+        # Markup của python-telegram-bot là immutable nên dùng chung được giữa các lần gửi
+        self.reply_markup = None
+        if (config.get('button_text') and config['button_text'].strip() and
+                config.get('button_url') and config['button_url'].strip()):
+            self.reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton(config['button_text'], url=config['button_url'])
+            ]])
+
+    @staticmethod
+    def _format(pieces, message: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        return parse_markdown(''.join(
+            literal + (format(TEMPLATE_FIELDS[field](message), spec) if field is not None else '')
+            for literal, field, spec in pieces
+        ))
+
+    def render(self, content: str, message: Dict[str, Any],
+               entities: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """Ghép header + nội dung + footer; entities của nội dung được dời theo độ dài header"""
+        prefix, prefix_entities = self._format(self.prefix_template, message) if self.prefix_template else self.prefix
+        suffix, suffix_entities = self._format(self.suffix_template, message) if self.suffix_template else self.suffix
+        offset = utf16_len(prefix)
+        return ''.join((prefix, content, suffix)), (
+            prefix_entities
+            + shift_entities(entities, offset)
+            + shift_entities(suffix_entities, offset + utf16_len(content))
+        )
+
+class RenderPlanCache:
+    """Cache RenderPlan theo config id; registry thay dict mới khi config đổi nên so sánh theo identity"""
+
+    def __init__(self):
+        self.plans: Dict[int, Tuple[Dict[str, Any], RenderPlan]] = {}
+
+    def get(self, config: Dict[str, Any]) -> RenderPlan:
+        entry = self.plans.get(config['id'])
+        if entry is None or entry[0] is not config:
+            entry = (config, RenderPlan(config))
+            self.plans[config['id']] = entry
+        return entry[1]
@@ -0,0 +1,108 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from typing import Dict, Any, Awaitable, Callable, List, Tuple
+from telegram.error import BadRequest as BotBadRequest, Forbidden, NetworkError
+from pyrogram.errors import (
+    BadRequest, Forbidden as UserForbidden, ChatAdminRequired, ChannelPrivate, InternalServerError
+)
+from bot.messages.rate_limiter import ChatParked
+
+logger = logging.getLogger(__name__)
+
+# Chính sách retry theo nhóm lỗi: số lần thử lại tối đa, delay cơ sở và delay tối đa (giây).
+# Flood-wait không nằm ở đây: message được hoãn theo chat đích để giữ thứ tự (xem defer_message)
+RETRY_POLICIES = {
+    'network': {'max_attempts': 6, 'base_delay': 2.0, 'max_delay': 300.0},
+    'permission': {'max_attempts': 2, 'base_delay': 60.0, 'max_delay': 900.0},
+    'invalid': {'max_attempts': 0, 'base_delay': 0.0, 'max_delay': 0.0},
+    'unknown': {'max_attempts': 3, 'base_delay': 5.0, 'max_delay': 300.0}
+}
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff có jitter: nửa cố định, nửa ngẫu nhiên để các retry không dồn cùng lúc"""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def classify_error(error: Exception) -> str:
+    """Xếp lỗi gửi tin nhắn vào một nhóm trong RETRY_POLICIES"""
+    if isinstance(error, ChatParked):
+        return 'flood'
+    if isinstance(error, (Forbidden, UserForbidden, ChatAdminRequired, ChannelPrivate)):
+        return 'permission'
+    # BadRequest của Bot API kế thừa NetworkError nên phải kiểm tra trước
+    if isinstance(error, (BotBadRequest, BadRequest)):
+        return 'invalid'
+    if isinstance(error, (NetworkError, InternalServerError, OSError, asyncio.TimeoutError)):
+        return 'network'
+    return 'unknown'
+
+class RetryScheduler:
+    """Hàng đợi retry dạng min-heap theo thời điểm đến hạn; một task nền đưa message trở lại queue"""
+
+    def __init__(self, resubmit: Callable[[Dict[str, Any]], Awaitable[None]],
+                 dead_letter: Callable[[Dict[str, Any], str, Exception], None]):
+        self.resubmit = resubmit
+        self.dead_letter = dead_letter
+        self.policies = {name: dict(policy) for name, policy in RETRY_POLICIES.items()}
+        self.policies['network']['max_attempts'] = int(os.getenv('RETRY_NETWORK_ATTEMPTS', '6'))
+        self.heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.stats = {'scheduled': 0, 'resubmitted': 0, 'dead_lettered': 0}
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def schedule(self, message_data: Dict[str, Any], error: Exception) -> bool:
+        """Xếp lịch gửi lại theo chính sách của lỗi; trả về False nếu message đã vào dead letter"""
+        error_class = classify_error(error)
+        policy = self.policies[error_class]
+        attempts = message_data.get('retry_attempts', 0)
+        if attempts >= policy['max_attempts']:
+            self.dead_letter(message_data, error_class, error)
+            self.stats['dead_lettered'] += 1
+            return False
+
+        delay = backoff_delay(attempts, policy['base_delay'], policy['max_delay'])
+        message_data['retry_attempts'] = attempts + 1
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), message_data))
+        self.stats['scheduled'] += 1
+        self.wakeup.set()
+        logger.warning("🔁 Retry %d/%d for config %s in %.1fs (%s: %s)", attempts + 1, policy['max_attempts'],
+                       message_data['config_id'], delay, error_class, type(error).__name__)
+        return True
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, message_data = heapq.heappop(self.heap)
+            try:
+                await self.resubmit(message_data)
+                self.stats['resubmitted'] += 1
+            except Exception as e:
+                logger.error("❌ Error resubmitting retry for config %s: %s", message_data['config_id'], e)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        return [message_data for _, _, message_data in sorted(self.heap)]
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats, pending=len(self.heap))
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
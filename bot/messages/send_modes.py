@@ -0,0 +1,15 @@
+from typing import Dict, Any
+
+# Cách gửi: auto = copy qua user client khi có quyền gửi vào channel đích, copy = luôn copy, bot = gửi lại qua bot,
+# forward = gom các message liên tiếp vào một lần forward_messages (chỉ với config không sửa nội dung)
+SEND_MODES = ('auto', 'copy', 'bot', 'forward')
+
+# Telegram cho phép forward tối đa 100 message mỗi lần
+MAX_FORWARD_BATCH = 100
+
+def uses_forward_mode(config: Dict[str, Any]) -> bool:
+    """Config có thể forward nguyên message không (send_mode forward và không có pattern/header/footer/button)"""
+    if config.get('send_mode') != 'forward':
+        return False
+    return not any((config.get(key) or '').strip()
+                   for key in ('extract_pattern', 'header_text', 'footer_text', 'button_text'))
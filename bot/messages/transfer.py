@@ -0,0 +1,109 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Any
+from pyrogram.errors import FloodWait
+
+# Pyrogram tải file theo từng chunk 1MB
+CHUNK_SIZE = 1024 * 1024
+
+class TransferError(Exception):
+    """Một phần của file không tải được sau khi đã thử lại"""
+
+class TransferEngine:
+    """Tải file qua user client bằng nhiều media session song song, mỗi session lấy một đoạn (part)"""
+
+    def __init__(self):
+        self.workers = max(1, int(os.getenv('TRANSFER_WORKERS', '4')))
+        self.part_chunks = max(1, int(os.getenv('TRANSFER_PART_CHUNKS', '8')))
+        self.max_part_retries = max(0, int(os.getenv('TRANSFER_PART_RETRIES', '3')))
+        self.max_flood_wait = float(os.getenv('TRANSFER_MAX_FLOOD_WAIT', '60'))  # tổng giây chờ flood-wait mỗi part
+        self.parallel_min_bytes = int(os.getenv('TRANSFER_PARALLEL_MIN_BYTES', str(16 * CHUNK_SIZE)))
+        self.recent = deque(maxlen=20)
+        self.totals = {'transfers': 0, 'bytes': 0, 'seconds': 0.0, 'part_retries': 0}
+
+    async def _fetch_part(self, client, file_id: str, offset: int, limit: int, output,
+                          max_bytes: int, transfer: Dict[str, Any]) -> int:
+        """Tải một đoạn [offset, offset + limit) chunk vào output, thử lại riêng đoạn này khi lỗi"""
+        attempt = 0
+        flood_waited = 0.0
+        while True:
+            position = offset * CHUNK_SIZE
+            try:
+                async for chunk in client.stream_media(file_id, limit=limit, offset=offset):
+                    if max_bytes and position + len(chunk) > max_bytes:
+                        raise ValueError(f"File exceeds {max_bytes} bytes")
+                    output.seek(position)
+                    output.write(chunk)
+                    position += len(chunk)
+                return position - offset * CHUNK_SIZE
+            except ValueError:
+                raise
+            except FloodWait as e:
+                # Flood-wait cũng tính vào số lần thử và có giới hạn tổng thời gian chờ,
+                # để một part không giữ slot relay và spool mãi
+                if attempt >= self.max_part_retries or flood_waited + e.value > self.max_flood_wait:
+                    raise TransferError(
+                        f"Part at chunk {offset} still flood-waited ({e.value}s) after {attempt + 1} attempts"
+                    ) from e
+                flood_waited += e.value
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                if attempt >= self.max_part_retries:
+                    raise TransferError(f"Part at chunk {offset} failed after {attempt + 1} attempts: {e}") from e
+                await asyncio.sleep(min(2 ** attempt, 10))
+            attempt += 1
+            transfer['retries'] += 1
+
+    async def download(self, client, file_id: str, file_size: int, output, max_bytes: int = 0) -> Dict[str, Any]:
+        """Tải file vào output (file object có seek); file lớn được chia part và tải song song"""
+        started = time.monotonic()
+        transfer = {'file_size': file_size, 'bytes': 0, 'parts': 1, 'retries': 0}
+
+        if not file_size or file_size < self.parallel_min_bytes or self.workers == 1:
+            # File nhỏ hoặc không rõ kích thước: một session tải tuần tự
+            transfer['bytes'] = await self._fetch_part(client, file_id, 0, 0, output, max_bytes, transfer)
+        else:
+            total_chunks = math.ceil(file_size / CHUNK_SIZE)
+            parts = deque(
+                (offset, min(self.part_chunks, total_chunks - offset))
+                for offset in range(0, total_chunks, self.part_chunks)
+            )
+            transfer['parts'] = len(parts)
+
+            async def worker():
+                # Mỗi worker giữ tối đa một part (một chunk trong bộ nhớ) tại một thời điểm
+                while parts:
+                    offset, limit = parts.popleft()
+                    size = await self._fetch_part(client, file_id, offset, limit, output, max_bytes, transfer)
+                    transfer['bytes'] += size
+
+            tasks = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(parts)))]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        output.seek(0)
+        transfer['seconds'] = time.monotonic() - started
+        transfer['throughput'] = transfer['bytes'] / transfer['seconds'] if transfer['seconds'] > 0 else 0.0
+        self.recent.append(transfer)
+        self.totals['transfers'] += 1
+        self.totals['bytes'] += transfer['bytes']
+        self.totals['seconds'] += transfer['seconds']
+        self.totals['part_retries'] += transfer['retries']
+        return transfer
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê throughput: tổng, trung bình và lần tải gần nhất"""
+        seconds = self.totals['seconds']
+        return dict(
+            self.totals,
+            average_throughput=self.totals['bytes'] / seconds if seconds > 0 else 0.0,
+            last=self.recent[-1] if self.recent else None
+        )
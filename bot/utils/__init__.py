@@ -7,6 +7,7 @@ Contains shared utilities, database operations, keyboards, and helper functions.
 from .states import *
 from .keyboards import Keyboards
 from .database import Database
+from .config_registry import ConfigRegistry, config_registry
 from .client import TelegramClient
 
 __all__ = [
@@ -17,5 +18,5 @@ __all__ = [
     'WAITING_FOR_BUTTON_TEXT', 'WAITING_FOR_BUTTON_URL',
     
     # Utilities
-    'Keyboards', 'Database', 'TelegramClient'
+    'Keyboards', 'Database', 'TelegramClient', 'ConfigRegistry', 'config_registry'
 ] 
\ No newline at end of file
@@ -1,15 +1,35 @@
 from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler, EditedMessageHandler, DeletedMessagesHandler
 from pyrogram.types import Message
 from pyrogram.errors import SessionPasswordNeeded, PeerIdInvalid, ChatAdminRequired
-from pyrogram.enums import ChatType
+from pyrogram.enums import ChatType, ChatMemberStatus
 import asyncio
+import logging
 import re
 import os
 import shutil
+import time
 from typing import Dict, List, Optional
 from bot.utils.database import Database
+from bot.messages.batching import KeyedBatcher
+from bot.messages.send_modes import uses_forward_mode, MAX_FORWARD_BATCH
+from bot.messages.entities import entities_from_pyrogram
+from bot.messages.retry import backoff_delay
+from bot.messages.backfill import newest_message_id, fetch_newer_messages
+from bot.messages.latency import stamp, source_timestamp
+from bot.utils.config_registry import config_registry
+from bot.utils.logger import set_trace, current_trace
+from bot.utils.metrics import metrics
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Telegram giới hạn một album tối đa 10 media
+MAX_ALBUM_SIZE = 10
+
+# Thời gian cache kết quả kiểm tra quyền gửi tin nhắn vào chat đích
+POST_PERMISSION_TTL = 600
+
 class TelegramClient:
     def __init__(self, user_id: int, api_id: int, api_hash: str, session_string: str = None, bot_instance=None):
         self.user_id = user_id
@@ -19,11 +39,44 @@ class TelegramClient:
         self.client = None
         self.db = Database()
         self.active_configs = {}
+        self.source_index: Dict[int, List[Dict]] = {}  # source_channel_id -> các config đang chạy
+        self.dispatcher_handler = None
+        self.dispatcher_client = None
         self.running_tasks = {}
         self.peer_cache = {}  # Cache for peer information
+        self.post_permissions = {}  # chat_id -> (có quyền gửi, thời điểm kiểm tra)
+        # Số file part tải/upload song song của client (mặc định của Pyrogram là 1)
+        self.transfer_workers = max(1, int(os.getenv('TRANSFER_WORKERS', '4')))
+        # Mirror edit/delete của source sang target (cần MESSAGE_MAP_ENABLED)
+        mirror_enabled = os.getenv('MESSAGE_MAP_ENABLED', 'True').lower() == 'true'
+        self.mirror_edits = mirror_enabled and os.getenv('MIRROR_EDITS', 'True').lower() == 'true'
+        self.mirror_deletes = mirror_enabled and os.getenv('MIRROR_DELETES', 'True').lower() == 'true'
+        # Copy bù sau khi reconnect: message live đến trong lúc copy bù được giữ lại rồi xử lý sau
+        self.catchup_max_messages = int(os.getenv('CATCHUP_MAX_MESSAGES_PER_CLIENT', '500'))
+        self.held_messages: Optional[List[Message]] = None
+        # Giới hạn việc giữ message live trong lúc copy bù: quá số message hoặc quá thời gian thì dừng copy bù
+        self.catchup_max_held = max(1, int(os.getenv('CATCHUP_MAX_HELD_MESSAGES', '1000')))
+        self.catchup_max_seconds = float(os.getenv('CATCHUP_MAX_SECONDS', '120'))
+        self.held_overflow = asyncio.Event()
+        self.held_draining: Optional[asyncio.Event] = None  # Set khi đã xả xong các message giữ lại
+        self.catchup_task = None
         self.bot_instance = bot_instance  # Reference to main bot for message queue
         self.session_name = f"sessions/user_{self.user_id}"
         
+        # Gom các phần của album theo (config_id, media_group_id) để gửi một lần
+        self.album_batcher = KeyedBatcher(
+            self._flush_album,
+            window=float(os.getenv('ALBUM_WINDOW_SECONDS', '1.0')),
+            max_items=MAX_ALBUM_SIZE
+        )
+        # Gom các message liên tiếp của config ở chế độ forward vào một lần forward_messages
+        self.forward_batcher = KeyedBatcher(
+            self._flush_forward,
+            window=float(os.getenv('FORWARD_WINDOW_SECONDS', '1.0')),
+            max_items=MAX_FORWARD_BATCH,
+            sliding=False
+        )
+        
         # Tạo thư mục sessions nếu chưa có
         os.makedirs("sessions", exist_ok=True)
     
@@ -63,7 +116,14 @@ class TelegramClient:
             'message_id': message.id,
             'text': getattr(message, 'text', None),
             'caption': getattr(message, 'caption', None),
-            'date': message.date.isoformat() if hasattr(message, 'date') and message.date else None
+            'date': message.date.isoformat() if hasattr(message, 'date') and message.date else None,
+            'media_group_id': getattr(message, 'media_group_id', None),
+            'reply_to_message_id': getattr(message, 'reply_to_message_id', None),
+            'source_title': getattr(message.chat, 'title', None) if getattr(message, 'chat', None) else None,
+            # Giữ định dạng gốc (offset UTF-16) để gửi lại bằng entities
+            'entities': entities_from_pyrogram(
+                getattr(message, 'entities', None) or getattr(message, 'caption_entities', None)
+            )
         }
         
         # Handle different media types
@@ -150,7 +210,8 @@ class TelegramClient:
                     self.session_name,
                     api_id=self.api_id,
                     api_hash=self.api_hash,
-                    workdir="."  # Dùng session file trong thư mục hiện tại
+                    workdir=".",  # Dùng session file trong thư mục hiện tại
+                    max_concurrent_transmissions=self.transfer_workers
                 )
                 
             elif has_session_string:
@@ -164,7 +225,8 @@ class TelegramClient:
                     api_id=self.api_id,
                     api_hash=self.api_hash,
                     session_string=self.session_string,
-                    workdir="."
+                    workdir=".",
+                    max_concurrent_transmissions=self.transfer_workers
                 )
                 
             else:
@@ -333,7 +395,8 @@ class TelegramClient:
                 self.session_name,
                 api_id=self.api_id,
                 api_hash=self.api_hash,
-                workdir="."  # Sử dụng session file
+                workdir=".",  # Sử dụng session file
+                max_concurrent_transmissions=self.transfer_workers
             )
             
             await self.client.connect()
@@ -527,51 +590,16 @@ class TelegramClient:
                 print(f"❌ Cannot access target channel {target_channel_id}: {target_error}")
                 return False
             
-            # Step 3: Lưu cấu hình đang chạy
+            # Step 3: Lưu cấu hình đang chạy và thêm vào index theo source channel
             self.active_configs[config_id] = config
+            self.source_index.setdefault(source_channel_id, []).append(config)
             print(f"📋 Debug - Active configs: {list(self.active_configs.keys())}")
             
-            # Step 4: Tạo một handler function cho config này
-            async def message_handler(client, message: Message):
-                try:
-                    # Kiểm tra xem config vẫn còn active không
-                    if config_id not in self.active_configs:
-                        print(f"⚠️ Config {config_id} is no longer active, ignoring message")
-                        return
-                    
-                    print(f"📥 Debug - New message received from {source_channel_id} for config {config_id}")
-                    print(f"📝 Debug - Message ID: {message.id}")
-                    
-                    # Safe string handling for debug logs
-                    message_text = getattr(message, 'text', None) or ''
-                    message_caption = getattr(message, 'caption', None) or ''
-                    
-                    print(f"📝 Debug - Message text: '{message_text[:100]}...'")
-                    print(f"📝 Debug - Message caption: '{message_caption[:100]}...'")
-                    print(f"📝 Debug - Message type: {type(message).__name__}")
-                    
-                    await self._process_and_copy_message(message, self.active_configs[config_id])
-                except PeerIdInvalid as e:
-                    print(f"Peer ID invalid when copying message: {e}")
-                    # Try to refresh the peer cache
-                    await self._cache_dialogs()
-                except Exception as e:
-                    print(f"Error copying message for config {config_id}: {e}")
-                    import traceback
-                    traceback.print_exc()
-            
-            # Step 5: Đăng ký message handler
-            handler = self.client.add_handler(
-                self.client.on_message(filters.chat(source_channel_id) & ~filters.service)(message_handler)
-            )
-            
-            # Lưu handler reference để có thể remove sau này
-            if not hasattr(self, 'message_handlers'):
-                self.message_handlers = {}
-            self.message_handlers[config_id] = handler
+            # Step 4: Đảm bảo dispatcher chung của client đã được đăng ký
+            self._ensure_dispatcher()
             
             print(f"✅ Started copying from {source_channel_id} to {target_channel_id}")
-            print(f"🎯 Debug - Message handler registered for channel {source_channel_id}, config {config_id}")
+            print(f"🎯 Debug - Config {config_id} added to dispatcher for channel {source_channel_id}")
             return True
             
         except Exception as e:
@@ -604,6 +632,8 @@ class TelegramClient:
     
     async def _validate_channel_access(self, channel_id: int, channel_type: str = "channel", retry: bool = True):
         """Validate channel access with retry mechanism and improved error handling"""
+        # Retry chạy inline thay vì qua RetryScheduler: caller (start_copying, /status) cần kết quả ngay,
+        # và hàm này chỉ chạy khi bật config/kiểm tra kênh, không nằm trên đường gửi message của worker
         max_retries = 3 if retry else 1
         
         for attempt in range(max_retries):
@@ -642,7 +672,7 @@ class TelegramClient:
                 if attempt < max_retries - 1:
                     print(f"🔄 Refreshing cache and retrying...")
                     await self._cache_dialogs()
-                    await asyncio.sleep(2)
+                    await asyncio.sleep(backoff_delay(attempt, 0.5, 4.0))
                 else:
                     print(f"❌ All attempts failed - channel {channel_id} is not accessible")
                     return None
@@ -658,28 +688,220 @@ class TelegramClient:
                     return None
                 
                 if attempt < max_retries - 1:
-                    print(f"🔄 Retrying in 2 seconds...")
-                    await asyncio.sleep(2)
+                    delay = backoff_delay(attempt, 1.0, 8.0)
+                    print(f"🔄 Retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
                 else:
                     print(f"❌ All validation attempts failed for {channel_type} channel {channel_id}")
                     return None
         
         return None
     
-    async def _process_and_copy_message(self, message: Message, config: Dict):
-        """Xử lý và gửi tin nhắn vào queue để bot telegram xử lý"""
+    def _ensure_dispatcher(self):
+        """Đăng ký một message handler duy nhất cho client (tra cứu config qua source_index)"""
+        if self.dispatcher_handler and self.dispatcher_client is self.client:
+            return
+        
+        async def is_indexed_source(_, __, message: Message):
+            return message.chat is not None and message.chat.id in self.source_index
+        
+        self.dispatcher_handler = self.client.add_handler(
+            MessageHandler(self._dispatch_message, filters.create(is_indexed_source) & ~filters.service)
+        )
+        if self.mirror_edits:
+            self.client.add_handler(
+                EditedMessageHandler(self._dispatch_edited_message, filters.create(is_indexed_source) & ~filters.service)
+            )
+        if self.mirror_deletes:
+            self.client.add_handler(
+                DeletedMessagesHandler(self._dispatch_deleted_messages, filters.create(is_indexed_source))
+            )
+        self.dispatcher_client = self.client
+        print(f"🎯 Debug - Message dispatcher registered for user {self.user_id}")
+    
+    async def _dispatch_message(self, client, message: Message):
+        """Chuyển tin nhắn tới tất cả config đang chạy của source channel"""
+        configs = self.source_index.get(message.chat.id)
+        if not configs:
+            return
+        if self.held_messages is not None:
+            self.held_messages.append(message)  # Đang copy bù: xử lý sau để giữ thứ tự
+            if len(self.held_messages) >= self.catchup_max_held:
+                self.held_overflow.set()
+            return
+        if self.held_draining is not None:
+            # Chờ xả xong để không vượt lên trước message đã giữ; handler bị chiếm nên không giữ thêm trong bộ nhớ
+            await self.held_draining.wait()
+        await self._copy_to_configs(message, configs)
+    
+    async def _copy_to_configs(self, message: Message, configs: List[Dict]):
+        """Convert message một lần rồi đưa vào queue cho từng config"""
+        # Gắn trace trước dòng log đầu tiên để dòng này được lấy mẫu cùng các dòng của config đầu tiên
+        trace = set_trace(configs[0]['id'], message.id)
         try:
-            print(f"🔄 Debug - Processing message {message.id} for config {config['id']}")
+            logger.debug("📥 New message %s from %s for %d config(s)", message.id, message.chat.id, len(configs))
+            message_dict = self.convert_message_to_dict(message)
+        except Exception as e:
+            logger.error("❌ Error converting message %s: %s", message.id, e)
+            return
+        finally:
+            current_trace.reset(trace)
+        
+        for config in list(configs):
+            try:
+                await self._process_and_copy_message(message, config, message_dict)
+            except PeerIdInvalid as e:
+                logger.warning("Peer ID invalid when copying message: %s", e)
+                # Try to refresh the peer cache
+                await self._cache_dialogs()
+            except Exception as e:
+                logger.exception("Error copying message for config %s: %s", config['id'], e)
+    
+    def hold_live_updates(self):
+        """Giữ lại message live cho đến khi copy bù xong (gọi trước khi đăng ký lại configs)"""
+        if self.held_messages is None:
+            self.held_messages = []
+    
+    async def catch_up(self):
+        """Copy các message nguồn mới hơn tiến độ đã lưu, sau đó mới xử lý các message live đã giữ lại"""
+        if self.catchup_task and not self.catchup_task.done():
+            return
+        self.hold_live_updates()
+        self.catchup_task = asyncio.create_task(self._catch_up())
+    
+    async def _catch_up(self):
+        caught_up: Dict[int, int] = {}  # source_channel_id -> message cuối cùng đã copy bù
+        self.held_overflow.clear()
+        copy_task = asyncio.create_task(self._copy_missed(caught_up))
+        overflow_task = asyncio.create_task(self.held_overflow.wait())
+        try:
+            await asyncio.wait({copy_task, overflow_task}, timeout=self.catchup_max_seconds,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not copy_task.done():
+                # Target chậm (queue block) có thể giữ message live trong bộ nhớ không giới hạn: dừng copy bù
+                reason = ('%d live messages held' % len(self.held_messages or [])
+                          if overflow_task.done() else 'CATCHUP_MAX_SECONDS=%.0f' % self.catchup_max_seconds)
+                logger.warning("⚠️ Catch-up for user %s stopped early (%s), releasing held messages",
+                               self.user_id, reason)
+                copy_task.cancel()
+            await asyncio.gather(copy_task, return_exceptions=True)
+        finally:
+            overflow_task.cancel()
+            # Ngừng giữ trước khi xả: message đến trong lúc xả chờ held_draining thay vì nối thêm vào list
+            held, self.held_messages = self.held_messages or [], None
+            self.held_draining = draining = asyncio.Event()
+            try:
+                for message in held:
+                    configs = self.source_index.get(message.chat.id)
+                    # Bỏ các message đã được copy bù
+                    if configs and message.id > caught_up.get(message.chat.id, 0):
+                        await self._copy_to_configs(message, configs)
+            finally:
+                self.held_draining = None
+                draining.set()
+            if self.held_messages is not None:
+                # hold_live_updates() được gọi lại trong lúc xả (khôi phục configs lần nữa): copy bù thêm một lượt
+                self.catchup_task = asyncio.create_task(self._catch_up())
+    
+    async def _copy_missed(self, caught_up: Dict[int, int]):
+        """Copy các message nguồn mới hơn tiến độ đã lưu, ghi lại message cuối đã copy của từng source"""
+        progress = self.bot_instance.message_processor.progress
+        budget = self.catchup_max_messages
+        try:
+            for source_channel_id, configs in list(self.source_index.items()):
+                # Config chưa từng xử lý message nào thì không có khoảng trống để bù
+                marks = {config['id']: progress.get(config['id']) for config in configs}
+                known = [mark for mark in marks.values() if mark]
+                if not known:
+                    continue
+                if budget <= 0:
+                    logger.warning("⚠️ Catch-up budget exhausted, skipping source %s", source_channel_id)
+                    continue
+                
+                after_id = min(known)
+                end_id = await newest_message_id(self.client, source_channel_id)
+                while after_id < end_id and budget > 0:
+                    messages = await fetch_newer_messages(self.client, source_channel_id, after_id, end_id,
+                                                          min(100, budget))
+                    if not messages:
+                        break
+                    for message in messages:
+                        if not message.service and not message.empty:
+                            message_dict = self.convert_message_to_dict(message)
+                            for config in configs:
+                                if marks[config['id']] and message.id > marks[config['id']]:
+                                    await self._process_and_copy_message(message, config, message_dict,
+                                                                         catchup=True)
+                        caught_up[source_channel_id] = message.id
+                    after_id = messages[-1].id
+                    budget -= len(messages)
+                
+                if after_id < end_id:
+                    logger.warning("⚠️ Catch-up for source %s stopped at %s/%s (CATCHUP_MAX_MESSAGES_PER_CLIENT=%d)",
+                                   source_channel_id, after_id, end_id, self.catchup_max_messages)
             
+            logger.info("🔁 Catch-up done for user %s: %d messages from %d source(s)",
+                        self.user_id, self.catchup_max_messages - budget, len(caught_up))
+        except Exception as e:
+            logger.error("❌ Catch-up failed for user %s: %s", self.user_id, e)
+    
+    async def _dispatch_edited_message(self, client, message: Message):
+        """Đưa edit của message nguồn vào queue cho các config (trừ config forward)"""
+        configs = [config for config in self.source_index.get(message.chat.id, [])
+                   if not uses_forward_mode(config_registry.get(config['id']) or config)]
+        if not configs:
+            return
+        
+        try:
+            message_dict = self.convert_message_to_dict(message)
+        except Exception as e:
+            logger.error("❌ Error converting edited message %s: %s", message.id, e)
+            return
+        
+        for config in configs:
+            await self._queue_event(config, 'edit', message_dict)
+    
+    async def _dispatch_deleted_messages(self, client, messages: List[Message]):
+        """Đưa danh sách message nguồn bị xóa vào queue cho các config"""
+        deleted: Dict[int, List[int]] = {}
+        for message in messages:
+            if message.chat is not None and message.chat.id in self.source_index:
+                deleted.setdefault(message.chat.id, []).append(message.id)
+        
+        for chat_id, message_ids in deleted.items():
+            message_dict = {'message_id': message_ids[0], 'text': None, 'caption': None, 'deleted_ids': message_ids}
+            for config in list(self.source_index.get(chat_id, [])):
+                await self._queue_event(config, 'delete', message_dict)
+    
+    async def _queue_event(self, config: Dict, event: str, message_dict: Dict):
+        """Đưa edit/delete vào queue sau khi flush album/forward đang chờ để giữ thứ tự với message gốc"""
+        try:
+            await self.album_batcher.flush_where(lambda key: key[0] == config['id'])
+            await self.forward_batcher.flush(config['id'])
+            await self.bot_instance.add_message_to_queue({
+                'user_id': self.user_id,
+                'config_id': config['id'],
+                'event': event,
+                'message': message_dict,
+                'source_channel_id': config['source_channel_id'],
+                'target_channel_id': config['target_channel_id']
+            })
+        except Exception as e:
+            logger.error("❌ Error queueing %s for config %s: %s", event, config['id'], e)
+    
+    async def _process_and_copy_message(self, message: Message, config: Dict, message_dict: Dict = None,
+                                        catchup: bool = False):
+        """Xử lý và gửi tin nhắn vào queue để bot telegram xử lý"""
+        trace = set_trace(config['id'], message.id)
+        try:
             if not self.bot_instance:
-                print("❌ Bot instance not available for message processing")
+                logger.error("❌ Bot instance not available for message processing")
                 return
             
-            print(f"✅ Debug - Bot instance available")
-            
             # Convert pyrogram message to dict format
-            message_dict = self.convert_message_to_dict(message)
-            print(f"📊 Debug - Converted message keys: {list(message_dict.keys())}")
+            if message_dict is None:
+                message_dict = self.convert_message_to_dict(message)
+            metrics.messages_received.inc(config['id'])
             
             # Tạo data package để gửi vào queue
             message_data = {
@@ -689,22 +911,83 @@ class TelegramClient:
                 'source_channel_id': config['source_channel_id'],
                 'target_channel_id': config['target_channel_id']
             }
+            if catchup:
+                message_data['catchup'] = True  # Thời điểm đăng đã cũ, không tính vào độ trễ live
+            # Mốc thời gian để đo độ trễ từ lúc đăng ở source tới lúc gửi xong ở target
+            stamp(message_data, 'received')
+            source_time = source_timestamp(getattr(message, 'date', None))
+            if source_time:
+                stamp(message_data, 'source', source_time)
+            
+            # Config forward: gom theo cửa sổ thời gian (album cũng được forward nguyên vẹn)
+            if uses_forward_mode(config_registry.get(config['id']) or config):
+                await self.forward_batcher.add(config['id'], message_data)
+                logger.debug("⏩ Message %s buffered for forwarding", message.id)
+                return
             
-            print(f"📦 Debug - Message data package created")
-            print(f"👤 Debug - User ID: {self.user_id}")
-            print(f"⚙️ Debug - Config ID: {config['id']}")
-            print(f"📥 Debug - Source: {config['source_channel_id']}")
-            print(f"📤 Debug - Target: {config['target_channel_id']}")
+            # Phần của album: chờ gom đủ rồi mới đưa vào queue
+            if message_dict.get('media_group_id'):
+                await self.album_batcher.add((config['id'], message_dict['media_group_id']), message_data)
+                logger.debug("🖼️ Message %s buffered for album %s", message.id, message_dict['media_group_id'])
+                return
+            
+            # Flush album đang chờ của config này trước để giữ đúng thứ tự
+            await self.album_batcher.flush_where(lambda key: key[0] == config['id'])
             
             # Gửi vào message queue để bot telegram xử lý
             await self.bot_instance.add_message_to_queue(message_data)
             
-            print(f"📤 Message queued for processing: {message.id}")
+            logger.debug("📤 Message %s queued for config %s", message.id, config['id'])
                 
         except Exception as e:
-            print(f"❌ Error queueing message: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error queueing message: %s", e)
+        finally:
+            current_trace.reset(trace)
+    
+    @staticmethod
+    def build_album_message(message_data: Dict, parts: List[Dict], media_group_id) -> Dict:
+        """Gộp các message dict của một album (đã sắp theo message_id) thành một message_data"""
+        first = parts[0]
+        captioned = next((part for part in parts if part.get('caption')), {})
+        return dict(message_data, message={
+            'message_id': first['message_id'],
+            'text': None,
+            'caption': captioned.get('caption'),
+            'entities': captioned.get('entities') or [],
+            'date': first['date'],
+            'source_title': first.get('source_title'),
+            'reply_to_message_id': first.get('reply_to_message_id'),
+            'media_group_id': media_group_id,
+            'media_group': parts
+        })
+    
+    @staticmethod
+    def build_forward_message(message_data: Dict, parts: List[Dict]) -> Dict:
+        """Gộp các message dict (đã sắp theo message_id) thành một item forward_messages"""
+        return dict(message_data, message={
+            'message_id': parts[0]['message_id'],
+            'text': None,
+            'caption': None,
+            'date': parts[0]['date'],
+            'forward_messages': parts
+        })
+    
+    async def _flush_album(self, key, parts: List[Dict]):
+        """Gộp các phần của album thành một message và đưa vào queue"""
+        config_id, media_group_id = key
+        parts.sort(key=lambda part: part['message']['message_id'])
+        message_data = self.build_album_message(parts[0], [part['message'] for part in parts], media_group_id)
+        
+        await self.bot_instance.add_message_to_queue(message_data)
+        logger.debug("📤 Album %s queued with %d items for config %s", media_group_id, len(parts), config_id)
+    
+    async def _flush_forward(self, config_id: int, parts: List[Dict]):
+        """Gộp các message chờ forward của một config thành một item trong queue"""
+        parts.sort(key=lambda part: part['message']['message_id'])
+        message_data = self.build_forward_message(parts[0], [part['message'] for part in parts])
+        
+        await self.bot_instance.add_message_to_queue(message_data)
+        logger.debug("📤 Forward batch of %d messages queued for config %s", len(parts), config_id)
     
     async def stop_copying(self, config_id: int):
         """Dừng copy cho một cấu hình"""
@@ -713,12 +996,18 @@ class TelegramClient:
                 print(f"⚠️ Config {config_id} is not active")
                 return True
             
-            # Remove message handler
-            if hasattr(self, 'message_handlers') and config_id in self.message_handlers:
-                handler = self.message_handlers[config_id]
-                self.client.remove_handler(handler)
-                del self.message_handlers[config_id]
-                print(f"🗑️ Removed message handler for config {config_id}")
+            # Gửi nốt các album và batch forward đang gom dở
+            await self.album_batcher.flush_where(lambda key: key[0] == config_id)
+            await self.forward_batcher.flush(config_id)
+            
+            # Gỡ config khỏi index (dispatcher vẫn giữ nguyên)
+            source_channel_id = int(self.active_configs[config_id]['source_channel_id'])
+            configs = [config for config in self.source_index.get(source_channel_id, [])
+                       if config['id'] != config_id]
+            if configs:
+                self.source_index[source_channel_id] = configs
+            else:
+                self.source_index.pop(source_channel_id, None)
             
             # Remove from active configs
             del self.active_configs[config_id]
@@ -744,6 +1033,36 @@ class TelegramClient:
             print(f"Error stopping all copying: {e}")
             return False
     
+    async def can_post_to(self, chat_id: int) -> bool:
+        """Kiểm tra tài khoản user có thể gửi tin nhắn vào chat hay không (có cache)"""
+        cached = self.post_permissions.get(chat_id)
+        if cached and time.monotonic() - cached[1] < POST_PERMISSION_TTL:
+            return cached[0]
+        
+        allowed = False
+        try:
+            chat = await self.client.get_chat(chat_id)
+            member = await self.client.get_chat_member(chat_id, "me")
+            
+            if member.status == ChatMemberStatus.OWNER:
+                allowed = True
+            elif member.status == ChatMemberStatus.ADMINISTRATOR:
+                # Admin của channel cần quyền đăng bài, admin của group luôn gửi được
+                allowed = chat.type != ChatType.CHANNEL or bool(
+                    member.privileges and member.privileges.can_post_messages
+                )
+            elif member.status == ChatMemberStatus.MEMBER:
+                allowed = chat.type != ChatType.CHANNEL and bool(
+                    chat.permissions is None or chat.permissions.can_send_messages
+                )
+            elif member.status == ChatMemberStatus.RESTRICTED:
+                allowed = bool(member.permissions and member.permissions.can_send_messages)
+        except Exception as e:
+            print(f"⚠️ Cannot check post permission for {chat_id}: {e}")
+        
+        self.post_permissions[chat_id] = (allowed, time.monotonic())
+        return allowed
+    
     async def test_channel_access(self, channel_id: int):
         """Kiểm tra quyền truy cập channel"""
         try:
@@ -0,0 +1,41 @@
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class ConfigRegistry:
+    """Registry dùng chung toàn process cho channel configs, key theo config id"""
+
+    def __init__(self):
+        self.configs: Dict[int, Dict[str, Any]] = {}
+        self.loaded = False
+
+    def load(self, configs):
+        """Nạp toàn bộ configs (gọi một lần khi khởi động)"""
+        self.configs = {config['id']: config for config in configs}
+        self.loaded = True
+        logger.info("📋 Config registry loaded: %d configs", len(self.configs))
+
+    def get(self, config_id: int) -> Optional[Dict[str, Any]]:
+        """Lấy config theo id - O(1), không truy cập database"""
+        return self.configs.get(config_id)
+
+    def put(self, config: Dict[str, Any]):
+        """Thêm hoặc thay thế config"""
+        self.configs[config['id']] = config
+
+    def update(self, config_id: int, **fields):
+        """Cập nhật một số field của config (copy-on-write để reader không thấy dict dở dang)"""
+        config = self.configs.get(config_id)
+        if config is not None:
+            self.configs[config_id] = {**config, **fields}
+
+    def remove(self, config_id: int):
+        """Xóa config khỏi registry"""
+        self.configs.pop(config_id, None)
+
+    def __len__(self):
+        return len(self.configs)
+
+# Instance dùng chung cho mọi Database/MessageProcessor trong process
+config_registry = ConfigRegistry()
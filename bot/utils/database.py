@@ -3,13 +3,18 @@ import json
 import shutil
 import os
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from bot.utils.config_registry import config_registry
 
 class Database:
     def __init__(self, db_path: str = "data/telegram_bot.db"):
         self.db_path = db_path
         self.init_database()
         self.migrate_database()
+        
+        # Nạp config registry một lần cho cả process
+        if not config_registry.loaded:
+            self.load_config_registry()
     
     def init_database(self):
         """Khởi tạo database và tạo các bảng cần thiết"""
@@ -77,6 +82,80 @@ class Database:
             )
         ''')
         
+        # Bảng ánh xạ file_unique_id -> file_id dùng lại được của từng sender (bot/user)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_id_cache (
+                file_unique_id TEXT,
+                sender TEXT,
+                file_id TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (file_unique_id, sender)
+            )
+        ''')
+        
+        # Bảng outbox lưu các message chưa gửi để replay khi khởi động lại
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Bảng ánh xạ message nguồn -> message đích (mirror edit/delete/reply); khóa chính bao phủ truy vấn tra cứu
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_map (
+                config_id INTEGER NOT NULL,
+                source_msg_id INTEGER NOT NULL,
+                target_msg_id INTEGER NOT NULL,
+                via TEXT NOT NULL,
+                render_hash TEXT,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (config_id, source_msg_id, target_msg_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_map_created ON message_map (created_at)')
+        
+        # Bảng dead letter: message đã hết số lần retry, có thể replay bằng /replay_dead_letters
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                config_id INTEGER,
+                target_channel_id TEXT,
+                payload TEXT NOT NULL,
+                error_class TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_dead_letters_user ON dead_letters (user_id, config_id)')
+        
+        # Message nguồn mới nhất đã xử lý của mỗi config, dùng để copy bù sau khi mất kết nối/restart
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS config_progress (
+                config_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Bảng backfill: tiến độ copy tin nhắn cũ của từng config để chạy tiếp sau khi restart
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS backfill_jobs (
+                config_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                days INTEGER,
+                last_id INTEGER DEFAULT 0,
+                end_id INTEGER DEFAULT 0,
+                copied INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'running',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         conn.commit()
         conn.close()
     
@@ -141,10 +220,58 @@ class Database:
         except sqlite3.OperationalError as e:
             print(f"Migration error for session_backups: {e}")
         
+        try:
+            # Chính sách xử lý khi queue đầy cho từng config (NULL = dùng mặc định từ env)
+            cursor.execute("PRAGMA table_info(channel_configs)")
+            config_columns = [column[1] for column in cursor.fetchall()]
+            
+            if 'overflow_policy' not in config_columns:
+                cursor.execute('ALTER TABLE channel_configs ADD COLUMN overflow_policy TEXT')
+                print("✅ Added overflow_policy column to channel_configs table")
+            
+            # Cách gửi của config: auto/copy/bot (NULL = dùng mặc định từ env)
+            if 'send_mode' not in config_columns:
+                cursor.execute('ALTER TABLE channel_configs ADD COLUMN send_mode TEXT')
+                print("✅ Added send_mode column to channel_configs table")
+        except sqlite3.OperationalError as e:
+            print(f"Migration error for channel_configs: {e}")
+        
         conn.commit()
         conn.close()
         print("✅ Database migration completed")
     
+    @staticmethod
+    def _row_to_config(row) -> Dict[str, Any]:
+        """Chuyển một row của channel_configs thành dict"""
+        return {
+            'id': row[0],
+            'user_id': row[1],
+            'source_channel_id': row[2],
+            'source_channel_name': row[3],
+            'target_channel_id': row[4],
+            'target_channel_name': row[5],
+            'header_text': row[6],
+            'footer_text': row[7],
+            'extract_pattern': row[8],
+            'button_text': row[9],
+            'button_url': row[10],
+            'is_active': row[11],
+            'created_at': row[12],
+            'overflow_policy': row[13] if len(row) > 13 else None,
+            'send_mode': row[14] if len(row) > 14 else None
+        }
+    
+    def load_config_registry(self):
+        """Nạp tất cả channel configs vào registry trong bộ nhớ"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM channel_configs')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        config_registry.load(self._row_to_config(row) for row in rows)
+    
     def add_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
         """Thêm user mới hoặc cập nhật thông tin user"""
         conn = sqlite3.connect(self.db_path)
@@ -234,8 +361,14 @@ class Database:
             config.get('is_active', True)
         ))
         
+        cursor.execute('SELECT * FROM channel_configs WHERE id = ?', (cursor.lastrowid,))
+        row = cursor.fetchone()
+        
         conn.commit()
         conn.close()
+        
+        if row:
+            config_registry.put(self._row_to_config(row))
     
     def get_user_configs(self, user_id: int):
         """Lấy các cấu hình active của user"""
@@ -255,25 +388,7 @@ class Database:
         rows = cursor.fetchall()
         conn.close()
         
-        configs = []
-        for row in rows:
-            configs.append({
-                'id': row[0],
-                'user_id': row[1],
-                'source_channel_id': row[2],
-                'source_channel_name': row[3],
-                'target_channel_id': row[4],
-                'target_channel_name': row[5],
-                'header_text': row[6],
-                'footer_text': row[7],
-                'extract_pattern': row[8],
-                'button_text': row[9],
-                'button_url': row[10],
-                'is_active': row[11],
-                'created_at': row[12]
-            })
-        
-        return configs
+        return [self._row_to_config(row) for row in rows]
     
     def get_all_user_configs(self, user_id: int):
         """Lấy tất cả cấu hình của user (bao gồm cả inactive)"""
@@ -289,25 +404,7 @@ class Database:
         rows = cursor.fetchall()
         conn.close()
         
-        configs = []
-        for row in rows:
-            configs.append({
-                'id': row[0],
-                'user_id': row[1],
-                'source_channel_id': row[2],
-                'source_channel_name': row[3],
-                'target_channel_id': row[4],
-                'target_channel_name': row[5],
-                'header_text': row[6],
-                'footer_text': row[7],
-                'extract_pattern': row[8],
-                'button_text': row[9],
-                'button_url': row[10],
-                'is_active': row[11],
-                'created_at': row[12]
-            })
-        
-        return configs
+        return [self._row_to_config(row) for row in rows]
     
     def update_config_status(self, config_id: int, user_id: int, is_active: bool):
         """Cập nhật trạng thái active của config"""
@@ -319,9 +416,185 @@ class Database:
             WHERE id = ? AND user_id = ?
         ''', (is_active, config_id, user_id))
         
+        affected_rows = cursor.rowcount
+        conn.commit()
+        conn.close()
+        
+        if affected_rows > 0:
+            config_registry.update(config_id, is_active=is_active)
+    
+    def update_config_overflow_policy(self, config_id: int, user_id: int, overflow_policy: Optional[str]) -> bool:
+        """Cập nhật chính sách xử lý khi queue đầy của config"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE channel_configs SET overflow_policy = ? 
+            WHERE id = ? AND user_id = ?
+        ''', (overflow_policy, config_id, user_id))
+        
+        affected_rows = cursor.rowcount
+        conn.commit()
+        conn.close()
+        
+        if affected_rows > 0:
+            config_registry.update(config_id, overflow_policy=overflow_policy)
+        return affected_rows > 0
+    
+    def update_config_send_mode(self, config_id: int, user_id: int, send_mode: Optional[str]) -> bool:
+        """Cập nhật cách gửi (copy qua user client hoặc gửi qua bot) của config"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE channel_configs SET send_mode = ? 
+            WHERE id = ? AND user_id = ?
+        ''', (send_mode, config_id, user_id))
+        
+        affected_rows = cursor.rowcount
+        conn.commit()
+        conn.close()
+        
+        if affected_rows > 0:
+            config_registry.update(config_id, send_mode=send_mode)
+        return affected_rows > 0
+    
+    def add_dead_letter(self, message_data: Dict[str, Any], error_class: str, error: str):
+        """Lưu message đã hết số lần retry vào bảng dead_letters"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO dead_letters (user_id, config_id, target_channel_id, payload, error_class, error, attempts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            message_data.get('user_id'), message_data.get('config_id'),
+            str(message_data.get('target_channel_id')), json.dumps(message_data),
+            error_class, error, message_data.get('retry_attempts', 0)
+        ))
+        
+        conn.commit()
+        conn.close()
+    
+    def pop_dead_letters(self, user_id: int, config_id: int = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Lấy và xóa các dead letter của user (theo thứ tự cũ nhất trước) để replay"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        if config_id is None:
+            cursor.execute('''
+                SELECT id, payload FROM dead_letters WHERE user_id = ? ORDER BY id LIMIT ?
+            ''', (user_id, limit))
+        else:
+            cursor.execute('''
+                SELECT id, payload FROM dead_letters WHERE user_id = ? AND config_id = ? ORDER BY id LIMIT ?
+            ''', (user_id, config_id, limit))
+        rows = cursor.fetchall()
+        
+        cursor.executemany('DELETE FROM dead_letters WHERE id = ?', [(row[0],) for row in rows])
+        conn.commit()
+        conn.close()
+        
+        return [json.loads(row[1]) for row in rows]
+    
+    def count_dead_letters(self, user_id: int = None) -> int:
+        """Số dead letter (của một user hoặc toàn bộ)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        if user_id is None:
+            cursor.execute('SELECT COUNT(*) FROM dead_letters')
+        else:
+            cursor.execute('SELECT COUNT(*) FROM dead_letters WHERE user_id = ?', (user_id,))
+        count = cursor.fetchone()[0]
+        
+        conn.close()
+        return count
+    
+    def get_config_progress(self) -> Dict[int, int]:
+        """config_id -> id message nguồn mới nhất đã xử lý"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT config_id, last_message_id FROM config_progress')
+        progress = dict(cursor.fetchall())
+        
+        conn.close()
+        return progress
+    
+    def save_config_progress(self, progress: Dict[int, int]):
+        """Ghi tiến độ của nhiều config trong một transaction (không lùi id đã lưu)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            INSERT INTO config_progress (config_id, last_message_id) VALUES (?, ?)
+            ON CONFLICT(config_id) DO UPDATE SET
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                updated_at = CURRENT_TIMESTAMP
+        ''', list(progress.items()))
+        
+        conn.commit()
+        conn.close()
+    
+    def save_backfill_job(self, config_id: int, user_id: int, days: int, start_id: int, end_id: int):
+        """Tạo (hoặc tạo lại) job backfill của config, bắt đầu sau message start_id"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO backfill_jobs (config_id, user_id, days, last_id, end_id, copied, status)
+            VALUES (?, ?, ?, ?, ?, 0, 'running')
+        ''', (config_id, user_id, days, start_id, end_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def update_backfill_progress(self, config_id: int, last_id: int, copied: int):
+        """Lưu checkpoint: mọi message nguồn <= last_id đã được xử lý xong"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE backfill_jobs SET last_id = ?, copied = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE config_id = ?
+        ''', (last_id, copied, config_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def update_backfill_status(self, config_id: int, status: str):
+        """Đổi trạng thái job backfill (running/done/cancelled/failed)"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE backfill_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE config_id = ?
+        ''', (status, config_id))
+        
         conn.commit()
         conn.close()
     
+    def get_backfill_jobs(self, user_id: int = None, status: str = None) -> List[Dict[str, Any]]:
+        """Danh sách job backfill, lọc theo user và/hoặc trạng thái"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        query = 'SELECT * FROM backfill_jobs WHERE 1 = 1'
+        params = []
+        if user_id is not None:
+            query += ' AND user_id = ?'
+            params.append(user_id)
+        if status is not None:
+            query += ' AND status = ?'
+            params.append(status)
+        cursor.execute(query + ' ORDER BY config_id', params)
+        jobs = [dict(row) for row in cursor.fetchall()]
+        
+        conn.close()
+        return jobs
+    
     def save_user_session(self, user_id: int, session_string: str, api_id: int, api_hash: str):
         """Lưu session string của user với automatic backup và better error handling"""
         conn = sqlite3.connect(self.db_path)
@@ -452,8 +725,12 @@ class Database:
             WHERE id = ? AND user_id = ?
         ''', (config_id, user_id))
 
+        affected_rows = cursor.rowcount
         conn.commit()
         conn.close()
+        
+        if affected_rows > 0:
+            config_registry.update(config_id, is_active=False)
     
     def delete_config_permanently(self, config_id: int, user_id: int):
         """Xóa cấu hình vĩnh viễn khỏi database"""
@@ -469,6 +746,9 @@ class Database:
         conn.commit()
         conn.close()
         
+        if affected_rows > 0:
+            config_registry.remove(config_id)
+        
         return affected_rows > 0
     
     def get_config_by_id(self, config_id: int, user_id: int):
@@ -485,21 +765,7 @@ class Database:
         conn.close()
         
         if row:
-            return {
-                'id': row[0],
-                'user_id': row[1],
-                'source_channel_id': row[2],
-                'source_channel_name': row[3],
-                'target_channel_id': row[4],
-                'target_channel_name': row[5],
-                'header_text': row[6],
-                'footer_text': row[7],
-                'extract_pattern': row[8],
-                'button_text': row[9],
-                'button_url': row[10],
-                'is_active': row[11],
-                'created_at': row[12]
-            }
+            return self._row_to_config(row)
         return None
     
     def get_all_authenticated_users(self):
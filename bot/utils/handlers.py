@@ -2,6 +2,8 @@ import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from bot.utils.keyboards import Keyboards
+from bot.utils.states import WAITING_HEADER, WAITING_FOOTER
+from bot.messages.render import validate_template
 
 class BotHandlers:
     def __init__(self, bot_instance):
@@ -65,6 +67,9 @@ Nhập văn bản sẽ được thêm vào **đầu** mỗi tin nhắn copy:
 • `🔥 Tin nóng từ kênh ABC`
 • `📢 Thông báo quan trọng:`
 • `💎 Nội dung VIP:`
+• `📰 Từ {source_title} - {date:%d/%m/%Y}`
+
+🧩 **Biến:** `{source_title}` (tên kênh nguồn), `{date}` (thời gian tin nhắn)
 
 ⚠️ **Để trống** nếu không muốn thêm header
         """
@@ -82,6 +87,8 @@ Nhập văn bản sẽ được thêm vào **cuối** mỗi tin nhắn copy:
 • `🔗 Website: https://example.com`
 • `💌 Liên hệ: @admin`
 
+🧩 **Biến:** `{source_title}` (tên kênh nguồn), `{date}` (thời gian tin nhắn)
+
 ⚠️ **Để trống** nếu không muốn thêm footer
         """
         await self.safe_edit_message(query, text)
@@ -145,6 +152,15 @@ Nhập link sẽ được mở khi nhấn button:
         header_text = update.message.text.strip()
         user_id = update.effective_user.id
         
+        # Kiểm tra format spec của biến template trước khi lưu
+        error = validate_template(header_text)
+        if error:
+            await update.message.reply_text(
+                f"❌ **Header không hợp lệ!**\n\n{error}\n\n✏️ Vui lòng nhập lại header.",
+                parse_mode='Markdown'
+            )
+            return WAITING_HEADER
+        
         if user_id not in self.temp_data:
             self.temp_data[user_id] = {}
         
@@ -162,6 +178,15 @@ Nhập link sẽ được mở khi nhấn button:
         footer_text = update.message.text.strip()
         user_id = update.effective_user.id
         
+        # Kiểm tra format spec của biến template trước khi lưu
+        error = validate_template(footer_text)
+        if error:
+            await update.message.reply_text(
+                f"❌ **Footer không hợp lệ!**\n\n{error}\n\n✏️ Vui lòng nhập lại footer.",
+                parse_mode='Markdown'
+            )
+            return WAITING_FOOTER
+        
         if user_id not in self.temp_data:
             self.temp_data[user_id] = {}
         
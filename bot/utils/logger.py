@@ -0,0 +1,82 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import zlib
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# (config_id, message_id) của message đang được xử lý trong task hiện tại, dùng để lấy mẫu log DEBUG
+current_trace: ContextVar[Optional[Tuple[int, Optional[int]]]] = ContextVar('current_trace', default=None)
+
+class DebugSampler(logging.Filter):
+    """Lấy mẫu log DEBUG theo từng message: mọi dòng trace của cùng (config, message) được giữ hoặc bỏ cùng nhau"""
+
+    def __init__(self, rate: float, full_configs):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, rate)) * 10000)
+        self.full_configs = set(full_configs)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        trace = current_trace.get()
+        if trace is None:
+            # Dòng DEBUG không gắn với message nào cũng được lấy mẫu, không cho qua hết
+            return random.random() * 10000 < self.threshold
+        if trace[0] in self.full_configs:
+            return True
+        return zlib.crc32(f"{trace[0]}:{trace[1]}".encode()) % 10000 < self.threshold
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không format record trên event loop; queue nằm trong process nên không cần pickle"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+def set_trace(config_id: int, message_id: Optional[int] = None):
+    """Gắn message đang xử lý vào context của task để các dòng DEBUG sau đó được lấy mẫu cùng nhau"""
+    return current_trace.set((config_id, message_id))
+
+def setup_logging():
+    """Cấu hình logging: record đi qua QueueHandler, việc format và ghi file/console chạy ở thread riêng"""
+    level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    handlers = []
+    if os.getenv('LOG_TO_CONSOLE', 'True').lower() == 'true':
+        handlers.append(logging.StreamHandler(sys.stdout))
+    if os.getenv('LOG_TO_FILE', 'True').lower() == 'true':
+        log_file = os.getenv('LOG_FILE', 'logs/bot.log')
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+            encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(DebugSampler(
+        float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.05')),
+        (int(config_id) for config_id in os.getenv('LOG_DEBUG_CONFIGS', '').split(',') if config_id.strip())
+    ))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    # Thư viện HTTP của python-telegram-bot log mỗi request ở mức INFO
+    logging.getLogger('httpx').setLevel(max(level, logging.WARNING))
+
+    if not handlers:
+        root.handlers[:] = [logging.NullHandler()]
+        return
+    # Listener ghi log ở thread riêng; atexit dừng nó để xả hết record còn trong queue
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
@@ -0,0 +1,197 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bucket (giây) cho độ trễ gửi: từ lệnh nhanh tới upload file lớn
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Counter theo label; chỉ được tăng từ event loop nên không cần lock"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class Gauge:
+    """Gauge tính lúc scrape bằng callback trả về {label values: giá trị}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        if not self.callback:
+            return
+        for label_values, value in self.callback().items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class Histogram:
+    """Histogram với bucket cố định; observe chỉ tăng một ô, phần cộng dồn làm lúc render"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple, list] = {}  # label values -> [đếm theo bucket..., +Inf, tổng]
+
+    def observe(self, value: float, *label_values):
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for label_values, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == '+Inf' else repr(float(bound)))
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+class MetricsRegistry:
+    """Các metric của bot, render theo text exposition format của Prometheus"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.messages_received = self.counter(
+            'bot_messages_received_total', 'Source messages queued for copying', ('config_id',))
+        self.messages_filtered = self.counter(
+            'bot_messages_filtered_total', 'Messages skipped before sending', ('config_id', 'reason'))
+        self.messages_sent = self.counter(
+            'bot_messages_sent_total', 'Messages delivered to the target channel', ('config_id', 'via'))
+        self.messages_failed = self.counter(
+            'bot_messages_failed_total', 'Failed send attempts', ('config_id', 'error_class'))
+        self.send_latency = self.histogram(
+            'bot_send_latency_seconds', 'Telegram API call latency, excluding rate limiter waits', ('method',))
+        self.session_restores = self.counter(
+            'bot_session_restores_total', 'User session restores at startup', ('result',))
+        self.session_recoveries = self.counter(
+            'bot_session_recoveries_total', 'User session recoveries after a disconnect', ('result',))
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...],
+              callback: Callable[[], Dict[Tuple, float]]) -> Gauge:
+        self.metrics[name] = Gauge(name, help_text, labels, callback)
+        return self.metrics[name]
+
+    def timed(self, method, method_name: str):
+        """Bọc một coroutine function để đo thời gian gọi API vào send_latency"""
+        async def call(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.send_latency.observe(time.monotonic() - started, method_name)
+        return call
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                lines.append(f"# error collecting {metric.name}: {type(e).__name__}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    """HTTP server tối giản trên localhost: /metrics, /healthz, /readyz"""
+
+    def __init__(self, registry: MetricsRegistry, ready: Callable[[], bool]):
+        self.registry = registry
+        self.ready = ready
+        self.host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.port = int(os.getenv('METRICS_PORT', '9108'))
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("📈 Metrics server listening on http://%s:%s/metrics", self.host, self.port)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # Bỏ qua header, không cần đọc body vì chỉ hỗ trợ GET
+            while (await asyncio.wait_for(reader.readline(), timeout=5.0)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?')[0] if len(parts) >= 2 else ''
+
+            if len(parts) < 2 or parts[0] != 'GET':
+                status, body, content_type = '405 Method Not Allowed', 'method not allowed\n', 'text/plain'
+            elif path == '/metrics':
+                status, body = '200 OK', self.registry.render()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/healthz':
+                status, body, content_type = '200 OK', 'ok\n', 'text/plain'
+            elif path == '/readyz':
+                ready = self.ready()
+                status = '200 OK' if ready else '503 Service Unavailable'
+                body, content_type = ('ready\n' if ready else 'not ready\n'), 'text/plain'
+            else:
+                status, body, content_type = '404 Not Found', 'not found\n', 'text/plain'
+
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+# Instance dùng chung cho mọi thành phần trong process
+metrics = MetricsRegistry()
@@ -12,9 +12,12 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from bot.core import TelegramBot
+from bot.utils.logger import setup_logging
 
 def main():
     """Main function để chạy bot"""
+    # Logging cấu hình sau khi bot.core đã nạp .env (LOG_LEVEL, LOG_TO_FILE, LOG_TO_CONSOLE)
+    setup_logging()
     print("🚀 Khởi động Bot Copy Channel Telegram...")
     print("📋 Kiểm tra cấu hình...")
     
@@ -0,0 +1,30 @@
+import os
+import sys
+
+# Chạy được cả bằng `pytest` lẫn `python -m pytest` từ thư mục gốc của repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database tạm với đầy đủ schema (không đụng tới data/telegram_bot.db)"""
+    from bot.utils.database import Database
+    return Database(str(tmp_path / 'bot.db'))
+
+
+@pytest.fixture
+def make_processor(db):
+    """Tạo MessageProcessor với bot giả (đọc env lúc gọi); worker không được khởi động"""
+    from types import SimpleNamespace
+    from bot.messages.processor import MessageProcessor
+
+    def make():
+        return MessageProcessor(SimpleNamespace(db=db, bot_instance=None))
+    return make
+
+
+@pytest.fixture
+def processor(make_processor):
+    return make_processor()
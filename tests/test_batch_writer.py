@@ -0,0 +1,95 @@
+import asyncio
+
+from bot.messages.batch_writer import BatchedWriter
+from bot.messages.file_cache import FileIdCache
+from bot.messages.message_map import MessageMap
+
+
+class FlakyWriter(BatchedWriter):
+    def __init__(self, db_path):
+        super().__init__(db_path, batch_size=10, flush_interval=60)
+        self.failures = 1
+        self.written = []
+
+    def _write_batch(self, changes):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('database is locked')
+        self.written.append(changes)
+
+
+def test_failed_batch_is_merged_back_with_newer_changes_winning(db):
+    async def scenario():
+        writer = FlakyWriter(db.db_path)
+        writer._connect()
+        writer._queue_write('a', 1)
+        writer._queue_write('b', 1)
+        flushing = asyncio.ensure_future(writer.flush())
+        await asyncio.sleep(0)
+        writer._queue_write('a', 2)  # Đổi trong lúc batch cũ đang ghi
+        try:
+            await flushing
+        except OSError:
+            pass
+        await writer.flush()
+        await writer.close()
+        return writer.written
+
+    assert asyncio.run(scenario()) == [[('a', 2), ('b', 1)]]
+
+
+def test_writes_queued_before_start_are_flushed_on_close(db):
+    async def scenario():
+        writer = FlakyWriter(db.db_path)
+        writer.failures = 0
+        for key in range(20):  # Vượt batch_size trước khi có flush task
+            writer._queue_write(key, key)
+        writer._connect()
+        writer._start_flushing()
+        await writer.close()
+        return writer.written
+
+    assert [len(batch) for batch in asyncio.run(scenario())] == [20]
+
+
+def test_message_map_round_trip(db):
+    async def scenario():
+        message_map = MessageMap(db.db_path)
+        message_map.start()
+        message_map.record(1, [(10, 100), (11, 101)], 'bot', render_hash='h', captioned_source=11)
+        message_map.remove(1, [11])
+        await message_map.close()
+
+        reopened = MessageMap(db.db_path)
+        reopened.start()
+        rows = await reopened.get(1, 10), await reopened.get(1, 11)
+        await reopened.close()
+        return rows
+
+    rows, removed = asyncio.run(scenario())
+    assert [(row['target_msg_id'], row['render_hash']) for row in rows] == [(100, None)]
+    assert removed == []
+
+
+def test_file_id_cache_persists_and_invalidates(db):
+    message_data = {'photo': {'file_id': 'user-file', 'file_unique_id': 'u1'}}
+
+    async def scenario():
+        cache = FileIdCache(db.db_path)
+        cache.start()
+        cache.put('u1', 'bot:1', 'bot-file')
+        await cache.close()
+
+        reopened = FileIdCache(db.db_path)
+        reopened.start()
+        before = await reopened.resolve(message_data, 'bot:1')
+        reopened.invalidate_message(message_data, 'bot:1')
+        await reopened.close()
+
+        again = FileIdCache(db.db_path)
+        again.start()
+        after = await again.resolve(message_data, 'bot:1')
+        await again.close()
+        return before, after
+
+    assert asyncio.run(scenario()) == ({'user-file': 'bot-file'}, {})
@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot.utils import client as client_module
+from bot.utils.client import TelegramClient
+
+SOURCE = -1001
+
+
+def live(message_id, chat_id=SOURCE):
+    return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=chat_id))
+
+
+@pytest.fixture
+def make_client(monkeypatch, db):
+    """TelegramClient không kết nối Telegram: copy bù và copy message được thay bằng hàm ghi lại"""
+    monkeypatch.setattr(client_module, 'Database', lambda: db)
+
+    def make(missed=(), copy_delay=0.0, missed_delay=0.0):
+        client = TelegramClient(1, 1, 'hash', bot_instance=SimpleNamespace())
+        client.source_index = {SOURCE: [{'id': 1}]}
+        client.copied = []
+
+        async def copy_missed(caught_up):
+            for message_id in missed:
+                await asyncio.sleep(missed_delay)
+                client.copied.append(('missed', message_id))
+                caught_up[SOURCE] = message_id
+
+        async def copy_to_configs(message, configs):
+            await asyncio.sleep(copy_delay)
+            client.copied.append(('live', message.id))
+
+        client._copy_missed = copy_missed
+        client._copy_to_configs = copy_to_configs
+        return client
+    return make
+
+
+def test_held_messages_are_released_after_catch_up(make_client):
+    async def scenario():
+        client = make_client(missed=[5, 6], missed_delay=0.01)
+        await client.catch_up()
+        for message_id in (6, 7, 8):  # 6 đã được copy bù
+            await client._dispatch_message(None, live(message_id))
+        assert client.copied == []
+        await client.catchup_task
+        assert client.copied == [('missed', 5), ('missed', 6), ('live', 7), ('live', 8)]
+        assert client.held_messages is None and client.held_draining is None
+
+    asyncio.run(scenario())
+
+
+def test_arrivals_during_drain_wait_and_are_not_held(make_client):
+    async def scenario():
+        client = make_client(copy_delay=0.01)
+        client.hold_live_updates()
+        for message_id in (1, 2, 3):
+            await client._dispatch_message(None, live(message_id))
+        await client.catch_up()
+        await asyncio.sleep(0.005)  # Đang xả message 1
+        assert client.held_messages is None
+        late = asyncio.ensure_future(client._dispatch_message(None, live(4)))
+        await client.catchup_task
+        await late
+        assert client.copied == [('live', 1), ('live', 2), ('live', 3), ('live', 4)]
+
+    asyncio.run(scenario())
+
+
+def test_held_overflow_stops_catch_up(make_client, monkeypatch):
+    monkeypatch.setenv('CATCHUP_MAX_HELD_MESSAGES', '2')
+
+    async def scenario():
+        client = make_client(missed=range(1, 100), missed_delay=0.01)
+        await client.catch_up()
+        await asyncio.sleep(0.015)
+        await client._dispatch_message(None, live(200))
+        await client._dispatch_message(None, live(201))
+        await asyncio.wait_for(client.catchup_task, 1)
+        assert ('missed', 99) not in client.copied
+        assert client.copied[-2:] == [('live', 200), ('live', 201)]
+
+    asyncio.run(scenario())
+
+
+def test_catch_up_time_limit_releases_hold(make_client, monkeypatch):
+    monkeypatch.setenv('CATCHUP_MAX_SECONDS', '0.05')
+
+    async def scenario():
+        client = make_client(missed=range(1, 100), missed_delay=0.01)
+        await client.catch_up()
+        await client._dispatch_message(None, live(200))
+        await asyncio.wait_for(client.catchup_task, 1)
+        assert client.copied[-1] == ('live', 200)
+        assert client.held_messages is None
+
+    asyncio.run(scenario())
+
+
+def test_restore_active_configs_releases_hold_when_restore_fails(make_client):
+    from bot.core import TelegramBot
+
+    async def scenario():
+        client = make_client()
+
+        async def start_copying(config):
+            raise RuntimeError('peer not found')
+
+        def update_config_status(*args):
+            raise OSError('database is locked')
+
+        client.start_copying = start_copying
+        bot = SimpleNamespace(
+            db=SimpleNamespace(get_user_configs=lambda user_id: [{'id': 1}],
+                               update_config_status=update_config_status),
+            user_clients={1: client}
+        )
+        await TelegramBot.restore_active_configs(bot, 1)
+        await client._dispatch_message(None, live(1))
+        await client.catchup_task
+        assert client.held_messages is None
+        assert ('live', 1) in client.copied
+
+    asyncio.run(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bot.messages.rate_limiter import RateLimiter
+from bot.utils.config_registry import config_registry
+
+TARGET = -100
+
+
+class FakeBot:
+    """Bot API giả: ghi lại (method, nội dung) theo thứ tự gửi"""
+
+    def __init__(self):
+        self.sent = []
+        self.ids = itertools.count(1)
+
+    def __getattr__(self, method_name):
+        async def send(chat_id, **kwargs):
+            self.sent.append((method_name, kwargs.get('text') or method_name, time.monotonic()))
+            return SimpleNamespace(message_id=next(self.ids))
+        return send
+
+
+@pytest.fixture
+def bot_processor(monkeypatch, make_processor):
+    monkeypatch.setenv('COPY_DELAY_SECONDS', '0.1')
+    monkeypatch.setenv('MESSAGE_MAP_ENABLED', 'False')
+    monkeypatch.setattr(config_registry, 'configs', {
+        1: {'id': 1, 'user_id': 7, 'is_active': True, 'send_mode': 'bot'}
+    })
+    processor = make_processor()
+    processor.bot_instance.bot_instance = FakeBot()
+    processor.bot_instance.user_clients = {}
+    return processor
+
+
+def queued(message):
+    return {'config_id': 1, 'user_id': 7, 'source_channel_id': -200, 'target_channel_id': TARGET,
+            'message': message}
+
+
+async def drain(processor):
+    while processor.deferred_tasks:
+        await asyncio.gather(*processor.deferred_tasks)
+
+
+def test_forward_fallback_defers_each_part_instead_of_waiting(bot_processor):
+    parts = [{'message_id': message_id, 'text': f'part {message_id}'} for message_id in (1, 2, 3)]
+
+    async def scenario():
+        started = time.monotonic()
+        await bot_processor.dispatch_message(queued({'message_id': 1, 'forward_messages': parts}))
+        # Worker trả về ngay sau phần đầu, không ngủ COPY_DELAY_SECONDS giữa các phần
+        assert time.monotonic() - started < 0.05
+        assert [text for _, text, _ in bot_processor.bot_instance.bot_instance.sent] == ['part 1']
+        assert TARGET in bot_processor.deferred_messages
+        await drain(bot_processor)
+
+    asyncio.run(scenario())
+    sent = bot_processor.bot_instance.bot_instance.sent
+    assert [text for _, text, _ in sent] == ['part 1', 'part 2', 'part 3']
+    assert all(later[2] - earlier[2] >= 0.09 for earlier, later in zip(sent, sent[1:]))
+    assert bot_processor.progress.get(1) == 3
+    assert bot_processor.db.count_dead_letters(7) == 0
+
+
+def test_sticker_text_is_sent_as_deferred_follow_up(bot_processor):
+    sticker = {'message_id': 5, 'text': 'xin chào', 'sticker': {'file_id': 'st', 'file_unique_id': 'u'}}
+
+    async def scenario():
+        await bot_processor.dispatch_message(queued(sticker))
+        assert [method for method, _, _ in bot_processor.bot_instance.bot_instance.sent] == ['send_sticker']
+        await drain(bot_processor)
+
+    asyncio.run(scenario())
+    assert [(method, text) for method, text, _ in bot_processor.bot_instance.bot_instance.sent] == [
+        ('send_sticker', 'send_sticker'), ('send_message', 'xin chào')
+    ]
+    assert bot_processor.progress.get(1) == 5
+
+
+def test_follow_ups_do_not_count_as_flood_retries(bot_processor, monkeypatch):
+    monkeypatch.setattr(bot_processor, 'max_flood_retries', 0)
+    parts = [{'message_id': message_id, 'text': f'part {message_id}'} for message_id in (1, 2, 3)]
+
+    async def scenario():
+        await bot_processor.dispatch_message(queued({'message_id': 1, 'forward_messages': parts}))
+        await drain(bot_processor)
+
+    asyncio.run(scenario())
+    assert len(bot_processor.bot_instance.bot_instance.sent) == 3
+    assert bot_processor.db.count_dead_letters(7) == 0
+
+
+def test_per_chat_bucket_defaults_to_20_per_minute(monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT_MESSAGES', raising=False)
+    monkeypatch.delenv('RATE_LIMIT_PERIOD', raising=False)
+    limiter = RateLimiter()
+    assert (limiter.chat_messages, limiter.chat_period) == (20, 60.0)
@@ -0,0 +1,71 @@
+import asyncio
+
+from bot.messages.lanes import LaneQueue, parse_lane_weights
+
+
+def item(target, message_id, **message):
+    return {'config_id': target, 'target_channel_id': target, 'message': dict({'message_id': message_id}, **message)}
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def ids(items):
+    return [entry and entry['message']['message_id'] for entry in items]
+
+
+def test_shutdown_sentinel_is_served_after_every_lane():
+    async def scenario():
+        queue = LaneQueue()
+        await queue.put(item(1, 1, video={'file_id': 'v'}))
+        await queue.put(None)
+        await queue.put(item(2, 2))
+        await queue.put({**item(3, 3), 'backfill': {'config_id': 3}})
+        await queue.put(item(4, 4, photo={'file_id': 'p'}))
+        return drain(queue)
+
+    assert ids(asyncio.run(scenario()))[-1] is None
+
+
+def test_text_lane_is_weighted_ahead_of_heavy_media():
+    async def scenario():
+        queue = LaneQueue(weights=parse_lane_weights('text:2,heavy:1'))
+        for message_id in range(3):
+            await queue.put(item(10 + message_id, message_id, video={'file_id': 'v'}))
+        for message_id in range(3, 7):
+            await queue.put(item(20 + message_id, message_id))
+        return drain(queue)
+
+    assert ids(asyncio.run(scenario())) == [3, 0, 4, 5, 1, 6, 2]  # Smooth WRR: text, heavy, text
+
+
+def test_same_target_keeps_order_across_lanes():
+    async def scenario():
+        queue = LaneQueue()
+        await queue.put(item(1, 1, video={'file_id': 'v'}))
+        await queue.put(item(1, 2))
+        await queue.put(item(2, 3))
+        return drain(queue)
+
+    order = ids(asyncio.run(scenario()))
+    assert order.index(1) < order.index(2)
+
+
+def test_pop_oldest_matching_only_takes_matching_items():
+    async def scenario():
+        queue = LaneQueue(maxsize=3)
+        await queue.put(item(1, 1))
+        await queue.put(item(2, 2, photo={'file_id': 'p'}))
+        await queue.put(item(2, 3))
+        oldest = queue.pop_oldest_matching_nowait(lambda entry: entry['config_id'] == 2)
+        missing = queue.pop_oldest_matching_nowait(lambda entry: entry['config_id'] == 9)
+        return oldest, missing, drain(queue)
+
+    oldest, missing, rest = asyncio.run(scenario())
+    assert oldest['message']['message_id'] == 2
+    assert missing is None
+    assert ids(rest) == [1, 3]
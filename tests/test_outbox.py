@@ -0,0 +1,97 @@
+import asyncio
+import sqlite3
+
+from bot.messages.outbox import MessageOutbox
+
+
+def rows(db):
+    conn = sqlite3.connect(db.db_path)
+    try:
+        return conn.execute('SELECT id, payload FROM message_outbox ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_enqueue_before_start_does_not_overwrite_unsent_rows(db):
+    async def first_run():
+        outbox = MessageOutbox(db.db_path)
+        outbox.start()
+        outbox.enqueue({'text': 'old-1'})
+        outbox.enqueue({'text': 'old-2'})
+        await outbox.close()
+
+    async def second_run():
+        outbox = MessageOutbox(db.db_path)
+        # Message live đến trước khi outbox start (trước đây lấy id 1 và ghi đè row cũ)
+        early = outbox.enqueue({'text': 'early'})
+        replayed = outbox.start()
+        await outbox.flush()
+        return outbox, early, replayed
+
+    asyncio.run(first_run())
+
+    async def scenario():
+        outbox, early, replayed = await second_run()
+        assert [message['text'] for message in replayed] == ['old-1', 'old-2']
+        assert early not in {message['outbox_id'] for message in replayed}
+        assert len(rows(db)) == 3
+
+        # Ack một handle chỉ xóa đúng row của nó
+        outbox.ack(replayed[0]['outbox_id'])
+        await outbox.flush()
+        assert [payload for _, payload in rows(db)] == ['{"text": "old-2"}', '{"text": "early"}']
+        await outbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_ack_before_flush_never_touches_disk(db):
+    async def scenario():
+        outbox = MessageOutbox(db.db_path)
+        outbox.start()
+        handle = outbox.enqueue({'text': 'fast'})
+        outbox.ack(handle)
+        await outbox.flush()
+        assert rows(db) == []
+        await outbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_ack_during_flush_deletes_row_on_next_flush(db):
+    async def scenario():
+        outbox = MessageOutbox(db.db_path)
+        outbox.start()
+        handle = outbox.enqueue({'text': 'slow'})
+        flushing = asyncio.ensure_future(outbox.flush())
+        await asyncio.sleep(0)
+        outbox.ack(handle)  # Insert của handle đang được ghi
+        await flushing
+        assert len(rows(db)) == 1
+        await outbox.flush()
+        assert rows(db) == []
+        await outbox.close()
+
+    asyncio.run(scenario())
+
+
+def test_replay_preserves_order_across_restarts(db):
+    async def run(texts):
+        outbox = MessageOutbox(db.db_path)
+        replayed = outbox.start()
+        for text in texts:
+            outbox.enqueue({'text': text})
+        await outbox.close()
+        return [message['text'] for message in replayed]
+
+    assert asyncio.run(run(['a', 'b'])) == []
+    assert asyncio.run(run(['c'])) == ['a', 'b']
+    assert asyncio.run(run([])) == ['a', 'b', 'c']
+
+
+def test_enqueue_before_start_with_full_batch_does_not_raise(db, monkeypatch):
+    monkeypatch.setenv('OUTBOX_BATCH_SIZE', '1')
+    outbox = MessageOutbox(db.db_path)
+    outbox.enqueue({'text': 'x'})
+    outbox.enqueue({'text': 'y'})
+    assert outbox.backlog() == 2
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.utils.config_registry import config_registry
+
+
+@pytest.fixture
+def policies(monkeypatch):
+    """Config 1 dùng block, config 2 dùng drop_oldest, config 3 drop_by_age, config 4 degrade"""
+    monkeypatch.setattr(config_registry, 'configs', {
+        1: {'id': 1, 'overflow_policy': 'block'},
+        2: {'id': 2, 'overflow_policy': 'drop_oldest'},
+        3: {'id': 3, 'overflow_policy': 'drop_by_age'},
+        4: {'id': 4, 'overflow_policy': 'degrade'},
+    })
+
+
+@pytest.fixture
+def small_queue(monkeypatch, policies, make_processor):
+    monkeypatch.setenv('MESSAGE_WORKERS', '1')
+    monkeypatch.setenv('MESSAGE_QUEUE_MAXSIZE', '2')
+    monkeypatch.setenv('QUEUE_MESSAGE_TTL', '60')
+    return make_processor()
+
+
+def message(config_id, message_id, **fields):
+    return dict({'config_id': config_id, 'target_channel_id': -100 - config_id,
+                 'message': {'message_id': message_id, 'text': f'm{message_id}'}}, **fields)
+
+
+def queued(processor):
+    return [(item['config_id'], item['message']['message_id']) for item in processor.shard_queues[0]._queue]
+
+
+def test_drop_oldest_only_evicts_own_config(small_queue):
+    async def scenario():
+        await small_queue.add_message_to_queue(message(1, 1))
+        await small_queue.add_message_to_queue(message(2, 2))
+        await small_queue.add_message_to_queue(message(2, 3))
+        assert queued(small_queue) == [(1, 1), (2, 3)]
+        assert small_queue.get_shed_stats() == {2: {'dropped_oldest': 1}}
+
+    asyncio.run(scenario())
+
+
+def test_drop_oldest_blocks_when_config_has_nothing_queued(small_queue):
+    async def scenario():
+        await small_queue.add_message_to_queue(message(1, 1))
+        await small_queue.add_message_to_queue(message(1, 2))
+        producer = asyncio.ensure_future(small_queue.add_message_to_queue(message(2, 3)))
+        await asyncio.sleep(0.01)
+        assert not producer.done()
+        assert queued(small_queue) == [(1, 1), (1, 2)]
+
+        assert (await small_queue.shard_queues[0].get())['config_id'] == 1
+        await asyncio.wait_for(producer, 1)
+        assert queued(small_queue) == [(1, 2), (2, 3)]
+        assert small_queue.get_shed_stats() == {}
+
+    asyncio.run(scenario())
+
+
+def test_block_waits_for_space(small_queue):
+    async def scenario():
+        await small_queue.add_message_to_queue(message(1, 1))
+        await small_queue.add_message_to_queue(message(1, 2))
+        producer = asyncio.ensure_future(small_queue.add_message_to_queue(message(1, 3)))
+        await asyncio.sleep(0.01)
+        assert not producer.done()
+        await small_queue.shard_queues[0].get()
+        await asyncio.wait_for(producer, 1)
+        assert queued(small_queue) == [(1, 2), (1, 3)]
+
+    asyncio.run(scenario())
+
+
+def test_drop_by_age_sheds_expired_messages(small_queue):
+    assert small_queue.admit_message(message(3, 1, enqueued_at=time.time()))
+    assert not small_queue.admit_message(message(3, 2, enqueued_at=time.time() - 120))
+    assert small_queue.get_shed_stats() == {3: {'expired': 1}}
+
+
+def test_degrade_keeps_only_text_of_late_media(small_queue):
+    late = message(4, 1, enqueued_at=time.time() - 120)
+    late['message'] = {'message_id': 1, 'caption': 'caption', 'photo': {'file_id': 'x'}}
+    assert small_queue.admit_message(late)
+    assert late['degraded'] is True
+    assert late['message']['text'] == 'caption' and 'photo' not in late['message']
+
+    empty = message(4, 2, enqueued_at=time.time() - 120)
+    empty['message'] = {'message_id': 2, 'photo': {'file_id': 'y'}}
+    assert not small_queue.admit_message(empty)
+    assert small_queue.get_shed_stats() == {4: {'degraded': 1, 'degraded_empty': 1}}
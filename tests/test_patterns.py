@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+from bot.messages.patterns import PatternMatcher, PatternTimeout, validate_pattern
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def matcher(monkeypatch):
+    monkeypatch.setenv('PATTERN_TIMEOUT_SECONDS', '0.5')
+    matcher = PatternMatcher()
+    yield matcher
+    matcher.shutdown()
+
+
+def test_findall_returns_matches(matcher):
+    assert run(matcher.findall(r'\d+', 'a 12 b 34')) == ['12', '34']
+
+
+def test_invalid_pattern_raises_before_worker(matcher):
+    with pytest.raises(Exception):
+        run(matcher.findall('(', 'text'))
+    assert not matcher.workers
+
+
+def test_validate_pattern_rejects_nested_quantifier():
+    assert validate_pattern(r'(a+)+$')
+    assert validate_pattern(r'(\d+) USD') is None
+
+
+@pytest.mark.parametrize('pattern', [r'(a|aa)+b', r'(a|a)*b', r'(a+)+$'])
+def test_backtracking_pattern_times_out_without_blocking_loop(matcher, pattern):
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.05)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        try:
+            with pytest.raises(PatternTimeout):
+                await matcher.findall(pattern, 'a' * 40 + '!')
+        finally:
+            task.cancel()
+        return time.monotonic() - started, ticks
+
+    elapsed, ticks = run(scenario())
+    # Thời gian khởi động process không tính vào budget, nhưng event loop vẫn phải chạy trong lúc chờ
+    assert elapsed < 5
+    assert ticks >= 5
+    assert matcher.timeouts == 1
+
+
+def test_timeout_only_kills_the_slow_pattern(matcher):
+    async def scenario():
+        slow = asyncio.create_task(matcher.findall(r'(a|aa)+b', 'a' * 40))
+        fast = await matcher.findall(r'\w+', 'hello world')
+        with pytest.raises(PatternTimeout):
+            await slow
+        return fast, await matcher.findall(r'\w+', 'again')
+
+    fast, after = run(scenario())
+    assert fast == ['hello', 'world']
+    assert after == ['again']
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from bot.messages.progress import ProgressTracker
+
+
+def test_flush_writes_off_the_event_loop(db, monkeypatch):
+    threads = []
+    save = db.save_config_progress
+
+    def recording_save(progress):
+        threads.append(threading.current_thread())
+        save(progress)
+
+    monkeypatch.setattr(db, 'save_config_progress', recording_save)
+
+    async def scenario():
+        tracker = ProgressTracker(db)
+        tracker.start()
+        tracker.mark(1, 10)
+        tracker.mark(1, 5)  # Không lùi tiến độ
+        tracker.mark(2, 3)
+        await tracker.close()
+
+    asyncio.run(scenario())
+    assert threads and threading.main_thread() not in threads
+    assert db.get_config_progress() == {1: 10, 2: 3}
+
+
+def test_failed_flush_is_retried(db, monkeypatch):
+    calls = []
+    save = db.save_config_progress
+
+    def flaky_save(progress):
+        calls.append(dict(progress))
+        if len(calls) == 1:
+            raise OSError('database is locked')
+        save(progress)
+
+    monkeypatch.setattr(db, 'save_config_progress', flaky_save)
+
+    async def scenario():
+        tracker = ProgressTracker(db)
+        tracker.mark(1, 10)
+        try:
+            await tracker.flush()
+        except OSError:
+            pass
+        tracker.mark(2, 4)
+        await tracker.flush()
+
+    asyncio.run(scenario())
+    assert calls[-1] == {1: 10, 2: 4}
+    assert db.get_config_progress() == {1: 10, 2: 4}
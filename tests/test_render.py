@@ -0,0 +1,64 @@
+import pytest
+
+from bot.messages.render import RenderPlan, TEMPLATE_MAX_WIDTH, compile_template, validate_template
+
+MESSAGE = {'source_title': 'News_Daily', 'date': '2024-03-05T08:30:00'}
+
+
+def render(header='', footer='', content='body', entities=None, message=MESSAGE):
+    plan = RenderPlan({'id': 1, 'header_text': header, 'footer_text': footer})
+    return plan.render(content, message, entities)
+
+
+def test_render_fields_with_specs():
+    text, entities = render(header='{source_title:>12} {date:%d/%m/%Y}', footer='🕒 {date:%H:%M}',
+                            message=dict(MESSAGE, source_title='Daily News'))
+    assert text == '  Daily News 05/03/2024\n\nbody\n\n🕒 08:30'
+    assert entities == []
+
+
+def test_render_markdown_header_shifts_content_entities():
+    text, entities = render(header='*Tin* từ {source_title}', content='hello',
+                            entities=[{'type': 'bold', 'offset': 0, 'length': 5}])
+    assert text == 'Tin từ News_Daily\n\nhello'
+    assert entities[0] == {'type': 'bold', 'offset': 0, 'length': 3}
+    assert entities[-1] == {'type': 'bold', 'offset': len('Tin từ News_Daily\n\n'), 'length': 5}
+
+
+def test_text_without_known_fields_is_literal():
+    assert compile_template('Giá {100k} {') is None
+    assert render(header='Giá {100k}')[0] == 'Giá {100k}\n\nbody'
+
+
+@pytest.mark.parametrize('text', [
+    'Không có biến',
+    '{source_title}',
+    '{source_title:^20}',
+    f'{{source_title:*<{TEMPLATE_MAX_WIDTH}}}',
+    '{source_title:.30}',
+    '{date:%d/%m/%Y %H:%M}',
+    '{date:%A, %B %d %%}',
+    'Giá {100k}',
+])
+def test_validate_template_accepts(text):
+    assert validate_template(text) is None
+
+
+@pytest.mark.parametrize('text', [
+    '{source_title:>10000000}',
+    f'{{source_title:>{TEMPLATE_MAX_WIDTH + 1}}}',
+    '{source_title:,}',
+    '{source_title:{date}}',
+    '{date:%10000000Y}',
+    '{date:%-d}',
+    '{date:' + '%Y' * 40 + '}',
+    'ok {date:%d} {source_title:x}',
+])
+def test_validate_template_rejects(text):
+    assert validate_template(text)
+
+
+def test_stored_template_with_bad_spec_renders_without_it():
+    # Config lưu trước khi có validate_template
+    assert compile_template('{source_title:>10000000}') == [('', 'source_title', '')]
+    assert render(header='{source_title:>10000000}')[0] == 'News_Daily\n\nbody'
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError
+
+from bot.messages import retry
+from bot.messages.rate_limiter import ChatParked
+from bot.messages.retry import RetryScheduler, classify_error
+
+
+@pytest.mark.parametrize('error, error_class', [
+    (BadRequest('Message caption is too long'), 'invalid'),
+    (Forbidden('bot was kicked'), 'permission'),
+    (NetworkError('connection reset'), 'network'),
+    (ChatParked(1, 5.0), 'flood'),
+    (ValueError('boom'), 'unknown'),
+])
+def test_classify_error(error, error_class):
+    assert classify_error(error) == error_class
+
+
+def make_scheduler():
+    resubmitted, dead = [], []
+
+    async def resubmit(message_data):
+        resubmitted.append(message_data)
+
+    def dead_letter(message_data, error_class, error):
+        dead.append((message_data, error_class))
+
+    return RetryScheduler(resubmit, dead_letter), resubmitted, dead
+
+
+def test_bad_request_goes_straight_to_dead_letter():
+    async def scenario():
+        scheduler, _, dead = make_scheduler()
+        message_data = {'config_id': 1}
+        assert scheduler.schedule(message_data, BadRequest('Entity bounds invalid')) is False
+        assert dead == [(message_data, 'invalid')]
+        assert scheduler.pending() == []
+
+    asyncio.run(scenario())
+
+
+def test_network_error_retries_until_attempts_run_out(monkeypatch):
+    monkeypatch.setenv('RETRY_NETWORK_ATTEMPTS', '2')
+    monkeypatch.setattr(retry, 'backoff_delay', lambda *args: 0.0)
+
+    async def scenario():
+        scheduler, resubmitted, dead = make_scheduler()
+        scheduler.start()
+        message_data = {'config_id': 1}
+        for attempt in (1, 2):
+            assert scheduler.schedule(message_data, NetworkError('timeout')) is True
+            assert message_data['retry_attempts'] == attempt
+            await asyncio.sleep(0.01)
+            assert resubmitted[-1] is message_data
+
+        assert scheduler.schedule(message_data, NetworkError('timeout')) is False
+        assert dead == [(message_data, 'network')]
+        assert scheduler.get_stats() == {'scheduled': 2, 'resubmitted': 2, 'dead_lettered': 1, 'pending': 0}
+        await scheduler.close()
+
+    asyncio.run(scenario())
+
+
+def test_retries_are_resubmitted_in_due_order():
+    async def scenario():
+        scheduler, resubmitted, _ = make_scheduler()
+        scheduler.start()
+        late, early = {'config_id': 1}, {'config_id': 2}
+        retry.heapq.heappush(scheduler.heap, (retry.time.monotonic() + 0.05, 0, late))
+        retry.heapq.heappush(scheduler.heap, (retry.time.monotonic() + 0.01, 1, early))
+        scheduler.wakeup.set()
+        await asyncio.sleep(0.1)
+        assert resubmitted == [early, late]
+        await scheduler.close()
+
+    asyncio.run(scenario())
+
+
+def message(config_id=1, **fields):
+    return dict({'config_id': config_id, 'user_id': 7, 'target_channel_id': -100,
+                 'message': {'message_id': 10, 'text': 'hi'}}, **fields)
+
+
+def test_dispatch_dead_letters_rejected_send(processor, db):
+    async def rejected(message_data):
+        raise BadRequest('Message caption is too long')
+
+    processor.handle_incoming_message = rejected
+    asyncio.run(processor.dispatch_message(message()))
+    assert db.count_dead_letters(7) == 1
+    assert processor.retry_scheduler.pending() == []
+
+
+def test_dispatch_schedules_network_error_for_retry(processor, db):
+    async def failing(message_data):
+        raise NetworkError('connection reset')
+
+    processor.handle_incoming_message = failing
+    message_data = message()
+    asyncio.run(processor.dispatch_message(message_data))
+    assert db.count_dead_letters(7) == 0
+    assert processor.retry_scheduler.pending() == [message_data]
+    assert message_data['retry_attempts'] == 1
+
+
+def test_send_processed_message_does_not_fall_back_to_plain_text(processor):
+    sent_plain = []
+
+    async def rejected(*args, **kwargs):
+        raise BadRequest("Can't parse entities")
+
+    async def send(method_name, chat_id, **kwargs):
+        sent_plain.append(method_name)
+
+    processor.bot_instance.bot_instance = object()
+    processor._relay_and_send = rejected
+    processor._send = send
+    with pytest.raises(BadRequest):
+        asyncio.run(processor.send_processed_message(-100, message(), 'hi'))
+    assert sent_plain == []